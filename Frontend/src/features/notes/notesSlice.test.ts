@@ -7,6 +7,7 @@ import notesReducer, {
   fetchAllNotes,
   fetchMyNotes,
   fetchNoteById,
+  MAX_NOTE_PAGES,
   normalizeNote,
   updateNote,
 } from './notesSlice'
@@ -200,6 +201,7 @@ describe('notes thunks', () => {
   it('fetchMyNotes fulfilled normalizes list', async () => {
     vi.mocked(fetch).mockResolvedValue({
       ok: true,
+      headers: new Headers(),
       json: async () => [{ id: '1', title: 'T', description: 'D', user: { id: '2', username: 5 } }],
     } as Response)
 
@@ -212,6 +214,39 @@ describe('notes thunks', () => {
     )
   })
 
+  it('fetchMyNotes follows X-Next-Cursor until the last page', async () => {
+    vi.mocked(fetch)
+      .mockResolvedValueOnce({
+        ok: true,
+        headers: new Headers({ 'X-Next-Cursor': 'next page' }),
+        json: async () => [{ id: 1, title: 'a', description: 'a', user_id: 1 }],
+      } as Response)
+      .mockResolvedValueOnce({
+        ok: true,
+        headers: new Headers(),
+        json: async () => [{ id: 2, title: 'b', description: 'b', user_id: 1 }],
+      } as Response)
+
+    const action = await fetchMyNotes({ token: 'token' })(dispatch, getState, undefined)
+    expect(action.type).toBe(fetchMyNotes.fulfilled.type)
+    expect((action.payload as Note[]).map((note) => note.id)).toEqual([1, 2])
+    expect(fetch).toHaveBeenCalledTimes(2)
+    expect(vi.mocked(fetch).mock.calls[1][0]).toContain('/api/note/me?cursor=next+page')
+  })
+
+  it('fetchMyNotes stops after MAX_NOTE_PAGES pages', async () => {
+    vi.mocked(fetch).mockImplementation(async () => ({
+      ok: true,
+      headers: new Headers({ 'X-Next-Cursor': 'next page' }),
+      json: async () => [{ id: 1, title: 'a', description: 'a', user_id: 1 }],
+    }) as Response)
+
+    const action = await fetchMyNotes({ token: 'token' })(dispatch, getState, undefined)
+    expect(action.type).toBe(fetchMyNotes.fulfilled.type)
+    expect(action.payload as Note[]).toHaveLength(MAX_NOTE_PAGES)
+    expect(fetch).toHaveBeenCalledTimes(MAX_NOTE_PAGES)
+  })
+
   it('fetchMyNotes rejected on non-ok response', async () => {
     vi.mocked(fetch).mockResolvedValue({ ok: false } as Response)
 
@@ -223,6 +258,7 @@ describe('notes thunks', () => {
   it('fetchAllNotes handles non-array payload', async () => {
     vi.mocked(fetch).mockResolvedValue({
       ok: true,
+      headers: new Headers(),
       json: async () => ({ data: 'not-array' }),
     } as Response)
 
@@ -53,39 +53,56 @@ function normalizeNote(raw: unknown): Note {
   }
 }
 
-export const fetchMyNotes = createAsyncThunk<Note[], WithToken, { rejectValue: string }>(
-  'notes/fetchMy',
-  async ({ token }, { rejectWithValue }) => {
-    const response = await fetch(`${API_BASE}/note/me`, {
+// Не больше MAX_NOTE_PAGES страниц за раз, чтобы большая коллекция не грузилась целиком
+export const MAX_NOTE_PAGES = 10
+
+// Списки заметок отдаются страницами: курсор следующей страницы приходит в заголовке X-Next-Cursor
+async function fetchAllPages(path: string, token: string): Promise<unknown[] | null> {
+  const items: unknown[] = []
+  let cursor: string | null = null
+  let pages = 0
+  do {
+    const query: string = cursor ? `?${new URLSearchParams({ cursor })}` : ''
+    const response = await fetch(`${API_BASE}${path}${query}`, {
       headers: {
         Authorization: `Bearer ${token}`,
       },
     })
 
     if (!response.ok) {
-      return rejectWithValue('Не удалось загрузить заметки')
+      return null
     }
 
     const data = (await response.json()) as unknown
-    return Array.isArray(data) ? data.map(normalizeNote) : []
+    if (!Array.isArray(data)) {
+      return items
+    }
+    items.push(...data)
+    cursor = response.headers.get('X-Next-Cursor')
+    pages += 1
+  } while (cursor && pages < MAX_NOTE_PAGES)
+  return items
+}
+
+export const fetchMyNotes = createAsyncThunk<Note[], WithToken, { rejectValue: string }>(
+  'notes/fetchMy',
+  async ({ token }, { rejectWithValue }) => {
+    const data = await fetchAllPages('/note/me', token)
+    if (data === null) {
+      return rejectWithValue('Не удалось загрузить заметки')
+    }
+    return data.map(normalizeNote)
   },
 )
 
 export const fetchAllNotes = createAsyncThunk<Note[], WithToken, { rejectValue: string }>(
   'notes/fetchAll',
   async ({ token }, { rejectWithValue }) => {
-    const response = await fetch(`${API_BASE}/note/`, {
-      headers: {
-        Authorization: `Bearer ${token}`,
-      },
-    })
-
-    if (!response.ok) {
+    const data = await fetchAllPages('/note/', token)
+    if (data === null) {
       return rejectWithValue('Не удалось загрузить все заметки')
     }
-
-    const data = (await response.json()) as unknown
-    return Array.isArray(data) ? data.map(normalizeNote) : []
+    return data.map(normalizeNote)
   },
 )
 
@@ -0,0 +1,162 @@
+import asyncio
+import time
+import typing as tp
+
+from pydantic import BaseModel
+
+from .lru import TTLCache
+from ..metrics.metrics import ENTITY_CACHE_HITS, ENTITY_CACHE_MISSES, ENTITY_CACHE_EVICTIONS
+
+Schema = tp.TypeVar("Schema", bound=BaseModel)
+
+
+def _entity(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+class MemoryBackend:
+    '''
+        Кэш в памяти процесса. Хранит сами схемы, без сериализации.
+        Инвалидация видна только этому процессу, на других репликах запись живет до истечения ttl
+    '''
+    serializes = False
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._entries = TTLCache(maxsize, ttl, on_evict=lambda key, value: ENTITY_CACHE_EVICTIONS.labels(_entity(key)).inc())
+
+    async def get(self, key: str) -> tp.Any:
+        return self._entries.get(key)
+
+    async def set(self, key: str, value: tp.Any, ttl: float):
+        self._entries.set(key, value, ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key)
+
+    async def close(self):
+        self._entries.clear()
+
+
+class RedisBackend:
+    '''
+        Общий для всех реплик кэш в Redis, значения хранятся в JSON.
+        client - объект с async get/set(ex=)/delete, в тестах подменяется заглушкой
+    '''
+    serializes = True
+
+    def __init__(self, client: tp.Any):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("ENTITY_CACHE_BACKEND=redis requires the redis package")
+        return cls(redis.from_url(url))
+
+    async def get(self, key: str) -> tp.Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(key, value, ex=max(1, int(ttl)))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*keys)
+
+    async def close(self):
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+
+
+class EntityCache:
+    '''
+        Read-through кэш сущностей по id ("note:1", "user:1") поверх MemoryBackend или RedisBackend.
+        Одновременные промахи по одному ключу ждут одну загрузку из БД (защита от stampede).
+        Ошибки бэкенда (недоступный Redis) не роняют запрос: чтение уходит в loader, запись и удаление пропускаются.
+        replica_lag - сколько секунд после инвалидации загрузка может прочитать старое значение с реплики
+    '''
+    def __init__(self, backend: tp.Union[MemoryBackend, RedisBackend], ttl: float, maxsize: int = 10000,
+                 replica_lag: float = 0):
+        self.backend = backend
+        self.ttl = ttl
+        self.replica_lag = replica_lag
+        self._inflight: dict[str, asyncio.Future] = {}
+        # ключ -> время последней инвалидации: загрузка, начатая раньше (или в пределах replica_lag после),
+        # не попадает в кэш
+        self._invalidated_at = TTLCache(maxsize, ttl + replica_lag)
+
+    @staticmethod
+    def key(entity: str, entity_id: tp.Any) -> str:
+        return f"{entity}:{entity_id}"
+
+    async def get_or_load(self, entity: str, entity_id: tp.Any, schema: tp.Type[Schema],
+                          loader: tp.Callable[[], tp.Awaitable[tp.Optional[Schema]]]) -> tp.Optional[Schema]:
+        key = self.key(entity, entity_id)
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            print(f"Entity cache get {key} failed: {e!r}")
+            value = None
+        if value is not None:
+            ENTITY_CACHE_HITS.labels(entity).inc()
+            return schema.model_validate_json(value) if self.backend.serializes else value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            ENTITY_CACHE_HITS.labels(entity).inc()
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # отменили запрос, который грузил значение, а не текущий - грузим сами
+                if not inflight.cancelled():
+                    raise
+                return await loader()
+
+        ENTITY_CACHE_MISSES.labels(entity).inc()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            loaded_at = time.monotonic()
+            value = await loader()
+            if value is not None and not self._is_stale(key, loaded_at):
+                await self._set(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # исключение получают ожидающие; если их нет, future не должен ругаться в лог
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def invalidate(self, entity: str, *entity_ids: tp.Any):
+        keys = [self.key(entity, entity_id) for entity_id in entity_ids]
+        now = time.monotonic()
+        for key in keys:
+            self._invalidated_at.set(key, now)
+        try:
+            await self.backend.delete(*keys)
+        except Exception as e:
+            # локальные метки уже стоят; на других репликах запись доживет до ttl
+            print(f"Entity cache invalidate {keys} failed: {e!r}")
+
+    async def close(self):
+        await self.backend.close()
+
+    async def _set(self, key: str, value: BaseModel):
+        try:
+            await self.backend.set(key, value.model_dump_json() if self.backend.serializes else value, self.ttl)
+        except Exception as e:
+            print(f"Entity cache set {key} failed: {e!r}")
+
+    def _is_stale(self, key: str, since: float) -> bool:
+        invalidated_at = self._invalidated_at.get(key)
+        return invalidated_at is not None and invalidated_at + self.replica_lag >= since
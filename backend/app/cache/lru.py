@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+import typing as tp
+
+
+class TTLCache:
+    '''
+        Ограниченный по размеру LRU-кэш, в котором каждая запись живет не дольше ttl секунд
+    '''
+    def __init__(self, maxsize: int, ttl: float, clock: tp.Callable[[], float] = time.monotonic,
+                 on_evict: tp.Optional[tp.Callable[[tp.Hashable, tp.Any], None]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        # вызывается при вытеснении записи по размеру (не по ttl)
+        self._on_evict = on_evict
+        self._data: "OrderedDict[tp.Hashable, tuple[tp.Any, float]]" = OrderedDict()
+
+    def get(self, key: tp.Hashable, default: tp.Any = None) -> tp.Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at <= self._clock():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: tp.Hashable, value: tp.Any, ttl: tp.Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (value, self._clock() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted_key, (evicted, _) = self._data.popitem(last=False)
+            if self._on_evict is not None:
+                self._on_evict(evicted_key, evicted)
+
+    def pop(self, key: tp.Hashable, default: tp.Any = None) -> tp.Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: tp.Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
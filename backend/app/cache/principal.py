@@ -0,0 +1,63 @@
+import time
+from datetime import datetime
+import typing as tp
+
+from .lru import TTLCache
+from ..entries.schemas import UserSchema
+from ..metrics.metrics import PRINCIPAL_CACHE_HITS, PRINCIPAL_CACHE_MISSES
+from settings import settings
+
+
+class PrincipalCache:
+    '''
+        Кэш аутентифицированных пользователей по access-токену.
+        Позволяет не ходить в БД за пользователем на каждый запрос.
+    '''
+    def __init__(self, maxsize: int, ttl: float, embed_claims: bool = False):
+        self.embed_claims = embed_claims
+        self._entries = TTLCache(maxsize, ttl)
+        # user_id -> время последнего изменения пользователя. Записи кэша и токены,
+        # полученные раньше этого момента, считаются устаревшими
+        self._invalidated_at = TTLCache(maxsize, settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+    def get(self, token: str, payload: dict) -> tp.Optional[UserSchema]:
+        entry = self._entries.get(token)
+        if entry is not None:
+            user, cached_at = entry
+            if not self._is_stale(user.id, cached_at):
+                PRINCIPAL_CACHE_HITS.inc()
+                return user
+            self._entries.pop(token)
+
+        user = self._from_claims(payload)
+        if user is not None:
+            PRINCIPAL_CACHE_HITS.inc()
+            return user
+
+        PRINCIPAL_CACHE_MISSES.inc()
+        return None
+
+    def set(self, token: str, user: UserSchema, loaded_at: tp.Optional[float] = None):
+        # loaded_at - момент до запроса в БД, чтобы инвалидация во время запроса не потерялась
+        self._entries.set(token, (user, time.time() if loaded_at is None else loaded_at))
+
+    def invalidate_user(self, user_id: int):
+        self._invalidated_at.set(user_id, time.time())
+
+    def clear(self):
+        self._entries.clear()
+        self._invalidated_at.clear()
+
+    def _is_stale(self, user_id: int, since: float) -> bool:
+        invalidated_at = self._invalidated_at.get(user_id)
+        return invalidated_at is not None and invalidated_at >= since
+
+    def _from_claims(self, payload: dict) -> tp.Optional[UserSchema]:
+        if not self.embed_claims:
+            return None
+        user_id, created_at, issued_at = payload.get("uid"), payload.get("created_at"), payload.get("iat")
+        if user_id is None or created_at is None or issued_at is None:
+            return None
+        if self._is_stale(user_id, issued_at):
+            return None
+        return UserSchema(id=user_id, username=payload["sub"], created_at=datetime.fromisoformat(created_at))
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import math
+from datetime import datetime, timezone
+import typing as tp
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from ..metrics.metrics import REVOCATION_FILTER_ENTRIES, REVOCATION_FILTER_BITS, \
+    REVOCATION_FILTER_FALSE_POSITIVE_RATE, REVOCATION_FALSE_POSITIVES
+from ..repository.refresh_token import RefreshTokenRepository
+from ..repository.revoked_token import RevokedTokenRepository
+
+# Отзыв всех токенов пользователя хранится в revoked_token вместо jti под ключом с этим префиксом
+SUBJECT_PREFIX = "sub:"
+
+
+def subject_key(subject: str) -> str:
+    '''
+        Ключ отзыва всех токенов с данным sub. Длина как у jti (32 символа), с jti не пересекается
+    '''
+    return SUBJECT_PREFIX + hashlib.sha256(subject.encode()).hexdigest()[:32 - len(SUBJECT_PREFIX)]
+
+
+class BloomFilter:
+    def __init__(self, size: int, hash_count: int):
+        self.size = size
+        self.hash_count = hash_count
+        self.count = 0
+        self._bits = bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, false_positive_rate: float) -> "BloomFilter":
+        capacity = max(1, capacity)
+        size = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        hash_count = max(1, round(size / capacity * math.log(2)))
+        return cls(size, hash_count)
+
+    def add(self, key: str):
+        for index in self._indexes(key):
+            self._bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(key))
+
+    @property
+    def false_positive_rate(self) -> float:
+        # оценка (1 - e^(-kn/m))^k
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+
+    def _indexes(self, key: str) -> tp.Iterator[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+
+class RevocationList:
+    '''
+        Отозванные токены (jti) в памяти процесса. Bloom-фильтр отсекает неотозванные токены,
+        точное множество убирает ложные срабатывания, так что проверка не ходит в БД.
+        Периодически перестраивается по таблице revoked_token, чтобы увидеть отзывы с других подов.
+        Кроме отдельных токенов хранит отзывы по пользователю (sub): отозваны его токены, истекающие не позже отметки
+    '''
+    def __init__(self, capacity: int, false_positive_rate: float, refresh_interval: float):
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.refresh_interval = refresh_interval
+        self._stop: tp.Optional[asyncio.Event] = None
+        # jti, отозванные этим процессом во время чтения из БД
+        self._added_during_refresh: tp.Optional[set] = None
+        self._subjects_added_during_refresh: tp.Optional[dict[str, float]] = None
+        self._subjects: dict[str, float] = {}
+        self.replace([])
+
+    def is_revoked(self, jti: str) -> bool:
+        if jti not in self._filter:
+            return False
+        if jti in self._revoked:
+            return True
+        REVOCATION_FALSE_POSITIVES.inc()
+        return False
+
+    def add(self, jti: str):
+        if jti not in self._revoked:
+            self._revoked.add(jti)
+            self._filter.add(jti)
+            self._update_metrics()
+        if self._added_during_refresh is not None:
+            self._added_during_refresh.add(jti)
+
+    def is_subject_revoked(self, subject: tp.Optional[str], expires_at: tp.Optional[float]) -> bool:
+        if not self._subjects or subject is None:
+            return False
+        revoked_until = self._subjects.get(subject_key(subject))
+        return revoked_until is not None and (expires_at is None or expires_at <= revoked_until)
+
+    def revoke_subject(self, subject: str, until: datetime):
+        '''
+            Отзывает токены пользователя с exp не позже until: выданные после отзыва истекают позже и принимаются
+        '''
+        self._add_subject(subject_key(subject), until.timestamp())
+
+    def _add_subject(self, key: str, until: float):
+        self._subjects[key] = max(until, self._subjects.get(key, until))
+        if self._subjects_added_during_refresh is not None:
+            self._subjects_added_during_refresh[key] = self._subjects[key]
+
+    def replace(self, jtis: tp.Iterable[str]):
+        revoked = set(jtis)
+        bloom = BloomFilter.for_capacity(max(self.capacity, len(revoked)), self.false_positive_rate)
+        for jti in revoked:
+            bloom.add(jti)
+        self._filter, self._revoked = bloom, revoked
+        self._update_metrics()
+
+    async def refresh(self, session_factory: async_sessionmaker):
+        self._added_during_refresh = set()
+        self._subjects_added_during_refresh = {}
+        try:
+            async with session_factory() as session:
+                repository = RevokedTokenRepository(session)
+                now = datetime.now(timezone.utc)
+                await repository.delete_expired(now)
+                # истекшие refresh-токены чистятся тем же периодическим циклом
+                await RefreshTokenRepository(session).delete_expired(now)
+                jtis = await repository.get_active(now)
+                subjects = await repository.get_active_subjects(now, SUBJECT_PREFIX)
+            self.replace(set(jtis) | self._added_during_refresh)
+            added_subjects, self._subjects_added_during_refresh = self._subjects_added_during_refresh, None
+            self._subjects = {}
+            for key, expires_at in subjects:
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                self._add_subject(key, expires_at.timestamp())
+            for key, until in added_subjects.items():
+                self._add_subject(key, until)
+        finally:
+            self._added_during_refresh = None
+            self._subjects_added_during_refresh = None
+
+    async def run(self, session_factory: async_sessionmaker):
+        self._stop = asyncio.Event()
+        while not self._stop.is_set():
+            try:
+                await self.refresh(session_factory)
+            except Exception as e:
+                print(f"Revocation list refresh failed: {e}")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    def _update_metrics(self):
+        REVOCATION_FILTER_ENTRIES.set(len(self._revoked))
+        REVOCATION_FILTER_BITS.set(self._filter.size)
+        REVOCATION_FILTER_FALSE_POSITIVE_RATE.set(self._filter.false_positive_rate)
@@ -0,0 +1,94 @@
+import asyncio
+from datetime import timedelta
+from functools import cached_property
+import typing as tp
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .cache.entity import EntityCache, MemoryBackend, RedisBackend
+from .cache.principal import PrincipalCache
+from .cache.revocation import RevocationList
+from .services.admission import LoginAdmission
+from .services.hashing import AsyncPasswordHash, Argon2Params
+from .services.token_codec import TokenCodec
+from settings import settings
+
+
+class Container:
+    '''
+        Объекты без состояния запроса: хеширование паролей, JWT, кэши.
+        Создаются один раз на приложение, в запросе создаются только сессия БД
+        и тонкие репозитории/сервисы поверх нее
+    '''
+    def __init__(self):
+        self._revocation_task: tp.Optional[asyncio.Task] = None
+
+    @cached_property
+    def password_hash(self) -> AsyncPasswordHash:
+        return AsyncPasswordHash(
+            executor=settings.PASSWORD_HASH_EXECUTOR,
+            workers=settings.PASSWORD_HASH_WORKERS,
+            params=Argon2Params(settings.ARGON2_TIME_COST, settings.ARGON2_MEMORY_COST, settings.ARGON2_PARALLELISM),
+        )
+
+    @cached_property
+    def login_admission(self) -> LoginAdmission:
+        return LoginAdmission(
+            max_concurrent=settings.LOGIN_MAX_CONCURRENT or self.password_hash.workers,
+            queue_depth=settings.LOGIN_QUEUE_DEPTH,
+            retry_after=settings.LOGIN_RETRY_AFTER_SECONDS,
+        )
+
+    @cached_property
+    def token_codec(self) -> TokenCodec:
+        return TokenCodec(
+            secret_key=settings.AUTH_SECRET_KEY,
+            algorithm=settings.AUTH_ALGORITHM,
+            access_token_ttl=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+        )
+
+    @cached_property
+    def principal_cache(self) -> PrincipalCache:
+        return PrincipalCache(
+            maxsize=settings.PRINCIPAL_CACHE_SIZE,
+            ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+            embed_claims=settings.AUTH_EMBED_USER_CLAIMS,
+        )
+
+    @cached_property
+    def entity_cache(self) -> tp.Optional[EntityCache]:
+        if settings.ENTITY_CACHE_BACKEND == "none":
+            return None
+        if settings.ENTITY_CACHE_BACKEND == "redis":
+            backend = RedisBackend.from_url(settings.ENTITY_CACHE_URL)
+        elif settings.ENTITY_CACHE_BACKEND == "memory":
+            # инвалидация видна только этому процессу: годится для одного воркера на одном поде
+            backend = MemoryBackend(settings.ENTITY_CACHE_SIZE, settings.ENTITY_CACHE_TTL_SECONDS)
+        else:
+            raise ValueError(f"Unknown entity cache backend: {settings.ENTITY_CACHE_BACKEND}")
+        # GET-запросы могут читать с реплики: сразу после записи она еще может отдать старую версию
+        replica_lag = settings.DB_REPLICA_MAX_LAG_SECONDS if settings.DB_REPLICA_URLS else 0
+        return EntityCache(backend, settings.ENTITY_CACHE_TTL_SECONDS, settings.ENTITY_CACHE_SIZE, replica_lag)
+
+    @cached_property
+    def revocation_list(self) -> RevocationList:
+        return RevocationList(
+            capacity=settings.REVOCATION_FILTER_CAPACITY,
+            false_positive_rate=settings.REVOCATION_FILTER_FP_RATE,
+            refresh_interval=settings.REVOCATION_REFRESH_SECONDS,
+        )
+
+    async def start(self, session_factory: async_sessionmaker):
+        self._revocation_task = asyncio.create_task(self.revocation_list.run(session_factory))
+
+    async def close(self):
+        if self._revocation_task is not None:
+            self.revocation_list.stop()
+            await asyncio.wait_for(self._revocation_task, timeout=5)
+            self._revocation_task = None
+        self.password_hash.shutdown()
+        if "entity_cache" in self.__dict__ and self.entity_cache is not None:
+            await self.entity_cache.close()
+
+
+container = Container()
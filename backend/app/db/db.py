@@ -1,48 +1,259 @@
 import asyncio
+import contextlib
+import itertools
+import math
+import random
+import time
+import typing as tp
+from functools import cached_property
 from typing import Any, AsyncGenerator
 
 from datetime import datetime
-from pwdlib import PasswordHash
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from fastapi import Request
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession, AsyncEngine
 
-from ..entries.models import BaseTable, UserTable
+from ..entries.models import UserTable
+from ..metrics.metrics import DB_SESSIONS, DB_REPLICA_HEALTHY, DB_REPLICA_LAG
+from .pool import create_engine
 from settings import settings
 
 
+# Методы, запросы которых можно обслужить репликой
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+# Cookie с моментом (unix time), до которого чтения клиента идут в основную БД. Отметка хранится у клиента,
+# поэтому read-your-writes работает, на какой бы воркер или под ни попал следующий запрос
+READ_YOUR_WRITES_COOKIE = "db_primary_until"
+
+# Отставание реплики Postgres. Если все полученное WAL уже применено, реплика не отстает,
+# даже когда последняя транзакция на основной БД была давно
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Replica:
+    '''
+        Реплика только для чтения. До первой успешной проверки запросы в нее не идут
+    '''
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.healthy = False
+        self.lag: tp.Optional[float] = None
+
+    @cached_property
+    def engine(self) -> AsyncEngine:
+        return create_engine(self.url, self.name)
+
+    @cached_property
+    def session_factory(self) -> async_sessionmaker:
+        return async_sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    async def check(self, max_lag: float, timeout: float) -> bool:
+        try:
+            lag = await asyncio.wait_for(self._lag(), timeout)
+        except Exception as e:
+            if self.healthy:
+                print(f"Replica {self.name} is unavailable: {e!r}")
+            self.lag = None
+            self._set_healthy(False)
+            return False
+        self.lag = lag
+        DB_REPLICA_LAG.labels(self.name).set(lag)
+        self._set_healthy(lag <= max_lag)
+        return self.healthy
+
+    async def _lag(self) -> float:
+        async with self.engine.connect() as conn:
+            if conn.dialect.name != "postgresql":
+                await conn.execute(text("SELECT 1"))
+                return 0.0
+            return float((await conn.execute(REPLICA_LAG_QUERY)).scalar_one())
+
+    def _set_healthy(self, healthy: bool):
+        self.healthy = healthy
+        DB_REPLICA_HEALTHY.labels(self.name).set(1 if healthy else 0)
+
+
 class Database:
-    def __init__(self):
-        self.url = settings.ASYNC_DB_URL
-        self.engine = create_async_engine(url=self.url, echo=False)
-        self.session_factory = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+    '''
+        Основная БД и необязательные реплики для чтения (DB_REPLICA_URLS).
+        get_session отдает сессию реплики запросам GET/HEAD/OPTIONS, остальным - основной БД.
+        Клиент, который недавно писал (cookie от ReadYourWritesMiddleware), читает из основной БД.
+        Движки создаются при первом обращении, а не при импорте модуля
+    '''
+    def __init__(self, url: tp.Optional[str] = None, replica_urls: tp.Optional[tp.Sequence[str]] = None):
+        self.url = url or settings.ASYNC_DB_URL
+        replica_urls = settings.DB_REPLICA_URLS if replica_urls is None else replica_urls
+        self.replicas = [Replica(f"replica-{index}", replica_url) for index, replica_url in enumerate(replica_urls)]
+        self._next_replica = itertools.count()
+        self._monitor_task: tp.Optional[asyncio.Task] = None
 
-    async def get_session(self) -> AsyncGenerator[AsyncSession, Any]:
-        async with self.session_factory() as session:
+    @cached_property
+    def engine(self) -> AsyncEngine:
+        return create_engine(self.url)
+
+    @cached_property
+    def session_factory(self) -> async_sessionmaker:
+        return async_sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    async def get_session(self, request: Request = None) -> AsyncGenerator[AsyncSession, Any]:
+        session_factory = self.session_factory
+        if self.replicas and request is not None and request.method in READ_METHODS \
+                and not self._wrote_recently(request):
+            session_factory = self.replica_session_factory() or session_factory
+
+        DB_SESSIONS.labels("primary" if session_factory is self.session_factory else "replica").inc()
+        async with session_factory() as session:
             yield session
 
-    async def init_tables(self):
+    def replica_session_factory(self) -> tp.Optional[async_sessionmaker]:
+        '''
+            Следующая по кругу исправная реплика или None, если таких нет
+        '''
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next_replica) % len(healthy)].session_factory
+
+    @staticmethod
+    def _wrote_recently(request: Request) -> bool:
         try:
-            async with self.engine.begin() as conn:
-                await conn.run_sync(BaseTable.metadata.create_all)
-
-            async with self.session_factory() as session:
-                query = select(UserTable.id).limit(1)
-                result = await session.execute(query)
-                user = result.one_or_none()
-                if not user:
-                    admin_user = UserTable(
-                        username="admin",
-                        password=PasswordHash.recommended().hash("admin"),
-                        created_at=datetime.now(),
-                    )
-                    session.add(admin_user)
+            return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    async def check_replicas(self):
+        await asyncio.gather(*(
+            replica.check(settings.DB_REPLICA_MAX_LAG_SECONDS, settings.DB_REPLICA_CHECK_SECONDS)
+            for replica in self.replicas
+        ))
+
+    async def monitor_replicas(self):
+        while True:
+            await asyncio.sleep(settings.DB_REPLICA_CHECK_SECONDS)
+            await self.check_replicas()
+
+    async def start(self):
+        if not self.replicas:
+            return
+        await self.check_replicas()
+        self._monitor_task = asyncio.create_task(self.monitor_replicas())
+
+    async def stop(self):
+        '''
+            Останавливает проверку реплик и закрывает соединения всех пулов
+        '''
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+            self._monitor_task = None
+        for replica in self.replicas:
+            if "engine" in replica.__dict__:
+                await replica.engine.dispose()
+        if "engine" in self.__dict__:
+            await self.engine.dispose()
+
+    async def wait_until_available(self, timeout: tp.Optional[float] = None) -> int:
+        '''
+            Проверяет основную БД (SELECT 1) с экспоненциальной задержкой между попытками.
+            Возвращает число неудачных попыток; если БД не ответила до дедлайна - пробрасывает последнюю ошибку
+        '''
+        timeout = settings.DB_STARTUP_TIMEOUT_SECONDS if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        delay = settings.DB_STARTUP_BACKOFF_SECONDS
+        failures = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._ping(), max(deadline - time.monotonic(), 0.1))
+                return failures
+            except Exception as e:
+                failures += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+                print(f"Database is not available yet ({e!r}), retrying in {delay:.1f}s")
+                # разброс, чтобы поды после рестарта БД не приходили одновременно
+                await asyncio.sleep(min(delay * random.uniform(0.5, 1), remaining))
+                delay = min(delay * 2, settings.DB_STARTUP_BACKOFF_MAX_SECONDS)
+
+    async def _ping(self):
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def prewarm(self, connections: tp.Optional[int] = None):
+        '''
+            Открывает connections соединений основного пула одновременно, чтобы первые запросы их не ждали
+        '''
+        connections = settings.DB_POOL_PREWARM if connections is None else connections
+        async with contextlib.AsyncExitStack() as stack:
+            for _ in range(connections):
+                conn = await stack.enter_async_context(self.engine.connect())
+                await conn.execute(text("SELECT 1"))
+
+    async def init_tables(self):
+        '''
+            Применяет миграции и создает admin:admin в пустой БД. Ошибки пробрасываются:
+            без схемы приложение не должно становиться ready
+        '''
+        from ..container import container
+
+        if settings.DB_MIGRATE_ON_STARTUP:
+            # модуль миграций (и argparse для его CLI) нужен только здесь
+            from .migrations import Migrator
+            await Migrator(self.engine).upgrade()
+
+        async with self.session_factory() as session:
+            query = select(UserTable.id).limit(1)
+            result = await session.execute(query)
+            user = result.one_or_none()
+            if not user:
+                admin_user = UserTable(
+                    username="admin",
+                    password=await container.password_hash.hash("admin"),
+                    created_at=datetime.now(),
+                )
+                session.add(admin_user)
+                try:
                     await session.commit()
-            print("Schema initialized successfully!")
-        except Exception as e:
-            print(e)
+                except IntegrityError:
+                    # admin уже создан другим воркером, стартовавшим одновременно
+                    await session.rollback()
+        print("Schema initialized successfully!")
+
+
+class ReadYourWritesMiddleware:
+    '''
+        ASGI-middleware: на ответ на запрос с записью (не GET/HEAD/OPTIONS) ставит cookie, по которой
+        чтения того же клиента DB_READ_YOUR_WRITES_SECONDS секунд идут в основную БД. Без реплик ничего не делает
+    '''
+    def __init__(self, app: tp.Any, database: Database):
+        self.app = app
+        self.database = database
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in READ_METHODS or not self.database.replicas:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                window = settings.DB_READ_YOUR_WRITES_SECONDS
+                cookie = f"{READ_YOUR_WRITES_COOKIE}={time.time() + window:.3f}; Max-Age={math.ceil(window)}; " \
+                         "Path=/; HttpOnly; SameSite=Lax"
+                message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
 
 
 db = Database()
 
 if __name__ == "__main__":
-    asyncio.run(db.init_tables())
\ No newline at end of file
+    asyncio.run(db.init_tables())
@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+from datetime import datetime
+import typing as tp
+
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, select, insert, text, func
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from ..entries.models import BaseTable, note_search_vector_sql
+from settings import settings
+
+
+schema_metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    schema_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+# Произвольный ключ pg_advisory_lock, чтобы реплики не накатывали миграции одновременно
+MIGRATION_LOCK_KEY = 7_130_410_011
+
+
+class Migration(tp.NamedTuple):
+    version: int
+    description: str
+    upgrade: tp.Callable[[AsyncConnection], tp.Awaitable[None]]
+    # False - выполняется вне транзакции (CREATE INDEX CONCURRENTLY на Postgres)
+    transactional: bool = True
+
+
+async def create_index(conn: AsyncConnection, name: str, table: str, columns: str, unique: bool = False,
+                       using: tp.Optional[str] = None):
+    '''
+        CREATE INDEX IF NOT EXISTS; на Postgres - CONCURRENTLY, без блокировки записи в таблицу.
+        Невалидный индекс от прерванного CONCURRENTLY удаляется и строится заново
+    '''
+    unique_sql = "UNIQUE " if unique else ""
+    using_sql = f"USING {using} " if using else ""
+    if conn.dialect.name == "postgresql":
+        result = await conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name})
+        if result.first() is not None:
+            await conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+        await conn.execute(text(f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" {using_sql}({columns})'))
+    else:
+        await conn.execute(text(f'CREATE {unique_sql}INDEX IF NOT EXISTS "{name}" ON "{table}" ({columns})'))
+
+
+async def _initial(conn: AsyncConnection):
+    # Таблицы, уже созданные прежним create_all, не трогаются
+    await conn.run_sync(BaseTable.metadata.create_all)
+
+
+async def _note_user_indexes(conn: AsyncConnection):
+    await create_index(conn, "ix_user_username", "user", "username", unique=True)
+    await create_index(conn, "ix_note_user_id_created_at_id", "note", "user_id, created_at DESC, id DESC")
+    await create_index(conn, "ix_note_created_at_id", "note", "created_at DESC, id DESC")
+
+
+async def _note_search(conn: AsyncConnection):
+    '''
+        SQLite: FTS5-таблица note_fts поверх note, синхронизируется триггерами.
+        Postgres: ничего, поиск идет по индексу выражения из миграции 4 без хранимой колонки
+    '''
+    if conn.dialect.name == "postgresql":
+        return
+    await conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(title, description, content='note', content_rowid='id')"
+    ))
+    await conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS note_fts_ai AFTER INSERT ON note BEGIN "
+        "INSERT INTO note_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+    ))
+    await conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS note_fts_ad AFTER DELETE ON note BEGIN "
+        "INSERT INTO note_fts(note_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END"
+    ))
+    await conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS note_fts_au AFTER UPDATE ON note BEGIN "
+        "INSERT INTO note_fts(note_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+        "INSERT INTO note_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+    ))
+    await conn.execute(text("INSERT INTO note_fts(note_fts) VALUES ('rebuild')"))
+
+
+async def _note_search_index(conn: AsyncConnection):
+    '''
+        GIN-индекс по выражению tsvector (CONCURRENTLY): в отличие от хранимой колонки не переписывает
+        таблицу note и не блокирует чтение и запись на время построения
+    '''
+    if conn.dialect.name == "postgresql":
+        await create_index(conn, "ix_note_search_vector", "note",
+                           f"({note_search_vector_sql(settings.NOTE_SEARCH_CONFIG)})", using="gin")
+
+async def _user_username_pattern_index(conn: AsyncConnection):
+    '''
+        Индекс для LIKE 'prefix%' по username: при сортировке не "C" обычный btree для LIKE не используется.
+        В SQLite LIKE без учета регистра и не использует индексы, индекс не нужен
+    '''
+    if conn.dialect.name == "postgresql":
+        await create_index(conn, "ix_user_username_pattern", "user", "username text_pattern_ops")
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "initial schema", _initial),
+    Migration(2, "note listing and username indexes", _note_user_indexes, transactional=False),
+    Migration(3, "note full-text search (SQLite FTS5)", _note_search),
+    Migration(4, "note full-text search index", _note_search_index, transactional=False),
+    Migration(5, "username prefix search index", _user_username_pattern_index, transactional=False),
+]
+
+
+class Migrator:
+    '''
+        Версионные миграции схемы. Текущая версия хранится в таблице schema_version;
+        если она актуальна, upgrade ограничивается одним SELECT
+    '''
+    def __init__(self, engine: AsyncEngine, migrations: tp.Sequence[Migration] = MIGRATIONS):
+        self.engine = engine
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+
+    @property
+    def head(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    async def current_version(self) -> int:
+        async with self.engine.connect() as conn:
+            return await self._current_version(conn)
+
+    @staticmethod
+    async def _current_version(conn: AsyncConnection) -> int:
+        exists = await conn.run_sync(lambda sync_conn: sync_conn.dialect.has_table(sync_conn, schema_version.name))
+        if not exists:
+            return 0
+        result = await conn.execute(select(func.max(schema_version.c.version)))
+        return result.scalar() or 0
+
+    async def pending(self, target: tp.Optional[int] = None) -> list[Migration]:
+        return self._pending(await self.current_version(), target)
+
+    def _pending(self, current: int, target: tp.Optional[int]) -> list[Migration]:
+        target = self.head if target is None else target
+        return [migration for migration in self.migrations if current < migration.version <= target]
+
+    async def upgrade(self, target: tp.Optional[int] = None) -> list[int]:
+        '''
+            Применяет недостающие миграции до target (по умолчанию до последней), возвращает их версии
+        '''
+        if not await self.pending(target):
+            return []
+
+        async with self.engine.connect() as lock_conn:
+            postgres = lock_conn.dialect.name == "postgresql"
+            if postgres:
+                lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+                await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                return await self._apply(target)
+            finally:
+                if postgres:
+                    await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+    async def _apply(self, target: tp.Optional[int]) -> list[int]:
+        async with self.engine.begin() as conn:
+            await conn.run_sync(schema_metadata.create_all)
+            current = await self._current_version(conn)
+
+        applied = []
+        for migration in self._pending(current, target):
+            if migration.transactional:
+                async with self.engine.begin() as conn:
+                    await migration.upgrade(conn)
+                    await self._record(conn, migration)
+            else:
+                async with self.engine.connect() as conn:
+                    conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                    await migration.upgrade(conn)
+                    await self._record(conn, migration)
+            applied.append(migration.version)
+            print(f"Applied migration {migration.version}: {migration.description}")
+        return applied
+
+    @staticmethod
+    async def _record(conn: AsyncConnection, migration: Migration):
+        await conn.execute(insert(schema_version).values(
+            version=migration.version, description=migration.description, applied_at=datetime.now(),
+        ))
+
+
+async def main(argv: tp.Optional[tp.Sequence[str]] = None):
+    from .db import db
+
+    parser = argparse.ArgumentParser(prog="python -m app.db.migrations", description="Миграции схемы БД")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    upgrade_parser = subparsers.add_parser("upgrade", help="применить миграции")
+    upgrade_parser.add_argument("--target", type=int, default=None)
+    subparsers.add_parser("current", help="текущая версия схемы")
+    subparsers.add_parser("history", help="список миграций")
+    args = parser.parse_args(argv)
+
+    migrator = Migrator(db.engine)
+    try:
+        if args.command == "upgrade":
+            applied = await migrator.upgrade(args.target)
+            print(f"Schema is at version {await migrator.current_version()} (applied: {applied or 'none'})")
+        elif args.command == "current":
+            print(f"{await migrator.current_version()} (head: {migrator.head})")
+        else:
+            current = await migrator.current_version()
+            for migration in migrator.migrations:
+                mark = "x" if migration.version <= current else " "
+                print(f"[{mark}] {migration.version}: {migration.description}")
+    finally:
+        await db.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+import time
+import typing as tp
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from ..metrics.metrics import DB_POOL_CHECKED_OUT, DB_POOL_IDLE, DB_POOL_OVERFLOW, DB_POOL_CHECKOUT_SECONDS, \
+    DB_POOL_TIMEOUTS
+from settings import settings
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    '''
+        Пул, который измеряет ожидание соединения и обновляет метрики занятых, простаивающих
+        и overflow-соединений при каждой выдаче и возврате. Метка метрик - pool_logging_name движка,
+        она сохраняется при пересоздании пула в engine.dispose()
+    '''
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.labels(self.logging_name).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.labels(self.logging_name).observe(time.perf_counter() - started)
+            self.update_metrics()
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self.update_metrics()
+
+    def dispose(self):
+        super().dispose()
+        self.update_metrics()
+
+    def update_metrics(self):
+        DB_POOL_CHECKED_OUT.labels(self.logging_name).set(self.checkedout())
+        DB_POOL_IDLE.labels(self.logging_name).set(self.checkedin())
+        DB_POOL_OVERFLOW.labels(self.logging_name).set(max(self.overflow(), 0))
+
+
+def engine_options(url: str, name: str) -> dict[str, tp.Any]:
+    '''
+        Параметры пула из настроек. SQLite в памяти (тесты) работает на одном соединении без пула
+    '''
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    options: dict[str, tp.Any] = {
+        "poolclass": InstrumentedPool,
+        "pool_logging_name": name,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if parsed.get_driver_name() == "asyncpg":
+        # 0 - для pgbouncer в режиме transaction, где подготовленные выражения не переживают транзакцию
+        options["connect_args"] = {"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+def create_engine(url: str, name: str = "primary") -> AsyncEngine:
+    return create_async_engine(url=url, echo=False, **engine_options(url, name))
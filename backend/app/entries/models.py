@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import List
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary, Boolean, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, relationship
 
 
@@ -18,6 +18,10 @@ class UserTable(BaseTable):
 
     notes: Mapped[List["NotesTable"]] = relationship(back_populates="user", cascade="all, delete")
 
+    __table_args__ = (
+        Index("ix_user_username", "username", unique=True),
+    )
+
 class NotesTable(BaseTable):
     __tablename__ = "note"
 
@@ -29,3 +33,35 @@ class NotesTable(BaseTable):
     updated_at: Mapped[datetime] = Column(DateTime(timezone=True))
 
     user: Mapped["UserTable"] = relationship(back_populates="notes")
+
+# Индексы дублируются в миграциях (app/db/migrations.py): здесь они нужны для create_all на чистой БД
+Index("ix_note_user_id_created_at_id", NotesTable.user_id, NotesTable.created_at.desc(), NotesTable.id.desc())
+Index("ix_note_created_at_id", NotesTable.created_at.desc(), NotesTable.id.desc())
+
+
+def note_search_vector_sql(config: str) -> str:
+    '''
+        tsvector заметки для полнотекстового поиска в Postgres: title с весом A, description - B.
+        Одно и то же выражение в GIN-индексе ix_note_search_vector и в запросе, иначе индекс не используется
+    '''
+    return (
+        f"setweight(to_tsvector('{config}'::regconfig, coalesce(title, '')), 'A') || "
+        f"setweight(to_tsvector('{config}'::regconfig, coalesce(description, '')), 'B')"
+    )
+
+class RefreshTokenTable(BaseTable):
+    __tablename__ = "refresh_token"
+
+    id: Mapped[int] = Column(Integer, primary_key=True, autoincrement=True)
+    # sha256 от токена, сам токен не хранится
+    token_hash: Mapped[bytes] = Column(LargeBinary(32), unique=True, nullable=False)
+    family_id: Mapped[bytes] = Column(LargeBinary(16), index=True, nullable=False)
+    user_id: Mapped[int] = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    expires_at: Mapped[datetime] = Column(DateTime(timezone=True), nullable=False)
+    used: Mapped[bool] = Column(Boolean, default=False, nullable=False)
+
+class RevokedTokenTable(BaseTable):
+    __tablename__ = "revoked_token"
+
+    jti: Mapped[str] = Column(String(32), primary_key=True)
+    expires_at: Mapped[datetime] = Column(DateTime(timezone=True), nullable=False)
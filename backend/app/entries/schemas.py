@@ -1,16 +1,40 @@
 from datetime import datetime
 
+from fastapi import Form
 from fastapi.security import OAuth2PasswordBearer
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 import typing as tp
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+
+class TokenRequestForm:
+    '''
+        Форма /token: grant_type=password (username, password) или grant_type=refresh_token (refresh_token)
+    '''
+    def __init__(
+        self,
+        grant_type: tp.Annotated[str, Form(pattern="^(password|refresh_token)$")] = "password",
+        username: tp.Annotated[tp.Optional[str], Form()] = None,
+        password: tp.Annotated[tp.Optional[str], Form(json_schema_extra={"format": "password"})] = None,
+        refresh_token: tp.Annotated[tp.Optional[str], Form()] = None,
+        scope: tp.Annotated[str, Form()] = "",
+    ):
+        self.grant_type = grant_type
+        self.username = username
+        self.password = password
+        self.refresh_token = refresh_token
+        self.scopes = scope.split()
+
 class UserSchema(BaseModel):
     id: int
     username: str
     created_at: datetime
 
+class UserPageSchema(BaseModel):
+    items: list[UserSchema]
+    next_cursor: tp.Optional[str] = None
+
 class CreateUserInputSchema(BaseModel):
     username: str
     password: str
@@ -39,6 +63,38 @@ class NoteSchema(BaseModel):
     created_at: datetime
     updated_at: tp.Optional[datetime] = None
 
+class NotePageSchema(BaseModel):
+    items: list[NoteSchema]
+    next_cursor: tp.Optional[str] = None
+    total_estimate: tp.Optional[int] = None
+
+class CompactNoteSchema(BaseModel):
+    id: int
+    title: str
+    description: tp.Optional[str] = None
+    user_id: int
+    created_at: datetime
+    updated_at: tp.Optional[datetime] = None
+
+class CompactNotePageSchema(BaseModel):
+    '''
+        Компактный список (?format=compact): у заметок только user_id, пользователи передаются один раз в users
+    '''
+    items: list[CompactNoteSchema]
+    users: dict[int, UserSchema]
+    next_cursor: tp.Optional[str] = None
+    total_estimate: tp.Optional[int] = None
+
+class NoteSearchResultSchema(NoteSchema):
+    rank: float
+    # фрагмент текста с совпадениями в <mark></mark>, сам текст заметки не экранируется
+    snippet: tp.Optional[str] = None
+
+class NoteSearchPageSchema(BaseModel):
+    items: list[NoteSearchResultSchema]
+    next_cursor: tp.Optional[str] = None
+    total_estimate: tp.Optional[int] = None
+
 class CreateNoteInputSchema(BaseModel):
     title: str
     description: tp.Optional[str] = None
@@ -49,10 +105,40 @@ class CreateNoteSchema(BaseModel):
     user_id: int
     created_at: datetime
 
+class BulkNoteResultSchema(BaseModel):
+    index: int
+    id: tp.Optional[int] = None
+    errors: tp.Optional[list[dict]] = None
+
+class BulkCreateNoteResultSchema(BaseModel):
+    created: int
+    results: list[BulkNoteResultSchema]
+
 class UpdateNoteSchema(BaseModel):
     title: tp.Optional[str] = None
     description: tp.Optional[str] = None
 
+class BulkNoteFilterSchema(BaseModel):
+    '''
+        Выбор заметок для массовой операции: список id и/или интервал created_at [since, until)
+    '''
+    ids: tp.Optional[list[int]] = None
+    since: tp.Optional[datetime] = None
+    until: tp.Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def check_not_empty(self):
+        if self.ids is None and self.since is None and self.until is None:
+            raise ValueError("ids, since or until is required")
+        return self
+
+class BulkUpdateNoteSchema(BulkNoteFilterSchema):
+    update: UpdateNoteSchema
+
+class BulkNoteChangeResultSchema(BaseModel):
+    affected: list[int]
+    rejected: list[int]
+
 
 
 
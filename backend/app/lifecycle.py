@@ -0,0 +1,18 @@
+class Lifecycle:
+    '''
+        Состояние процесса для readiness-пробы Kubernetes: ready после прогрева БД.
+        Остановку обслуживает uvicorn: после SIGTERM он перестает принимать соединения и ждет
+        запросы в обработке до timeout_graceful_shutdown, и только затем выполняет shutdown lifespan.
+        Из Endpoints под убирается за время preStop, до SIGTERM
+    '''
+    def __init__(self):
+        self.ready = False
+
+    def mark_ready(self):
+        self.ready = True
+
+    def mark_stopped(self):
+        self.ready = False
+
+
+lifecycle = Lifecycle()
@@ -1,13 +1,15 @@
-import asyncio
+import os
 from contextlib import asynccontextmanager
 
-import uvicorn
 from fastapi import FastAPI, APIRouter
 from starlette.middleware.cors import CORSMiddleware
 
 from settings import settings
 from .metrics.middleware import setup_metrics_middleware
-from .db.db import db
+from .container import container
+from .db.db import db, ReadYourWritesMiddleware
+from .lifecycle import lifecycle
+from .routers.health import router as health_router
 from .routers.notes import router as notes_router
 from .routers.user import router as user_router
 from .routers.token import router as token_router
@@ -16,14 +18,25 @@ from .routers.metrics import router as metrics_router
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Application starting up...")
-    print("Waiting 10 seconds for db up...")
-    await asyncio.sleep(10)
-    print("init db schema...")
+    failures = await db.wait_until_available()
+    print(f"Database is available (after {failures} failed attempts), init db schema...")
     await db.init_tables()
+    await db.prewarm()
+    await db.start()
+    await container.start(db.session_factory)
+    lifecycle.mark_ready()
 
     yield
 
+    # uvicorn уже закрыл прием соединений и дождался запросов в обработке (timeout_graceful_shutdown)
     print("Application shutting down...")
+    lifecycle.mark_stopped()
+    await container.close()
+    await db.stop()
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        # gauge-метрики live* этого воркера больше не учитываются
+        multiprocess.mark_process_dead(os.getpid())
 
 app = FastAPI(lifespan=lifespan, docs_url="/api/docs")
 api_router = APIRouter()
@@ -36,15 +49,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Estimate"],
 )
+app.add_middleware(ReadYourWritesMiddleware, database=db)
 
 api_router.include_router(token_router)
 api_router.include_router(notes_router)
 api_router.include_router(user_router)
 api_router.include_router(metrics_router)
+api_router.include_router(health_router)
 
 app.include_router(api_router, prefix="/api")
 
 
 if __name__ == "__main__": # pragma: no cover
-    uvicorn.run(app, host=settings.HOST_IP, port=8000)
+    import uvicorn
+
+    uvicorn.run(app, host=settings.HOST_IP, port=8000, timeout_graceful_shutdown=int(settings.SHUTDOWN_DRAIN_SECONDS))
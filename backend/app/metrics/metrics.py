@@ -1,5 +1,8 @@
 from prometheus_client import Counter, Histogram, Gauge
 
+# Метрики процесса. В многопроцессном режиме (app.serve, PROMETHEUS_MULTIPROC_DIR) значения пишутся в файлы
+# и суммируются по воркерам при сборе; multiprocess_mode у Gauge задает, как их объединять
+
 REQUESTS = Counter(
     'http_requests_total',
     'Total count of HTTP requests',
@@ -15,11 +18,134 @@ REQUEST_DURATION = Histogram(
 
 ACTIVE_REQUESTS = Gauge(
     'http_requests_active',
-    'Number of active HTTP requests'
+    'Number of active HTTP requests',
+    multiprocess_mode='livesum'
 )
 
 ERRORS = Counter(
     'http_errors_total',
     'Total count of HTTP errors',
     ['method', 'endpoint', 'error_type']
-)
\ No newline at end of file
+)
+
+METRICS_LABEL_OVERFLOW = Counter(
+    'metrics_label_overflow_total',
+    'Total count of observations recorded in the overflow series because a metric reached its label set limit',
+    ['metric']
+)
+
+PRINCIPAL_CACHE_HITS = Counter(
+    'principal_cache_hits_total',
+    'Total count of authenticated requests resolved without a database lookup'
+)
+
+PRINCIPAL_CACHE_MISSES = Counter(
+    'principal_cache_misses_total',
+    'Total count of authenticated requests that had to load the user from the database'
+)
+
+ENTITY_CACHE_HITS = Counter(
+    'entity_cache_hits_total',
+    'Total count of entity lookups served from the cache or a concurrent load',
+    ['entity']
+)
+
+ENTITY_CACHE_MISSES = Counter(
+    'entity_cache_misses_total',
+    'Total count of entity lookups that loaded from the database',
+    ['entity']
+)
+
+ENTITY_CACHE_EVICTIONS = Counter(
+    'entity_cache_evictions_total',
+    'Total count of entity cache entries evicted by the size bound',
+    ['entity']
+)
+
+LOGIN_ADMISSION_PENDING = Gauge(
+    'login_admission_pending',
+    'Number of login attempts verifying or waiting for a password verification slot',
+    multiprocess_mode='livesum'
+)
+
+LOGIN_ADMISSION_REJECTED = Counter(
+    'login_admission_rejected_total',
+    'Total count of login attempts rejected with 503 because the admission queue was full'
+)
+
+REVOCATION_FILTER_ENTRIES = Gauge(
+    'revocation_filter_entries',
+    'Number of revoked token ids held in the in-process revocation filter',
+    multiprocess_mode='livemax'
+)
+
+REVOCATION_FILTER_BITS = Gauge(
+    'revocation_filter_bits',
+    'Size of the revocation Bloom filter in bits',
+    multiprocess_mode='livemax'
+)
+
+REVOCATION_FILTER_FALSE_POSITIVE_RATE = Gauge(
+    'revocation_filter_false_positive_rate',
+    'Estimated false-positive rate of the revocation Bloom filter',
+    multiprocess_mode='livemax'
+)
+
+REVOCATION_FALSE_POSITIVES = Counter(
+    'revocation_filter_false_positives_total',
+    'Total count of Bloom filter hits that were not revoked tokens'
+)
+
+DB_SESSIONS = Counter(
+    'db_sessions_total',
+    'Total count of request database sessions by target (primary or replica)',
+    ['target']
+)
+
+DB_REPLICA_HEALTHY = Gauge(
+    'db_replica_healthy',
+    'Whether a read replica currently receives reads (1) or is excluded as unhealthy or lagging (0)',
+    ['replica'],
+    multiprocess_mode='livemin'
+)
+
+DB_REPLICA_LAG = Gauge(
+    'db_replica_lag_seconds',
+    'Replication lag of a read replica at the last health check',
+    ['replica'],
+    multiprocess_mode='livemax'
+)
+
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out_connections',
+    'Number of database connections currently checked out of the pool',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_IDLE = Gauge(
+    'db_pool_idle_connections',
+    'Number of idle database connections held in the pool',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_OVERFLOW = Gauge(
+    'db_pool_overflow_connections',
+    'Number of database connections opened above the pool size',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    'db_pool_checkout_seconds',
+    'Time spent waiting for a database connection from the pool',
+    ['pool'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts_total',
+    'Total count of connection checkouts that timed out waiting for the pool',
+    ['pool']
+)
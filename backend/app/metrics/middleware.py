@@ -1,59 +1,102 @@
 import time
-from typing import Callable
-from fastapi import Request, Response
-from .metrics import REQUESTS, REQUEST_DURATION, ACTIVE_REQUESTS, ERRORS
+import typing as tp
 
+from .metrics import REQUESTS, REQUEST_DURATION, ACTIVE_REQUESTS, ERRORS, METRICS_LABEL_OVERFLOW
+from settings import settings
 
-class PrometheusMiddleware:
+# Метка endpoint для запросов, не совпавших ни с одним маршрутом (404 от сканеров и т.п.)
+UNMATCHED_ENDPOINT = "unmatched"
+# Метки серии, куда попадают наблюдения сверх METRICS_MAX_LABEL_SETS
+OVERFLOW_LABEL = "overflow"
+KNOWN_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
 
-    async def __call__(self, request: Request, call_next: Callable) -> Response:
-        method = request.method
-        endpoint = request.url.path
 
-        # Увеличиваем счетчик активных запросов
-        ACTIVE_REQUESTS.inc()
+class LabelledChildren:
+    '''
+        Кэш дочерних метрик .labels() с ограничением числа наборов меток.
+        Сверх limit наблюдения пишутся в одну серию overflow, а metrics_label_overflow_total растет
+    '''
+    def __init__(self, metric: tp.Any, name: str, limit: int):
+        self.metric = metric
+        self.name = name
+        self.limit = limit
+        self._children: dict[tuple, tp.Any] = {}
+        self._overflow = None
 
-        # Замеряем время выполнения
-        start_time = time.time()
+    def get(self, *labels: tp.Any) -> tp.Any:
+        child = self._children.get(labels)
+        if child is not None:
+            return child
+        if len(self._children) >= self.limit:
+            METRICS_LABEL_OVERFLOW.labels(self.name).inc()
+            if self._overflow is None:
+                self._overflow = self.metric.labels(*(OVERFLOW_LABEL for _ in labels))
+            return self._overflow
+        child = self._children[labels] = self.metric.labels(*labels)
+        return child
 
-        try:
-            response = await call_next(request)
+    def __len__(self) -> int:
+        return len(self._children)
+
+
+class PrometheusMiddleware:
+    '''
+        ASGI-middleware метрик HTTP. Статус берется из сообщения http.response.start,
+        поэтому тело ответа (в том числе StreamingResponse) проходит без буферизации и лишних задач.
+        Длительность - до отправки последнего байта ответа.
+        endpoint - шаблон маршрута (/api/note/{id}), а не путь запроса, чтобы число серий не росло с числом id
+    '''
+    def __init__(self, app: tp.Any, max_label_sets: tp.Optional[int] = None):
+        self.app = app
+        limit = settings.METRICS_MAX_LABEL_SETS if max_label_sets is None else max_label_sets
+        self._requests = LabelledChildren(REQUESTS, "http_requests_total", limit)
+        self._durations = LabelledChildren(REQUEST_DURATION, "http_request_duration_seconds", limit)
+        self._errors = LabelledChildren(ERRORS, "http_errors_total", limit)
 
-            # Обновляем метрики после выполнения запроса
-            status_code = response.status_code
-            REQUESTS.labels(method=method, endpoint=endpoint, status=status_code).inc()
-            REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(
-                time.time() - start_time
-            )
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-            # Логируем ошибки
-            if status_code >= 400:
-                ERRORS.labels(
-                    method=method,
-                    endpoint=endpoint,
-                    error_type=f"http_{status_code}"
-                ).inc()
+        method = scope["method"] if scope["method"] in KNOWN_METHODS else "OTHER"
+        # если приложение упало до начала ответа, клиент получит 500
+        status_code = 500
 
-            return response
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
 
+        error_type = None
+        ACTIVE_REQUESTS.inc()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
         except Exception as e:
-            # Обработка исключений
-            status_code = 500
-            REQUESTS.labels(method=method, endpoint=endpoint, status=status_code).inc()
-            REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(
-                time.time() - start_time
-            )
-            ERRORS.labels(
-                method=method,
-                endpoint=endpoint,
-                error_type=type(e).__name__
-            ).inc()
+            error_type = type(e).__name__
             raise
-
         finally:
+            duration = time.perf_counter() - start_time
             ACTIVE_REQUESTS.dec()
+            self._observe(method, self._endpoint(scope), status_code, duration, error_type)
+
+    @staticmethod
+    def _endpoint(scope) -> str:
+        # роутер записывает совпавший маршрут в тот же scope
+        route = scope.get("route")
+        return getattr(route, "path_format", None) or UNMATCHED_ENDPOINT
+
+    def _observe(self, method: str, endpoint: str, status_code: int, duration: float, error_type: tp.Optional[str]):
+        self._requests.get(method, endpoint, status_code).inc()
+        self._durations.get(method, endpoint).observe(duration)
+
+        if error_type is None and status_code >= 400:
+            error_type = f"http_{status_code}"
+        if error_type is not None:
+            self._errors.get(method, endpoint, error_type).inc()
 
 
 def setup_metrics_middleware(app):
-    app.middleware("http")(PrometheusMiddleware())
-    return app
\ No newline at end of file
+    app.add_middleware(PrometheusMiddleware)
+    return app
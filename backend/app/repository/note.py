@@ -1,29 +1,225 @@
+import json
+import re
 from datetime import datetime
+import typing as tp
 
 from fastapi import Depends
-from sqlalchemy import select, delete, update
+from sqlalchemy import select, delete, update, insert, func, or_, text, tuple_, literal_column, bindparam, table, column
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload, joinedload
 
-from ..entries.models import NotesTable
+from ..cache.entity import EntityCache
+from ..container import container
+from ..entries.models import NotesTable, UserTable, note_search_vector_sql
 from ..db.db import db
-from ..entries.schemas import CreateNoteSchema, UpdateNoteSchema
+from settings import settings
+from ..entries.schemas import CreateNoteSchema, UpdateNoteSchema, NoteSchema
 
 
 class NoteRepository:
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, entity_cache: tp.Optional[EntityCache] = None):
         self.session: AsyncSession = session
+        self.entity_cache = entity_cache
 
     async def get_all(self):
         query = select(NotesTable).options(selectinload(NotesTable.user))
         result = await self.session.execute(query)
         return result.scalars().all()
 
-    async def get_by_id(self, note_id: int) -> NotesTable:
+    async def get_page(self, limit: int, after: tp.Optional[tuple[datetime, int]] = None,
+                       user_id: tp.Optional[int] = None, load_user: bool = True) -> list[NotesTable]:
+        '''
+            Keyset-пагинация по (created_at, id) от новых к старым.
+            load_user=False - без запроса пользователей, обращаться к note.user нельзя
+        '''
+        query = select(NotesTable) \
+            .order_by(NotesTable.created_at.desc(), NotesTable.id.desc()) \
+            .limit(limit)
+        if load_user:
+            query = query.options(selectinload(NotesTable.user))
+        if user_id is not None:
+            query = query.where(NotesTable.user_id == user_id)
+        if after is not None:
+            query = query.where(tuple_(NotesTable.created_at, NotesTable.id) < tuple_(*after))
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    async def get_users(self, user_ids: tp.Iterable[int]) -> list[UserTable]:
+        '''
+            Авторы заметок для компактного списка, каждый один раз
+        '''
+        user_ids = set(user_ids)
+        if not user_ids:
+            return []
+        result = await self.session.execute(select(UserTable).where(UserTable.id.in_(user_ids)))
+        return list(result.scalars())
+
+    async def estimate_count(self, user_id: tp.Optional[int] = None) -> tp.Optional[int]:
+        '''
+            Примерное количество заметок. В Postgres берется из статистики планировщика без COUNT(*),
+            в остальных СУБД (sqlite в тестах) считается точно
+        '''
+        query = select(func.count()).select_from(NotesTable)
+        if user_id is not None:
+            query = query.where(NotesTable.user_id == user_id)
+        if self.session.bind.dialect.name != "postgresql":
+            result = await self.session.execute(query)
+            return result.scalar_one()
+
+        if user_id is None:
+            result = await self.session.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'note'::regclass")
+            )
+            estimate = result.scalar_one_or_none()
+            return estimate if estimate is not None and estimate >= 0 else None
+        compiled = query.compile(dialect=self.session.bind.dialect, compile_kwargs={"literal_binds": True})
+        result = await self.session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}"))
+        plan = result.scalar_one()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        # план агрегата: строки берем у узла сканирования под ним
+        node = plan[0]["Plan"]
+        while node.get("Plans"):
+            node = node["Plans"][0]
+        return int(node["Plan Rows"])
+
+    async def search(self, user_id: int, search_query: str, limit: int,
+                     after: tp.Optional[tuple[float, int]] = None) -> list[tuple[NotesTable, float, tp.Optional[str]]]:
+        '''
+            Полнотекстовый поиск по заметкам пользователя с keyset-пагинацией по (rank, id) от лучших к худшим.
+            Postgres - GIN-индекс по выражению tsvector, SQLite - FTS5-таблица note_fts (см. миграции)
+        '''
+        if self.session.bind.dialect.name == "postgresql":
+            config = literal_column(f"'{settings.NOTE_SEARCH_CONFIG}'::regconfig")
+            ts_query = func.websearch_to_tsquery(config, bindparam("search_query", search_query))
+            search_vector = literal_column(f"({note_search_vector_sql(settings.NOTE_SEARCH_CONFIG)})")
+            match = search_vector.op("@@")(ts_query)
+            rank = func.ts_rank_cd(search_vector, ts_query)
+            snippet = func.ts_headline(
+                config, func.concat_ws(" ", NotesTable.title, NotesTable.description), ts_query,
+                "StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5",
+            )
+            query = select(NotesTable, rank, snippet)
+        else:
+            # во FTS5 у MATCH свой синтаксис: ищем все слова запроса как фразы
+            terms = re.findall(r"\w+", search_query)
+            if not terms:
+                return []
+            fts = literal_column("note_fts")
+            match = fts.op("MATCH")(bindparam("search_query", " ".join(f'"{term}"' for term in terms)))
+            rank = -func.bm25(fts, 10.0, 1.0)
+            snippet = func.snippet(fts, -1, "<mark>", "</mark>", "…", 16)
+            fts_table = table("note_fts", column("rowid"))
+            query = select(NotesTable, rank, snippet).join(fts_table, fts_table.c.rowid == NotesTable.id)
+
+        query = query.options(selectinload(NotesTable.user)) \
+            .where(NotesTable.user_id == user_id, match) \
+            .order_by(rank.desc(), NotesTable.id.desc()) \
+            .limit(limit)
+        if after is not None:
+            query = query.where(tuple_(rank, NotesTable.id) < tuple_(*after))
+        result = await self.session.execute(query)
+        return [tuple(row) for row in result.all()]
+
+    async def stream(self, batch_size: int, user_id: tp.Optional[int] = None, since: tp.Optional[datetime] = None,
+                     until: tp.Optional[datetime] = None) -> tp.AsyncIterator[list[dict]]:
+        '''
+            Выгрузка заметок серверным курсором пачками по batch_size строк.
+            Читаются только колонки (без ORM-объектов), пользователь подтягивается join-ом
+        '''
+        query = select(
+            NotesTable.id, NotesTable.title, NotesTable.description, NotesTable.created_at, NotesTable.updated_at,
+            UserTable.id.label("user_id"), UserTable.username, UserTable.created_at.label("user_created_at"),
+        ).join(UserTable, UserTable.id == NotesTable.user_id).order_by(NotesTable.id) \
+            .execution_options(yield_per=batch_size)
+        if user_id is not None:
+            query = query.where(NotesTable.user_id == user_id)
+        if since is not None:
+            query = query.where(NotesTable.created_at >= since)
+        if until is not None:
+            query = query.where(NotesTable.created_at < until)
+        result = await self.session.stream(query)
+        async for partition in result.mappings().partitions():
+            yield partition
+
+    async def get_by_id(self, note_id: int) -> tp.Union[NotesTable, NoteSchema, None]:
+        '''
+            С кэшем возвращает NoteSchema, без него - модель NotesTable
+        '''
+        if self.entity_cache is not None:
+            return await self.entity_cache.get_or_load("note", note_id, NoteSchema, lambda: self._load(note_id))
         query = select(NotesTable).where(NotesTable.id == note_id).options(selectinload(NotesTable.user))
         result = await self.session.execute(query)
         return result.scalar_one_or_none()
 
+    async def _load(self, note_id: int) -> tp.Optional[NoteSchema]:
+        query = select(NotesTable).where(NotesTable.id == note_id).options(selectinload(NotesTable.user))
+        result = await self.session.execute(query)
+        note_model = result.scalar_one_or_none()
+        return NoteSchema.model_validate(note_model, from_attributes=True) if note_model else None
+
+    async def _invalidate(self, *note_ids: int):
+        if self.entity_cache is not None and note_ids:
+            await self.entity_cache.invalidate("note", *note_ids)
+
+    async def get_version(self, note_id: int) -> tp.Optional[tuple[int, datetime]]:
+        '''
+            (user_id, версия) заметки без загрузки всей строки; версия - updated_at или created_at
+        '''
+        query = select(NotesTable.user_id, func.coalesce(NotesTable.updated_at, NotesTable.created_at)) \
+            .where(NotesTable.id == note_id)
+        result = await self.session.execute(query)
+        row = result.one_or_none()
+        return tuple(row) if row is not None else None
+
+    async def collection_version(self, user_id: int) -> tuple[int, tp.Optional[datetime], tp.Optional[int]]:
+        '''
+            Агрегат для ETag списка заметок пользователя: меняется при создании, изменении и удалении
+        '''
+        query = select(
+            func.count(), func.max(func.coalesce(NotesTable.updated_at, NotesTable.created_at)), func.max(NotesTable.id),
+        ).where(NotesTable.user_id == user_id)
+        result = await self.session.execute(query)
+        return tuple(result.one())
+
+    async def update_owned(self, note_id: int, user_id: int, values: dict,
+                           versions: tp.Optional[list[datetime]] = None) -> tp.Optional[tp.Any]:
+        '''
+            Обновление заметки владельца одним UPDATE ... WHERE id AND user_id RETURNING, без загрузки note.user.
+            Строка не меняется, если значения совпадают с текущими; с versions - только если версия совпала (If-Match).
+            None - заметки нет, она чужая, версия устарела или менять нечего
+        '''
+        columns = [getattr(NotesTable, key) for key in values]
+        conditions = [
+            NotesTable.id == note_id,
+            NotesTable.user_id == user_id,
+            or_(*(column.is_distinct_from(values[column.key]) for column in columns)),
+        ]
+        if versions is not None:
+            conditions.append(func.coalesce(NotesTable.updated_at, NotesTable.created_at).in_(versions))
+        query = update(NotesTable).where(*conditions).values(**values, updated_at=datetime.now()).returning(
+            NotesTable.id, NotesTable.title, NotesTable.description, NotesTable.user_id,
+            NotesTable.created_at, NotesTable.updated_at,
+        ).execution_options(synchronize_session=False)
+        result = await self.session.execute(query)
+        row = result.one_or_none()
+        await self.session.commit()
+        if row is not None:
+            await self._invalidate(note_id)
+        return row
+
+    async def delete_owned(self, note_id: int, user_id: int) -> bool:
+        '''
+            Удаление заметки владельца одним DELETE ... WHERE id AND user_id. False - заметки нет или она чужая
+        '''
+        query = delete(NotesTable).where(NotesTable.id == note_id, NotesTable.user_id == user_id) \
+            .returning(NotesTable.id).execution_options(synchronize_session=False)
+        result = await self.session.execute(query)
+        deleted = result.scalar_one_or_none() is not None
+        await self.session.commit()
+        if deleted:
+            await self._invalidate(note_id)
+        return deleted
+
     async def get_by_user(self, user_id: int):
         query = select(NotesTable).where(NotesTable.user_id == user_id).options(selectinload(NotesTable.user))
         result = await self.session.execute(query)
@@ -39,6 +235,7 @@ class NoteRepository:
                 setattr(note_model, key, value)
             note_model.updated_at = datetime.now()
             await self.session.commit()
+            await self._invalidate(note_id)
             await self.session.refresh(note_model, ["user"])
             return note_model
         return None
@@ -49,11 +246,62 @@ class NoteRepository:
         await self.session.commit()
         return model_note
 
+    async def create_many(self, notes: list[CreateNoteSchema]) -> list[int]:
+        '''
+            Вставка пачки заметок многострочным INSERT ... RETURNING в одной транзакции.
+            Id возвращаются в порядке входного списка
+        '''
+        query = insert(NotesTable).returning(NotesTable.id, sort_by_parameter_order=True)
+        result = await self.session.execute(query, [note.model_dump() for note in notes])
+        ids = list(result.scalars())
+        await self.session.commit()
+        return ids
+
+    @staticmethod
+    def _bulk_conditions(user_id: int, ids: tp.Optional[list[int]], since: tp.Optional[datetime],
+                         until: tp.Optional[datetime]) -> list:
+        conditions = [NotesTable.user_id == user_id]
+        if ids is not None:
+            conditions.append(NotesTable.id.in_(ids))
+        if since is not None:
+            conditions.append(NotesTable.created_at >= since)
+        if until is not None:
+            conditions.append(NotesTable.created_at < until)
+        return conditions
+
+    async def update_many(self, user_id: int, values: dict, ids: tp.Optional[list[int]] = None,
+                          since: tp.Optional[datetime] = None, until: tp.Optional[datetime] = None) -> list[int]:
+        '''
+            Массовое обновление заметок владельца одним UPDATE ... RETURNING id
+        '''
+        query = update(NotesTable).where(*self._bulk_conditions(user_id, ids, since, until)) \
+            .values(**values, updated_at=datetime.now()).returning(NotesTable.id) \
+            .execution_options(synchronize_session=False)
+        result = await self.session.execute(query)
+        note_ids = list(result.scalars())
+        await self.session.commit()
+        await self._invalidate(*note_ids)
+        return note_ids
+
+    async def delete_many(self, user_id: int, ids: tp.Optional[list[int]] = None,
+                          since: tp.Optional[datetime] = None, until: tp.Optional[datetime] = None) -> list[int]:
+        '''
+            Массовое удаление заметок владельца одним DELETE ... RETURNING id
+        '''
+        query = delete(NotesTable).where(*self._bulk_conditions(user_id, ids, since, until)) \
+            .returning(NotesTable.id).execution_options(synchronize_session=False)
+        result = await self.session.execute(query)
+        note_ids = list(result.scalars())
+        await self.session.commit()
+        await self._invalidate(*note_ids)
+        return note_ids
+
     async def delete(self, note_id: int):
         query = delete(NotesTable).where(NotesTable.id == note_id)
         await self.session.execute(query)
         await self.session.commit()
+        await self._invalidate(note_id)
 
 
-def get_note_repository(session: AsyncSession = Depends(db.get_session)) -> NoteRepository:
-    return NoteRepository(session)
\ No newline at end of file
+async def get_note_repository(session: AsyncSession = Depends(db.get_session)) -> NoteRepository:
+    return NoteRepository(session, container.entity_cache)
\ No newline at end of file
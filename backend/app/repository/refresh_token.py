@@ -0,0 +1,62 @@
+from datetime import datetime
+import typing as tp
+
+from fastapi import Depends
+from sqlalchemy import select, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..entries.models import RefreshTokenTable, UserTable
+from ..db.db import db
+
+
+class RefreshTokenRepository:
+    def __init__(self, session: AsyncSession):
+        self.session: AsyncSession = session
+
+    async def get_by_hash(self, token_hash: bytes) -> tp.Optional[tuple[RefreshTokenTable, UserTable]]:
+        query = select(RefreshTokenTable, UserTable) \
+            .join(UserTable, UserTable.id == RefreshTokenTable.user_id) \
+            .where(RefreshTokenTable.token_hash == token_hash)
+        result = await self.session.execute(query)
+        return result.one_or_none()
+
+    async def create(self, token_hash: bytes, family_id: bytes, user_id: int, expires_at: datetime):
+        model_token = RefreshTokenTable(token_hash=token_hash, family_id=family_id, user_id=user_id,
+                                        expires_at=expires_at, used=False)
+        self.session.add(model_token)
+        await self.session.commit()
+        return model_token
+
+    async def rotate(self, token_id: int, token_hash: bytes, family_id: bytes, user_id: int, expires_at: datetime) -> bool:
+        '''
+            Помечает токен использованным и выпускает следующий в том же семействе одной транзакцией.
+            Возвращает False, если токен уже успели использовать (параллельный refresh или повтор)
+        '''
+        query = update(RefreshTokenTable) \
+            .where(RefreshTokenTable.id == token_id, RefreshTokenTable.used.is_(False)) \
+            .values(used=True)
+        result = await self.session.execute(query)
+        if result.rowcount != 1:
+            await self.session.rollback()
+            return False
+        self.session.add(RefreshTokenTable(token_hash=token_hash, family_id=family_id, user_id=user_id,
+                                           expires_at=expires_at, used=False))
+        await self.session.commit()
+        return True
+
+    async def delete_expired(self, now: datetime):
+        '''
+            Удаляет истекшие токены, в том числе использованные: их повтор после истечения и так отклоняется
+        '''
+        query = delete(RefreshTokenTable).where(RefreshTokenTable.expires_at <= now)
+        await self.session.execute(query)
+        await self.session.commit()
+
+    async def revoke_family(self, family_id: bytes):
+        query = delete(RefreshTokenTable).where(RefreshTokenTable.family_id == family_id)
+        await self.session.execute(query)
+        await self.session.commit()
+
+
+async def get_refresh_token_repository(session: AsyncSession = Depends(db.get_session)) -> RefreshTokenRepository:
+    return RefreshTokenRepository(session)
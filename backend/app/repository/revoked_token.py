@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from fastapi import Depends
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..entries.models import RevokedTokenTable
+from ..db.db import db
+
+
+class RevokedTokenRepository:
+    def __init__(self, session: AsyncSession):
+        self.session: AsyncSession = session
+
+    async def get_active(self, now: datetime) -> list[str]:
+        query = select(RevokedTokenTable.jti).where(RevokedTokenTable.expires_at > now)
+        result = await self.session.execute(query)
+        return list(result.scalars().all())
+
+    async def get_active_subjects(self, now: datetime, prefix: str) -> list[tuple[str, datetime]]:
+        query = select(RevokedTokenTable.jti, RevokedTokenTable.expires_at) \
+            .where(RevokedTokenTable.jti.startswith(prefix), RevokedTokenTable.expires_at > now)
+        result = await self.session.execute(query)
+        return [(row.jti, row.expires_at) for row in result]
+
+    async def create(self, jti: str, expires_at: datetime):
+        model_token = RevokedTokenTable(jti=jti, expires_at=expires_at)
+        await self.session.merge(model_token)
+        await self.session.commit()
+        return model_token
+
+    async def delete_expired(self, now: datetime):
+        query = delete(RevokedTokenTable).where(RevokedTokenTable.expires_at <= now)
+        await self.session.execute(query)
+        await self.session.commit()
+
+
+async def get_revoked_token_repository(session: AsyncSession = Depends(db.get_session)) -> RevokedTokenRepository:
+    return RevokedTokenRepository(session)
@@ -1,28 +1,67 @@
+from datetime import datetime, timedelta, timezone
+import typing as tp
+
 from fastapi import Depends
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, update, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
 
-from ..entries.models import NotesTable, UserTable
+from ..cache.entity import EntityCache
+from ..cache.principal import PrincipalCache
+from ..cache.revocation import RevocationList, subject_key
+from ..container import container
+from ..entries.models import NotesTable, UserTable, RevokedTokenTable
 from ..db.db import db
 from ..entries.schemas import CreateUserSchema, \
-    UpdateUserInputSchema
+    UpdateUserInputSchema, UserSchema
+from settings import settings
 
 
 class UserRepository:
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, principal_cache: tp.Optional[PrincipalCache] = None,
+                 entity_cache: tp.Optional[EntityCache] = None, revocation_list: tp.Optional[RevocationList] = None):
         self.session: AsyncSession = session
+        self.principal_cache = principal_cache
+        self.entity_cache = entity_cache
+        self.revocation_list = revocation_list
 
     async def get_all(self):
-        query = select(UserTable).options(joinedload(UserTable.notes))
+        query = select(UserTable)
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    async def get_page(self, limit: int, after: tp.Optional[str] = None, prefix: tp.Optional[str] = None) -> list:
+        '''
+            Keyset-пагинация по username (уникальный индекс). Выбираются только колонки UserSchema, без заметок и пароля.
+            prefix - поиск по началу имени: LIKE 'prefix%' идет по индексу ix_user_username_pattern
+        '''
+        query = select(UserTable.id, UserTable.username, UserTable.created_at) \
+            .order_by(UserTable.username) \
+            .limit(limit)
+        if prefix:
+            query = query.where(UserTable.username.startswith(prefix, autoescape=True))
+        if after is not None:
+            query = query.where(UserTable.username > after)
         result = await self.session.execute(query)
-        return result.unique().scalars().all()
+        return result.all()
 
-    async def get_by_id(self, user_id: int) -> NotesTable:
+    async def get_by_id(self, user_id: int) -> tp.Union[UserTable, UserSchema, None]:
+        '''
+            С кэшем возвращает UserSchema (без хеша пароля), без него - модель UserTable
+        '''
+        if self.entity_cache is not None:
+            return await self.entity_cache.get_or_load("user", user_id, UserSchema, lambda: self._load(user_id))
         query = select(UserTable).where(UserTable.id == user_id)
         result = await self.session.execute(query)
         return result.scalar_one_or_none()
 
+    async def _load(self, user_id: int) -> tp.Optional[UserSchema]:
+        query = select(UserTable).where(UserTable.id == user_id)
+        result = await self.session.execute(query)
+        user_model = result.scalar_one_or_none()
+        return UserSchema.model_validate(user_model, from_attributes=True) if user_model else None
+
     async def get_by_username(self, username: str) -> NotesTable:
         query = select(UserTable).where(UserTable.username == username)
         result = await self.session.execute(query)
@@ -34,17 +73,37 @@ class UserRepository:
         return result.unique().scalar_one_or_none()
 
     async def update(self, user_id: int, user: UpdateUserInputSchema):
+        '''
+            Одним UPDATE ... RETURNING. Если значения совпадают с текущими, запись не выполняется.
+            При смене имени токены со старым именем отзываются в той же транзакции
+        '''
+        updated_data = user.model_dump(exclude_unset=True, exclude_none=True)
+        if updated_data:
+            old_username = None
+            if "username" in updated_data and self.revocation_list is not None:
+                old_username = await self.session.scalar(select(UserTable.username).where(UserTable.id == user_id))
+            columns = [getattr(UserTable, key) for key in updated_data]
+            query = update(UserTable).where(
+                UserTable.id == user_id,
+                or_(*(column.is_distinct_from(updated_data[column.key]) for column in columns)),
+            ).values(**updated_data).returning(UserTable).execution_options(populate_existing=True)
+            try:
+                result = await self.session.execute(query)
+            except IntegrityError:
+                await self.session.rollback()
+                raise
+            user_model = result.scalar_one_or_none()
+            renamed = user_model is not None and old_username is not None and old_username != user_model.username
+            revoked_until = await self._revoke_tokens(old_username) if renamed else None
+            await self.session.commit()
+            if user_model is not None:
+                self._invalidate_principal(user_id, old_username, revoked_until)
+                # имя пользователя входит в закэшированные заметки
+                await self._invalidate_entities(user_id, with_notes="username" in updated_data)
+                return user_model
         query = select(UserTable).where(UserTable.id == user_id)
         result = await self.session.execute(query)
-        user_model = result.scalar_one_or_none()
-        if user_model:
-            updated_data = user.model_dump(exclude_unset=True, exclude_none=True)
-            for key, value in updated_data.items():
-                setattr(user_model, key, value)
-            await self.session.commit()
-            await self.session.refresh(user_model)
-            return user_model
-        return None
+        return result.scalar_one_or_none()
 
     async def create(self, user: CreateUserSchema):
         model_user = UserTable(**user.model_dump())
@@ -53,10 +112,47 @@ class UserRepository:
         return model_user
 
     async def delete(self, user_id: int):
-        query = delete(UserTable).where(UserTable.id == user_id)
-        await self.session.execute(query)
+        note_ids = await self._note_ids(user_id) if self.entity_cache is not None else []
+        query = delete(UserTable).where(UserTable.id == user_id).returning(UserTable.username)
+        username = (await self.session.execute(query)).scalar_one_or_none()
+        revoked_until = await self._revoke_tokens(username) if username is not None else None
         await self.session.commit()
+        self._invalidate_principal(user_id, username, revoked_until)
+        # заметки удаляются каскадом в БД, их id собраны до удаления
+        if self.entity_cache is not None:
+            await self.entity_cache.invalidate("user", user_id)
+            await self.entity_cache.invalidate("note", *note_ids)
+
+    async def _note_ids(self, user_id: int) -> list[int]:
+        result = await self.session.execute(select(NotesTable.id).where(NotesTable.user_id == user_id))
+        return list(result.scalars())
+
+    async def _invalidate_entities(self, user_id: int, with_notes: bool = False):
+        if self.entity_cache is None:
+            return
+        await self.entity_cache.invalidate("user", user_id)
+        if with_notes:
+            await self.entity_cache.invalidate("note", *await self._note_ids(user_id))
+
+    async def _revoke_tokens(self, username: str) -> tp.Optional[datetime]:
+        '''
+            Запись в revoked_token, по которой все процессы перестают принимать выданные до этого момента
+            токены пользователя (PrincipalCache других процессов о смене имени или удалении не знает).
+            Возвращает отметку отзыва: после нее истекают только новые токены
+        '''
+        if self.revocation_list is None:
+            return None
+        revoked_until = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        await self.session.merge(RevokedTokenTable(jti=subject_key(username), expires_at=revoked_until))
+        return revoked_until
+
+    def _invalidate_principal(self, user_id: int, username: tp.Optional[str] = None,
+                              revoked_until: tp.Optional[datetime] = None):
+        if self.principal_cache is not None:
+            self.principal_cache.invalidate_user(user_id)
+        if revoked_until is not None:
+            self.revocation_list.revoke_subject(username, revoked_until)
 
 
-def get_user_repository(session: AsyncSession = Depends(db.get_session)) -> UserRepository:
-    return UserRepository(session)
\ No newline at end of file
+async def get_user_repository(session: AsyncSession = Depends(db.get_session)) -> UserRepository:
+    return UserRepository(session, container.principal_cache, container.entity_cache, container.revocation_list)
\ No newline at end of file
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, HTTPException
+
+from ..lifecycle import lifecycle
+
+router = APIRouter(prefix="/health",
+                   tags=["health"])
+
+
+@router.get("/live")
+async def live() -> dict:
+    '''
+        Liveness-проба: процесс запущен и обрабатывает запросы. БД не проверяется
+    '''
+    return {"status": "ok"}
+
+@router.get("/ready")
+async def ready() -> dict:
+    '''
+        Readiness-проба: БД доступна, схема применена и пул прогрет
+    '''
+    if not lifecycle.ready:
+        raise HTTPException(status_code=503, detail="starting")
+    return {"status": "ready"}
@@ -1,6 +1,8 @@
+import os
+
 from fastapi import APIRouter
 from fastapi import Response
-from prometheus_client import generate_latest, REGISTRY, CONTENT_TYPE_LATEST
+from prometheus_client import generate_latest, REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, multiprocess
 
 router = APIRouter(
     prefix="/metrics",
@@ -9,7 +11,14 @@ router = APIRouter(
 
 @router.get("/")
 async def get_metrics():
+    '''
+        Метрики Prometheus. При нескольких воркерах (PROMETHEUS_MULTIPROC_DIR) - сумма по всем воркерам пода
+    '''
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
     return Response(
-        content=generate_latest(REGISTRY),
+        content=generate_latest(registry),
         media_type=CONTENT_TYPE_LATEST
-    )
\ No newline at end of file
+    )
@@ -1,37 +1,121 @@
-from fastapi import APIRouter, Depends
+import typing as tp
+from datetime import datetime
+
+from fastapi import APIRouter, Body, Depends, Header, Query, Response
+from fastapi.responses import StreamingResponse
 
 from ..entries.schemas import CreateNoteSchema, CreateNoteInputSchema, UpdateNoteSchema, UserSchema, \
-    NoteSchema
+    NoteSchema, NotePageSchema, BulkCreateNoteResultSchema, \
+    BulkUpdateNoteSchema, BulkNoteFilterSchema, BulkNoteChangeResultSchema, \
+    NoteSearchPageSchema, NoteSearchResultSchema, CompactNotePageSchema
+from ..services.etag import none_match, note_schema_etag
+from .responses import serialized
 from ..services.note import get_note_service, NoteService
 from ..services.pemissions import NotePermission, get_note_permission
 from ..services.token import get_current_user
+from settings import settings
 
 router = APIRouter(prefix="/note",
                    tags=["note"])
 
 
+PageLimit = tp.Annotated[int, Query(ge=1, le=settings.NOTE_PAGE_MAX_LIMIT)]
+ETagHeader = tp.Annotated[tp.Optional[str], Header()]
+# full - у каждой заметки вложенный пользователь, compact - CompactNotePageSchema
+NoteFormat = tp.Annotated[tp.Literal["full", "compact"], Query(alias="format")]
+NoteListSchema = tp.Union[list[NoteSchema], CompactNotePageSchema]
+
+
+def page_headers(response: Response, page: tp.Union[NotePageSchema, NoteSearchPageSchema, CompactNotePageSchema]):
+    '''
+        Курсор следующей страницы и примерное количество отдаются в заголовках
+    '''
+    if page.next_cursor is not None:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    if page.total_estimate is not None:
+        response.headers["X-Total-Estimate"] = str(page.total_estimate)
+
+
+def page_items(response: Response, page: tp.Union[NotePageSchema, NoteSearchPageSchema]) -> list[NoteSchema]:
+    '''
+        Тело ответа остается списком заметок, курсор - в заголовках
+    '''
+    page_headers(response, page)
+    return page.items
+
+
+def note_list(response: Response, page: tp.Union[NotePageSchema, CompactNotePageSchema]):
+    if isinstance(page, CompactNotePageSchema):
+        page_headers(response, page)
+        return serialized(response, page, CompactNotePageSchema)
+    return serialized(response, page_items(response, page), list[NoteSchema])
+
+
 @router.get("/")
-async def get_notes(permission: NotePermission = Depends(get_note_permission)) -> list[NoteSchema]:
+async def get_notes(response: Response, limit: PageLimit = settings.NOTE_PAGE_DEFAULT_LIMIT, cursor: tp.Optional[str] = None,
+                    note_format: NoteFormat = "full",
+                    permission: NotePermission = Depends(get_note_permission)) -> NoteListSchema:
     '''
-        Эндпоинт для получения всех заметок в системе. Доступно только админу
+        Эндпоинт для получения заметок в системе постранично. Доступно только админу.
+        format=compact - авторы заметок передаются один раз в users
     '''
-    result = await permission.read_all()
-    return result
+    page = await permission.read_all(limit, cursor, note_format == "compact")
+    return note_list(response, page)
 
 @router.get("/me")
-async def get_my_notes(user: UserSchema = Depends(get_current_user), service: NoteService = Depends(get_note_service)) -> list[NoteSchema]:
+async def get_my_notes(response: Response, limit: PageLimit = settings.NOTE_PAGE_DEFAULT_LIMIT, cursor: tp.Optional[str] = None,
+                       note_format: NoteFormat = "full", if_none_match: ETagHeader = None,
+                       user: UserSchema = Depends(get_current_user), service: NoteService = Depends(get_note_service)) -> NoteListSchema:
     '''
-        Эндпоинт для получения всех заметок аутентифицированного пользователя
+        Эндпоинт для получения заметок аутентифицированного пользователя постранично.
+        ETag считается по агрегату (count, max(updated_at)), при совпадении If-None-Match - 304 без загрузки заметок.
+        format=compact - пользователь передается один раз в users
     '''
-    result = await service.get_by_user(user)
-    return result
+    etag, total = await service.get_collection_etag(user, limit, cursor, note_format)
+    if none_match(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if note_format == "compact":
+        page = await service.get_compact_page(limit, cursor, user, total)
+    else:
+        page = await service.get_page(limit, cursor, user, total)
+    response.headers["ETag"] = etag
+    return note_list(response, page)
+
+@router.get("/search")
+async def search_notes(response: Response, q: tp.Annotated[str, Query(min_length=1, max_length=256)],
+                       limit: PageLimit = settings.NOTE_PAGE_DEFAULT_LIMIT, cursor: tp.Optional[str] = None,
+                       user: UserSchema = Depends(get_current_user), service: NoteService = Depends(get_note_service)) -> list[NoteSearchResultSchema]:
+    '''
+        Эндпоинт для полнотекстового поиска по заметкам аутентифицированного пользователя.
+        Результаты отсортированы по релевантности, курсор следующей страницы - в X-Next-Cursor
+    '''
+    page = await service.search(user, q, limit, cursor)
+    return serialized(response, page_items(response, page), list[NoteSearchResultSchema])
+
+@router.get("/export")
+async def export_notes(user_id: tp.Optional[int] = None, since: tp.Optional[datetime] = None, until: tp.Optional[datetime] = None,
+                       gzip: bool = False, permission: NotePermission = Depends(get_note_permission)) -> StreamingResponse:
+    '''
+        Эндпоинт для потоковой выгрузки заметок в NDJSON. Админу доступны все заметки, остальным - свои
+    '''
+    chunks = permission.export(user_id, since, until, gzip)
+    headers = {"Content-Encoding": "gzip"} if gzip else None
+    return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
 
 @router.get("/{id}")
-async def get_note(id: int, permission_service: NotePermission = Depends(get_note_permission)) -> NoteSchema:
+async def get_note(id: int, response: Response, if_none_match: ETagHeader = None,
+                   permission_service: NotePermission = Depends(get_note_permission)) -> NoteSchema:
     '''
-        Эндпоинт для получения определенной заметки по id. Доступно создателю
+        Эндпоинт для получения определенной заметки по id. Доступно создателю.
+        При совпадении If-None-Match - 304 без загрузки заметки
     '''
-    return await permission_service.is_owner_read(id)
+    if if_none_match is not None:
+        etag = await permission_service.owner_etag(id)
+        if none_match(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    note = await permission_service.is_owner_read(id)
+    response.headers["ETag"] = note_schema_etag(note)
+    return serialized(response, note, NoteSchema)
 
 @router.post("/")
 async def create_note(note: CreateNoteInputSchema, service: NoteService = Depends(get_note_service), user: UserSchema = Depends(get_current_user)) -> CreateNoteSchema:
@@ -41,12 +125,39 @@ async def create_note(note: CreateNoteInputSchema, service: NoteService = Depend
     result = await service.create(user, note)
     return result
 
+@router.post("/bulk")
+async def create_notes(items: tp.Annotated[list[tp.Any], Body()], service: NoteService = Depends(get_note_service),
+                       user: UserSchema = Depends(get_current_user)) -> BulkCreateNoteResultSchema:
+    '''
+        Эндпоинт для массового создания заметок. Доступно аутентифицированному пользователю.
+        Возвращает результат по каждому элементу: id созданной заметки или ошибки валидации
+    '''
+    return await service.create_many(user, items)
+
+@router.patch("/bulk")
+async def update_notes(data: BulkUpdateNoteSchema, permission_service: NotePermission = Depends(get_note_permission)) -> BulkNoteChangeResultSchema:
+    '''
+        Эндпоинт для массового обновления заметок по списку id или интервалу created_at. Затрагивает только заметки создателя
+    '''
+    return await permission_service.owner_update_many(data)
+
+@router.delete("/bulk")
+async def delete_notes(data: BulkNoteFilterSchema, permission_service: NotePermission = Depends(get_note_permission)) -> BulkNoteChangeResultSchema:
+    '''
+        Эндпоинт для массового удаления заметок по списку id или интервалу created_at. Затрагивает только заметки создателя
+    '''
+    return await permission_service.owner_delete_many(data)
+
 @router.put("/{id}")
-async def update_note(id: int, note: UpdateNoteSchema, permission_service: NotePermission = Depends(get_note_permission)) -> NoteSchema:
+async def update_note(id: int, note: UpdateNoteSchema, response: Response, if_match: ETagHeader = None,
+                      permission_service: NotePermission = Depends(get_note_permission)) -> NoteSchema:
     '''
-        Эндпоинт для обновления заметки. Доступно создателю
+        Эндпоинт для обновления заметки. Доступно создателю.
+        С If-Match обновление выполняется, только если заметка не менялась (иначе 412)
     '''
-    return await permission_service.is_owner_update(id, note)
+    result = await permission_service.is_owner_update(id, note, if_match)
+    response.headers["ETag"] = note_schema_etag(result)
+    return result
 
 @router.delete("/{id}")
 async def delete_note(id: int, permission_service: NotePermission = Depends(get_note_permission)):
@@ -0,0 +1,29 @@
+from functools import lru_cache
+import typing as tp
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from settings import settings
+
+
+@lru_cache(maxsize=None)
+def type_adapter(type_: tp.Any) -> TypeAdapter:
+    return TypeAdapter(type_)
+
+
+def serialized(response: Response, content: tp.Any, type_: tp.Any) -> tp.Any:
+    '''
+        При FAST_SERIALIZATION=true ответ сериализуется один раз сразу в JSON-байты через TypeAdapter.dump_json,
+        без повторной валидации по return-аннотации эндпоинта. Только для уже провалидированного вывода сервисов.
+        Заголовки, выставленные в response (ETag, X-Next-Cursor), переносятся в ответ
+    '''
+    if not settings.FAST_SERIALIZATION:
+        return content
+    headers = {key: value for key, value in response.headers.items() if key not in ("content-length", "content-type")}
+    return Response(
+        type_adapter(type_).dump_json(content),
+        status_code=response.status_code or 200,
+        headers=headers,
+        media_type="application/json",
+    )
@@ -1,12 +1,25 @@
-from fastapi import APIRouter, Depends
-from fastapi.security import OAuth2PasswordRequestForm
+import typing as tp
 
+from fastapi import APIRouter, Depends, Form
+
+from ..entries.schemas import TokenRequestForm, oauth2_scheme
 from ..services.token import TokenService, get_token_service
 
 router = APIRouter(prefix="/token", tags=["Token"])
 
 
 @router.post("/")
-async def token(form_data: OAuth2PasswordRequestForm = Depends(), service: TokenService = Depends(get_token_service)) -> dict:
-    user_token = await service.get_token(form_data)
+async def token(form_data: TokenRequestForm = Depends(), service: TokenService = Depends(get_token_service)) -> dict:
+    '''
+        Эндпоинт для получения токенов по паролю (grant_type=password) или по refresh-токену (grant_type=refresh_token)
+    '''
+    user_token = await service.grant(form_data)
     return user_token
+
+@router.post("/revoke")
+async def revoke(refresh_token: tp.Optional[str] = Form(None), token: str = Depends(oauth2_scheme),
+                 service: TokenService = Depends(get_token_service)):
+    '''
+        Эндпоинт для выхода. Отзывает текущий access-токен и семейство переданного refresh-токена
+    '''
+    await service.revoke(token, refresh_token)
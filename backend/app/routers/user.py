@@ -1,37 +1,62 @@
-from fastapi import APIRouter, Depends
+import typing as tp
+
+from fastapi import APIRouter, Depends, Header, Query, Response
 
 from ..entries.schemas import CreateUserInputSchema, \
     UpdateUserInputSchema, UserSchema, CreateUserSchema
+from ..services.etag import digest_etag, none_match
+from .responses import serialized
 from ..services.pemissions import UserPermission, get_user_permission
 from ..services.token import get_current_user
 from ..services.user import UserService, get_user_service
+from settings import settings
 
 router = APIRouter(prefix="/user",
                    tags=["user"])
 
 
+def user_etag(user: UserSchema) -> str:
+    return digest_etag(user.id, user.username, user.created_at)
+
+
 @router.get("/")
-async def get_users(service: UserService = Depends(get_user_service)) -> list[UserSchema]:
+async def get_users(response: Response,
+                    limit: tp.Annotated[int, Query(ge=1, le=settings.USER_PAGE_MAX_LIMIT)] = settings.USER_PAGE_DEFAULT_LIMIT,
+                    cursor: tp.Optional[str] = None, prefix: tp.Annotated[tp.Optional[str], Query(max_length=256)] = None,
+                    service: UserService = Depends(get_user_service)) -> list[UserSchema]:
     '''
-        Эндпоинт для получения списка пользователей.
+        Эндпоинт для получения списка пользователей постранично, по алфавиту.
+        prefix - поиск по началу имени, курсор следующей страницы - в X-Next-Cursor
     '''
-    result = await service.get_all()
-    return result
+    page = await service.get_page(limit, cursor, prefix)
+    if page.next_cursor is not None:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return serialized(response, page.items, list[UserSchema])
 
 @router.get("/me")
-async def get_me(user: UserSchema = Depends(get_current_user)) -> UserSchema:
+async def get_me(response: Response, if_none_match: tp.Annotated[tp.Optional[str], Header()] = None,
+                 user: UserSchema = Depends(get_current_user)) -> UserSchema:
     '''
         Эндпоинт для информации о себе.
     '''
-    return user
+    etag = user_etag(user)
+    if none_match(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return serialized(response, user, UserSchema)
 
 @router.get("/{id}")
-async def get_user(id: int, service: UserService = Depends(get_user_service)) -> UserSchema:
+async def get_user(id: int, response: Response, if_none_match: tp.Annotated[tp.Optional[str], Header()] = None,
+                   service: UserService = Depends(get_user_service)) -> UserSchema:
     '''
         Эндпоинт для информации о юзере по id.
     '''
     user = await service.get_by_id(id)
-    return user
+    etag = user_etag(user)
+    if none_match(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return serialized(response, user, UserSchema)
 
 @router.post("/")
 async def create_user(user: CreateUserInputSchema, service: UserService = Depends(get_user_service)) -> CreateUserSchema:
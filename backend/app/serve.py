@@ -0,0 +1,62 @@
+'''
+    Прод-запуск: несколько воркеров uvicorn и метрики Prometheus, собранные со всех воркеров.
+
+        python -m app.serve
+
+    Разработка по-прежнему через python -m app.main (один процесс, без multiprocess-метрик)
+'''
+import importlib.util
+import os
+import shutil
+import tempfile
+import typing as tp
+
+import uvicorn
+
+from .services.hashing import available_cpus
+from settings import settings
+
+
+def prepare_multiprocess_metrics() -> str:
+    '''
+        Каталог для файлов метрик воркеров. Очищается при старте: файлы прошлого запуска исказили бы суммы.
+        Переменная должна быть выставлена до импорта app.metrics в воркерах
+    '''
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.path.join(tempfile.gettempdir(), "prometheus-multiproc")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    return path
+
+
+def server_options(workers: tp.Optional[int] = None) -> dict[str, tp.Any]:
+    workers = workers or settings.WEB_WORKERS or available_cpus()
+    return {
+        "host": settings.HOST_IP,
+        "port": settings.WEB_PORT,
+        "workers": workers,
+        "loop": "uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        "http": "httptools" if importlib.util.find_spec("httptools") else "h11",
+        "backlog": settings.WEB_BACKLOG,
+        "timeout_keep_alive": settings.WEB_KEEPALIVE_SECONDS,
+        "limit_concurrency": settings.WEB_LIMIT_CONCURRENCY or None,
+        "timeout_graceful_shutdown": int(settings.SHUTDOWN_DRAIN_SECONDS),
+        # access-лог в каждом воркере заметно снижает пропускную способность; запросы видны в метриках
+        "access_log": False,
+        "proxy_headers": True,
+        # X-Forwarded-For принимается только от прокси/ingress, иначе клиент может подменить свой адрес
+        "forwarded_allow_ips": settings.WEB_FORWARDED_ALLOW_IPS,
+    }
+
+
+def main():
+    prepare_multiprocess_metrics()
+    options = server_options()
+    # воркеры делят между собой ядра под пулы хеширования паролей (см. default_hash_workers)
+    os.environ["WEB_WORKERS"] = str(options["workers"])
+    print(f"Starting {options['workers']} workers (loop={options['loop']}, http={options['http']})")
+    uvicorn.run("app.main:app", **options)
+
+
+if __name__ == "__main__":
+    main()
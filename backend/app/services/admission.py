@@ -0,0 +1,50 @@
+import asyncio
+from contextlib import asynccontextmanager
+import typing as tp
+
+from fastapi import HTTPException
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+
+from ..metrics.metrics import LOGIN_ADMISSION_PENDING, LOGIN_ADMISSION_REJECTED
+
+
+class LoginAdmission:
+    '''
+        Ограничивает количество одновременных проверок пароля.
+        Не больше max_concurrent проверок выполняются, еще queue_depth ждут в очереди,
+        остальные сразу получают 503 с Retry-After
+    '''
+    def __init__(self, max_concurrent: int, queue_depth: int, retry_after: int):
+        self.max_concurrent = max_concurrent
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+        self._pending = 0
+        self._loop: tp.Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: tp.Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # семафор создается в работающем event loop, иначе в python 3.9 он привяжется к чужому
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    @asynccontextmanager
+    async def admit(self):
+        if self._pending >= self.max_concurrent + self.queue_depth:
+            LOGIN_ADMISSION_REJECTED.inc()
+            raise HTTPException(
+                status_code=HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login attempts, retry later",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self._pending += 1
+        LOGIN_ADMISSION_PENDING.inc()
+        try:
+            async with self.semaphore:
+                yield
+        finally:
+            self._pending -= 1
+            LOGIN_ADMISSION_PENDING.dec()
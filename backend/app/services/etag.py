@@ -0,0 +1,55 @@
+import hashlib
+from datetime import datetime
+import typing as tp
+
+from fastapi import HTTPException
+
+from .pagination import encode_cursor, decode_cursor
+
+
+def note_etag(note_id: int, version: datetime, username: str) -> str:
+    '''
+        Сильный ETag заметки: обратимо кодирует (id, updated_at), чтобы If-Match
+        можно было проверить прямо в UPDATE ... WHERE updated_at = :version.
+        Ответ включает автора, поэтому к ETag добавлен хеш username - после переименования он меняется
+    '''
+    owner = hashlib.sha256(username.encode()).hexdigest()[:8]
+    return f'"{encode_cursor(note_id, version)}.{owner}"'
+
+
+def note_schema_etag(note: tp.Any) -> str:
+    return note_etag(note.id, note.updated_at or note.created_at, note.user.username)
+
+
+def decode_note_etag(etag: str) -> tuple[int, datetime]:
+    '''
+        (id, updated_at) из ETag заметки; хеш автора для If-Match не нужен - проверяется версия строки
+    '''
+    try:
+        return decode_cursor(etag.strip('"').split(".", 1)[0], int, datetime)
+    except HTTPException:
+        raise HTTPException(status_code=412, detail="Precondition failed")
+
+
+def digest_etag(*parts: tp.Any) -> str:
+    '''
+        ETag по дешевым агрегатам (count, max(updated_at)) или полям сущности без сериализации ответа
+    '''
+    payload = "\x1f".join(part.isoformat() if isinstance(part, datetime) else str(part) for part in parts)
+    return f'"{hashlib.sha256(payload.encode()).hexdigest()[:32]}"'
+
+
+def parse_etags(header: tp.Optional[str]) -> list[str]:
+    if not header:
+        return []
+    return [etag.strip() for etag in header.split(",") if etag.strip()]
+
+
+def none_match(header: tp.Optional[str], etag: str) -> bool:
+    '''
+        True, если If-None-Match совпал и можно ответить 304. Сравнение слабое (W/ игнорируется)
+    '''
+    for candidate in parse_etags(header):
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
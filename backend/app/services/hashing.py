@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+import typing as tp
+
+import argon2
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+
+from settings import settings
+
+
+def available_cpus() -> int:
+    '''
+        Количество ядер, доступных процессу. Учитывает cgroup-лимит пода (cpu.max в v2, cfs_quota_us в v1),
+        иначе в kubernetes os.cpu_count() вернет количество ядер всей ноды
+    '''
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+            quota = int(file.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+            period = int(file.read())
+        if quota > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def default_hash_workers(web_workers: int) -> int:
+    '''
+        Процессов хеширования на воркер uvicorn: ядра контейнера делятся между воркерами, иначе в поде
+        окажется воркеры x ядра процессов argon2 по ARGON2_MEMORY_COST памяти каждый
+    '''
+    return max(1, available_cpus() // max(1, web_workers))
+
+
+class Argon2Params(tp.NamedTuple):
+    time_cost: int = argon2.DEFAULT_TIME_COST
+    memory_cost: int = argon2.DEFAULT_MEMORY_COST
+    parallelism: int = argon2.DEFAULT_PARALLELISM
+
+
+@lru_cache(maxsize=None)
+def _password_hash(params: Argon2Params) -> PasswordHash:
+    return PasswordHash((Argon2Hasher(*params),))
+
+
+# Функции уровня модуля, чтобы их можно было передать в ProcessPoolExecutor
+def _hash(params: Argon2Params, password: str) -> str:
+    return _password_hash(params).hash(password)
+
+
+def _verify(params: Argon2Params, password: str, hashed_password: str) -> bool:
+    return _password_hash(params).verify(password, hashed_password)
+
+
+def _verify_and_update(params: Argon2Params, password: str, hashed_password: str) -> tuple[bool, tp.Optional[str]]:
+    if not _verify(params, password, hashed_password):
+        return False, None
+    return True, _hash(params, password) if is_weaker(hashed_password, params) else None
+
+
+def is_weaker(hashed_password: str, params: Argon2Params) -> bool:
+    '''
+        Хеш получен с более слабыми параметрами, чем params (меньше итераций или памяти, старая версия argon2).
+        Хеш с более сильными или просто другими параметрами не пересчитывается: иначе процессы
+        с разными настройками переписывали бы его друг за другом при каждом входе
+    '''
+    try:
+        stored = argon2.extract_parameters(hashed_password)
+    except argon2.exceptions.InvalidHashError:
+        return True
+    return stored.type is not argon2.Type.ID \
+        or stored.version < argon2.low_level.ARGON2_VERSION \
+        or stored.time_cost < params.time_cost \
+        or stored.memory_cost < params.memory_cost
+
+
+def _measure_ms(params: Argon2Params, samples: int = 3) -> float:
+    hasher = Argon2Hasher(*params)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.hash("calibration")
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def calibrate_argon2(target_ms: float, params: Argon2Params = Argon2Params(),
+                     min_memory_cost: int = 19456, max_time_cost: int = 10) -> Argon2Params:
+    '''
+        Подбирает параметры argon2 так, чтобы одно хеширование занимало не больше target_ms
+        на текущем железе. Сначала уменьшается память (не ниже min_memory_cost, рекомендация OWASP),
+        затем увеличивается количество итераций, пока укладываемся в бюджет
+    '''
+    memory_cost = params.memory_cost
+    while memory_cost > min_memory_cost and _measure_ms(Argon2Params(1, memory_cost, params.parallelism)) > target_ms:
+        memory_cost = max(min_memory_cost, memory_cost // 2)
+
+    time_cost = 1
+    while time_cost < max_time_cost and _measure_ms(Argon2Params(time_cost + 1, memory_cost, params.parallelism)) <= target_ms:
+        time_cost += 1
+    return Argon2Params(time_cost, memory_cost, params.parallelism)
+
+
+class AsyncPasswordHash:
+    '''
+        Хеширование паролей argon2 вне event loop.
+        executor: process - пул процессов, thread - пул потоков, inline - прямо в event loop
+    '''
+    EXECUTORS = ("process", "thread", "inline")
+
+    def __init__(self, executor: str = "process", workers: tp.Optional[int] = None,
+                 params: Argon2Params = Argon2Params()):
+        if executor not in self.EXECUTORS:
+            raise ValueError(f"Unknown password hash executor: {executor}")
+        self.executor_kind = executor
+        self.workers = workers or default_hash_workers(settings.WEB_WORKERS)
+        self.params = params
+        self._executor: tp.Optional[Executor] = None
+
+    @property
+    def executor(self) -> tp.Optional[Executor]:
+        if self._executor is None and self.executor_kind == "process":
+            # spawn: fork из многопоточного процесса с event loop может привести к deadlock
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        elif self._executor is None and self.executor_kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, self.params, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, self.params, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, tp.Optional[str]]:
+        '''
+            Проверяет пароль и, если хеш слабее текущих параметров, возвращает новый хеш
+        '''
+        return await self._run(_verify_and_update, self.params, password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func: tp.Callable, *args):
+        if self.executor_kind == "inline":
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, func, *args)
+        except BrokenProcessPool:
+            # воркер пула убит (например, OOM) - пересоздаем пул и повторяем один раз
+            self.shutdown()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate argon2 parameters to a per-hash latency budget")
+    parser.add_argument("--target-ms", type=float, default=settings.ARGON2_TARGET_MS)
+    args = parser.parse_args()
+    params = calibrate_argon2(args.target_ms, Argon2Params(settings.ARGON2_TIME_COST, settings.ARGON2_MEMORY_COST,
+                                                           settings.ARGON2_PARALLELISM))
+    print(f"ARGON2_TIME_COST={params.time_cost}")
+    print(f"ARGON2_MEMORY_COST={params.memory_cost}")
+    print(f"ARGON2_PARALLELISM={params.parallelism}")
+    print(f"# {_measure_ms(params):.1f} ms per hash")
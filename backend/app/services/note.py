@@ -1,8 +1,16 @@
+import zlib
 from datetime import datetime
+import typing as tp
 
 from fastapi import Depends, HTTPException
+from pydantic import ValidationError
 from ..repository.note import NoteRepository, get_note_repository
-from ..entries.schemas import NoteSchema, CreateNoteSchema, CreateNoteInputSchema, UpdateNoteSchema, UserSchema
+from ..entries.schemas import NoteSchema, CreateNoteSchema, CreateNoteInputSchema, UpdateNoteSchema, UserSchema, \
+    NotePageSchema, BulkCreateNoteResultSchema, BulkNoteResultSchema, BulkNoteFilterSchema, BulkUpdateNoteSchema, \
+    BulkNoteChangeResultSchema, NoteSearchResultSchema, NoteSearchPageSchema, CompactNoteSchema, CompactNotePageSchema
+from .etag import note_etag, decode_note_etag, digest_etag, parse_etags
+from .pagination import encode_cursor, decode_cursor
+from settings import settings
 
 # check?
 
@@ -15,6 +23,90 @@ class NoteService:
         notes = [NoteSchema.model_validate(note_model, from_attributes=True) for note_model in note_models]
         return notes
 
+    async def get_page(self, limit: int, cursor: tp.Optional[str] = None,
+                       user: tp.Optional[UserSchema] = None, total: tp.Optional[int] = None) -> NotePageSchema:
+        '''
+            Страница заметок. Заметки пользователя user собираются с ним же, без загрузки связи note.user.
+            total - уже посчитанное точное число заметок (из get_collection_etag), чтобы не оценивать его заново
+        '''
+        note_models, next_cursor, total_estimate = await self._fetch_page(limit, cursor, user, user is None, total)
+        if user is None:
+            notes = [NoteSchema.model_validate(note_model, from_attributes=True) for note_model in note_models]
+        else:
+            notes = [NoteSchema(**self._note_fields(note_model), user=user) for note_model in note_models]
+        return NotePageSchema(items=notes, next_cursor=next_cursor, total_estimate=total_estimate)
+
+    async def get_compact_page(self, limit: int, cursor: tp.Optional[str] = None, user: tp.Optional[UserSchema] = None,
+                               total: tp.Optional[int] = None) -> CompactNotePageSchema:
+        note_models, next_cursor, total_estimate = await self._fetch_page(limit, cursor, user, False, total)
+        notes = [CompactNoteSchema(**self._note_fields(note_model), user_id=note_model.user_id) for note_model in note_models]
+        if user is None:
+            user_models = await self.repository.get_users(note.user_id for note in notes)
+            users = {user_model.id: UserSchema.model_validate(user_model, from_attributes=True) for user_model in user_models}
+        else:
+            users = {user.id: user} if notes else {}
+        return CompactNotePageSchema(items=notes, users=users, next_cursor=next_cursor, total_estimate=total_estimate)
+
+    async def _fetch_page(self, limit: int, cursor: tp.Optional[str], user: tp.Optional[UserSchema], load_user: bool,
+                          total: tp.Optional[int] = None) -> tuple[list, tp.Optional[str], tp.Optional[int]]:
+        '''
+            Оценка общего числа заметок нужна клиенту один раз - она считается только для первой страницы
+        '''
+        after = decode_cursor(cursor, datetime, int)
+        user_id = user.id if user is not None else None
+        note_models = await self.repository.get_page(limit + 1, after, user_id, load_user)
+        next_cursor = None
+        if len(note_models) > limit:
+            note_models = note_models[:limit]
+            next_cursor = encode_cursor(note_models[-1].created_at, note_models[-1].id)
+        total_estimate = None
+        if cursor is None:
+            total_estimate = total if total is not None else await self.repository.estimate_count(user_id)
+        return note_models, next_cursor, total_estimate
+
+    @staticmethod
+    def _note_fields(note_model) -> dict:
+        return {
+            "id": note_model.id, "title": note_model.title, "description": note_model.description,
+            "created_at": note_model.created_at, "updated_at": note_model.updated_at,
+        }
+
+    async def search(self, user: UserSchema, search_query: str, limit: int,
+                     cursor: tp.Optional[str] = None) -> NoteSearchPageSchema:
+        after = decode_cursor(cursor, float, int)
+        rows = await self.repository.search(user.id, search_query, limit + 1, after)
+        items = [
+            NoteSearchResultSchema(**dict(NoteSchema.model_validate(note_model, from_attributes=True)),
+                                   rank=rank, snippet=snippet)
+            for note_model, rank, snippet in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(items[-1].rank, items[-1].id)
+        return NoteSearchPageSchema(items=items, next_cursor=next_cursor)
+
+    async def export(self, batch_size: int, user_id: tp.Optional[int] = None, since: tp.Optional[datetime] = None,
+                     until: tp.Optional[datetime] = None, compress: bool = False) -> tp.AsyncIterator[bytes]:
+        '''
+            NDJSON-выгрузка заметок (по строке NoteSchema на заметку), опционально в gzip.
+            В памяти держится только одна пачка строк
+        '''
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        async for rows in self.repository.stream(batch_size, user_id, since, until):
+            chunk = b"".join(self._export_line(row) for row in rows)
+            yield compressor.compress(chunk) if compressor else chunk
+        if compressor:
+            yield compressor.flush()
+
+    @staticmethod
+    def _export_line(row) -> bytes:
+        note = NoteSchema(
+            id=row["id"], title=row["title"], description=row["description"],
+            created_at=row["created_at"], updated_at=row["updated_at"],
+            user=UserSchema(id=row["user_id"], username=row["username"], created_at=row["user_created_at"]),
+        )
+        return note.model_dump_json().encode() + b"\n"
+
     async def get_by_id(self, id: int):
         note_model = await self.repository.get_by_id(id)
         if note_model:
@@ -33,6 +125,108 @@ class NoteService:
         await self.repository.create(create_note)
         return create_note
 
+    async def create_many(self, user: UserSchema, items: list[tp.Any]) -> BulkCreateNoteResultSchema:
+        '''
+            Массовое создание заметок: невалидные элементы пропускаются с ошибками,
+            валидные пишутся одним запросом
+        '''
+        if len(items) > settings.NOTE_BULK_MAX_ITEMS:
+            raise HTTPException(status_code=413,
+                                detail=f"At most {settings.NOTE_BULK_MAX_ITEMS} notes per request")
+        results = [BulkNoteResultSchema(index=index) for index in range(len(items))]
+        valid = []
+        created_at = datetime.now()
+        for result, item in zip(results, items):
+            try:
+                note = CreateNoteInputSchema.model_validate(item)
+            except ValidationError as e:
+                result.errors = e.errors(include_url=False, include_context=False, include_input=False)
+                continue
+            valid.append((result, CreateNoteSchema(**note.model_dump(), user_id=user.id, created_at=created_at)))
+
+        if valid:
+            ids = await self.repository.create_many([note for _, note in valid])
+            for (result, _), note_id in zip(valid, ids):
+                result.id = note_id
+        return BulkCreateNoteResultSchema(created=len(valid), results=results)
+
+    async def update_many(self, user: UserSchema, data: BulkUpdateNoteSchema) -> BulkNoteChangeResultSchema:
+        self._check_bulk_size(data)
+        values = data.update.model_dump(exclude_unset=True, exclude_none=True)
+        if not values:
+            raise HTTPException(status_code=400, detail="Nothing to update")
+        affected = await self.repository.update_many(user.id, values, data.ids, data.since, data.until)
+        return self._change_result(data, affected)
+
+    async def delete_many(self, user: UserSchema, data: BulkNoteFilterSchema) -> BulkNoteChangeResultSchema:
+        self._check_bulk_size(data)
+        affected = await self.repository.delete_many(user.id, data.ids, data.since, data.until)
+        return self._change_result(data, affected)
+
+    @staticmethod
+    def _check_bulk_size(data: BulkNoteFilterSchema):
+        if data.ids is not None and len(data.ids) > settings.NOTE_BULK_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"At most {settings.NOTE_BULK_MAX_ITEMS} notes per request")
+
+    @staticmethod
+    def _change_result(data: BulkNoteFilterSchema, affected: list[int]) -> BulkNoteChangeResultSchema:
+        '''
+            Отклоненные - запрошенные id, которые не найдены или принадлежат другому пользователю
+        '''
+        affected_ids = set(affected)
+        rejected = sorted(set(data.ids or ()) - affected_ids)
+        return BulkNoteChangeResultSchema(affected=sorted(affected_ids), rejected=rejected)
+
+    async def get_version(self, note_id: int) -> tuple[int, datetime]:
+        version = await self.repository.get_version(note_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Note not found")
+        return version
+
+    async def get_collection_etag(self, user: UserSchema, limit: int, cursor: tp.Optional[str] = None,
+                                  *representation: str) -> tuple[str, int]:
+        '''
+            ETag страницы заметок пользователя и точное число его заметок, посчитанное тем же запросом
+        '''
+        count, latest, max_id = await self.repository.collection_version(user.id)
+        return digest_etag(user.id, user.username, count, latest, max_id, limit, cursor, *representation), count
+
+    async def update_owned(self, note_id: int, user: UserSchema, note: UpdateNoteSchema,
+                           if_match: tp.Optional[str] = None) -> NoteSchema:
+        '''
+            Обновление заметки владельцем одним запросом. 404/403/412 различаются только при неудаче.
+            С If-Match обновление применяется, только если заметка не менялась с выдачи ETag
+        '''
+        versions = self._if_match_versions(note_id, if_match) if if_match is not None else None
+        values = note.model_dump(exclude_unset=True, exclude_none=True)
+        row = await self.repository.update_owned(note_id, user.id, values, versions) if values else None
+        if row is not None:
+            return NoteSchema(**self._note_fields(row), user=user)
+
+        owner_id, version = await self.get_version(note_id)
+        if owner_id != user.id:
+            raise HTTPException(status_code=403)
+        if versions is not None and version not in versions:
+            raise HTTPException(status_code=412, detail="Precondition failed")
+        # менять нечего: запись не выполнялась
+        return await self.get_by_id(note_id)
+
+    async def delete_owned(self, note_id: int, user: UserSchema):
+        if not await self.repository.delete_owned(note_id, user.id):
+            await self.get_version(note_id)
+            raise HTTPException(status_code=403)
+        raise HTTPException(status_code=204, detail="Note deleted")
+
+    @staticmethod
+    def _if_match_versions(note_id: int, if_match: str) -> tp.Optional[list[datetime]]:
+        etags = parse_etags(if_match)
+        if etags == ["*"]:
+            return None
+        versions = [version for etag_id, version in map(decode_note_etag, etags) if etag_id == note_id]
+        if not versions:
+            raise HTTPException(status_code=412, detail="Precondition failed")
+        return versions
+
     async def update(self, note_id: int, note: UpdateNoteSchema):
         updated_note = await self.repository.update(note_id, note)
         if updated_note:
@@ -44,5 +238,5 @@ class NoteService:
         raise HTTPException(status_code=204, detail="Note deleted")
 
 
-def get_note_service(repository: NoteRepository = Depends(get_note_repository)) -> NoteService:
+async def get_note_service(repository: NoteRepository = Depends(get_note_repository)) -> NoteService:
     return NoteService(repository)
\ No newline at end of file
@@ -0,0 +1,29 @@
+import base64
+import json
+from datetime import datetime
+import typing as tp
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*values: tp.Any) -> str:
+    '''
+        Непрозрачный курсор для keyset-пагинации: значения ключа сортировки последней записи страницы
+    '''
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: tp.Optional[str], *types: type) -> tp.Optional[tuple]:
+    if cursor is None:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(payload) != len(types):
+            raise ValueError(cursor)
+        return tuple(
+            datetime.fromisoformat(value) if type_ is datetime else type_(value)
+            for value, type_ in zip(payload, types)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
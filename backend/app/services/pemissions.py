@@ -1,10 +1,16 @@
+import typing as tp
+from datetime import datetime
+
 from fastapi import Depends, HTTPException
 from starlette.status import HTTP_403_FORBIDDEN
 
-from ..entries.schemas import UserSchema, UpdateNoteSchema, UpdateUserInputSchema
+from ..entries.schemas import UserSchema, UpdateNoteSchema, UpdateUserInputSchema, BulkNoteFilterSchema, \
+    BulkUpdateNoteSchema
+from .etag import note_etag
 from .note import NoteService, get_note_service
 from .token import get_current_user
 from .user import UserService, get_user_service
+from settings import settings
 
 
 class NotePermission:
@@ -12,30 +18,54 @@ class NotePermission:
         self.user = user
         self.service = service
 
-    async def read_all(self):
-        obj = await self.service.get_all()
+    async def read_all(self, limit: int, cursor: tp.Optional[str] = None, compact: bool = False):
         if self.user.username == "admin":
-            return obj
+            if compact:
+                return await self.service.get_compact_page(limit, cursor)
+            return await self.service.get_page(limit, cursor)
         raise HTTPException(status_code=HTTP_403_FORBIDDEN)
 
 
+    def export(self, user_id: tp.Optional[int] = None, since: tp.Optional[datetime] = None,
+               until: tp.Optional[datetime] = None, compress: bool = False) -> tp.AsyncIterator[bytes]:
+        '''
+            Админ выгружает заметки любого пользователя или все, остальные - только свои
+        '''
+        if self.user.username != "admin":
+            if user_id is not None and user_id != self.user.id:
+                raise HTTPException(status_code=HTTP_403_FORBIDDEN)
+            user_id = self.user.id
+        return self.service.export(settings.NOTE_EXPORT_BATCH_SIZE, user_id, since, until, compress)
+
+    async def owner_etag(self, id: int) -> str:
+        '''
+            ETag заметки по (id, updated_at) без загрузки всей строки
+        '''
+        owner_id, version = await self.service.get_version(id)
+        if owner_id == self.user.id:
+            return note_etag(id, version, self.user.username)
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN)
+
     async def is_owner_read(self, id: int):
         obj = await self.service.get_by_id(id)
         if obj.user.id == self.user.id:
             return obj
         raise HTTPException(status_code=HTTP_403_FORBIDDEN)
 
-    async def is_owner_update(self, id: int, update_data: UpdateNoteSchema):
-        obj = await self.service.get_by_id(id)
-        if obj.user.id == self.user.id:
-            return await self.service.update(id, update_data)
-        raise HTTPException(status_code=HTTP_403_FORBIDDEN)
+    async def is_owner_update(self, id: int, update_data: UpdateNoteSchema, if_match: tp.Optional[str] = None):
+        '''
+            Проверка владельца входит в сам UPDATE (WHERE user_id = :me)
+        '''
+        return await self.service.update_owned(id, self.user, update_data, if_match)
 
     async def is_owner_delete(self, id: int):
-        obj = await self.service.get_by_id(id)
-        if obj.user.id == self.user.id:
-            return await self.service.delete(id)
-        raise HTTPException(status_code=HTTP_403_FORBIDDEN)
+        return await self.service.delete_owned(id, self.user)
+
+    async def owner_update_many(self, data: BulkUpdateNoteSchema):
+        return await self.service.update_many(self.user, data)
+
+    async def owner_delete_many(self, data: BulkNoteFilterSchema):
+        return await self.service.delete_many(self.user, data)
 
 class UserPermission:
     def __init__(self, user: UserSchema, service: UserService):
@@ -43,22 +73,22 @@ class UserPermission:
         self.service = service
 
     async def is_owner_update(self, id: int, update_data: UpdateUserInputSchema):
-        obj = await self.service.get_by_id(id)
-        if obj.id == self.user.id:
+        if id == self.user.id:
             return await self.service.update(id, update_data)
+        await self.service.get_by_id(id)
         raise HTTPException(status_code=HTTP_403_FORBIDDEN)
 
     async def is_owner_delete(self, id: int):
-        obj = await self.service.get_by_id(id)
-        if obj.id == self.user.id:
+        if id == self.user.id:
             return await self.service.delete(id)
+        await self.service.get_by_id(id)
         raise HTTPException(status_code=HTTP_403_FORBIDDEN)
 
 
-def get_note_permission(user: UserSchema = Depends(get_current_user), service: NoteService = Depends(get_note_service)):
+async def get_note_permission(user: UserSchema = Depends(get_current_user), service: NoteService = Depends(get_note_service)):
     return NotePermission(user, service)
 
-def get_user_permission(user: UserSchema = Depends(get_current_user), service: UserService = Depends(get_user_service)):
+async def get_user_permission(user: UserSchema = Depends(get_current_user), service: UserService = Depends(get_user_service)):
     return UserPermission(user, service)
 
 
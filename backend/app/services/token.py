@@ -1,45 +1,182 @@
+import hashlib
+import secrets
+import time
+import uuid
 from datetime import timedelta, datetime, timezone
+import typing as tp
 
-import jwt
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from jwt import InvalidTokenError
 
-from ..entries.schemas import oauth2_scheme
+from ..cache.principal import PrincipalCache
+from ..cache.revocation import RevocationList
+from ..container import container
+from ..entries.schemas import oauth2_scheme, TokenRequestForm, UserSchema
+from ..repository.refresh_token import RefreshTokenRepository, get_refresh_token_repository
+from ..repository.revoked_token import RevokedTokenRepository, get_revoked_token_repository
+from .admission import LoginAdmission
+from .token_codec import TokenCodec
 from .user import UserService, get_user_service
 from settings import settings
 
 
 class TokenService:
-    def __init__(self, user_service: UserService):
+    def __init__(self, user_service: UserService, principal_cache: tp.Optional[PrincipalCache] = None,
+                 login_admission: tp.Optional[LoginAdmission] = None,
+                 refresh_repository: tp.Optional[RefreshTokenRepository] = None,
+                 revocation_list: tp.Optional[RevocationList] = None,
+                 revoked_repository: tp.Optional[RevokedTokenRepository] = None,
+                 codec: tp.Optional[TokenCodec] = None):
         self.user_service = user_service
+        self.principal_cache = principal_cache
+        self.login_admission = login_admission
+        self.refresh_repository = refresh_repository
+        self.revocation_list = revocation_list
+        self.revoked_repository = revoked_repository
+        self.codec = codec or container.token_codec
 
 
     def create_access_token(self, data: dict):
-        to_encode = data.copy()
-        expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-        to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, settings.AUTH_SECRET_KEY, algorithm=settings.AUTH_ALGORITHM)
-        return encoded_jwt
+        return self.codec.encode(data)
 
     async def get_token(self, form_data: OAuth2PasswordRequestForm):
-        user = await self.user_service.authenticate(form_data.username, form_data.password)
-        access_token = self.create_access_token(
-            data={"sub": user.username}
-        )
-        return {"access_token": access_token, "token_type": "bearer"}
+        if self.login_admission is None:
+            user = await self.user_service.authenticate(form_data.username, form_data.password)
+        else:
+            async with self.login_admission.admit():
+                user = await self.user_service.authenticate(form_data.username, form_data.password)
+        result = self._access_token_response(user)
+        if self.refresh_repository is not None:
+            refresh_token, token_hash, family_id, expires_at = self._new_refresh_token(uuid.uuid4().bytes)
+            await self.refresh_repository.create(token_hash, family_id, user.id, expires_at)
+            result["refresh_token"] = refresh_token
+        return result
 
-    async def get_current_user(self, token: str):
+    async def refresh(self, refresh_token: str):
+        '''
+            Обмен refresh-токена на новую пару токенов без проверки пароля.
+            Каждый refresh-токен одноразовый: повторное использование отзывает все семейство
+        '''
+        found = await self.refresh_repository.get_by_hash(self._hash_refresh_token(refresh_token))
+        if found is None:
+            raise HTTPException(status_code=401)
+        token_model, user_model = found
+        if token_model.used:
+            await self.refresh_repository.revoke_family(token_model.family_id)
+            raise HTTPException(status_code=401)
+        expires_at = token_model.expires_at
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at <= datetime.now(timezone.utc):
+            raise HTTPException(status_code=401)
+
+        user = UserSchema.model_validate(user_model, from_attributes=True)
+        new_refresh_token, token_hash, family_id, expires_at = self._new_refresh_token(token_model.family_id)
+        if not await self.refresh_repository.rotate(token_model.id, token_hash, family_id, user.id, expires_at):
+            await self.refresh_repository.revoke_family(token_model.family_id)
+            raise HTTPException(status_code=401)
+
+        result = self._access_token_response(user)
+        result["refresh_token"] = new_refresh_token
+        return result
+
+    async def revoke(self, token: str, refresh_token: tp.Optional[str] = None):
+        '''
+            Отзыв access-токена по jti и, если передан, всего семейства refresh-токена.
+            Истекший access-токен тоже принимается (клиент выходит после простоя), подпись проверяется.
+            Владелец refresh-токена сверяется по id пользователя: username мог смениться после выдачи
+        '''
+        payload = self._decode(token, verify_exp=False)
+        jti = payload.get("jti")
+        expires_at = datetime.fromtimestamp(payload["exp"], timezone.utc)
+        if jti and self.revoked_repository is not None and expires_at > datetime.now(timezone.utc):
+            await self.revoked_repository.create(jti, expires_at)
+            if self.revocation_list is not None:
+                self.revocation_list.add(jti)
+        if refresh_token and self.refresh_repository is not None:
+            found = await self.refresh_repository.get_by_hash(self._hash_refresh_token(refresh_token))
+            if found is not None and found[1].id == await self._token_user_id(payload):
+                await self.refresh_repository.revoke_family(found[0].family_id)
+
+    async def grant(self, form_data: TokenRequestForm):
+        if form_data.grant_type == "refresh_token":
+            if not form_data.refresh_token or self.refresh_repository is None:
+                raise HTTPException(status_code=400, detail="refresh_token is required")
+            return await self.refresh(form_data.refresh_token)
+        if not form_data.username or not form_data.password:
+            raise HTTPException(status_code=400, detail="username and password are required")
+        return await self.get_token(form_data)
+
+    def _access_token_response(self, user: UserSchema) -> dict:
+        data = {"sub": user.username}
+        if settings.AUTH_EMBED_USER_CLAIMS:
+            data.update({"uid": user.id, "created_at": user.created_at.isoformat()})
+        access_token = self.create_access_token(data=data)
+        return {
+            "access_token": access_token,
+            "token_type": "bearer",
+            "expires_in": int(self.codec.access_token_ttl.total_seconds()),
+        }
+
+    def _new_refresh_token(self, family_id: bytes) -> tuple[str, bytes, bytes, datetime]:
+        refresh_token = secrets.token_urlsafe(32)
+        expires_at = datetime.now(timezone.utc) + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+        return refresh_token, self._hash_refresh_token(refresh_token), family_id, expires_at
+
+    @staticmethod
+    def _hash_refresh_token(refresh_token: str) -> bytes:
+        return hashlib.sha256(refresh_token.encode()).digest()
+
+    def _decode(self, token: str, verify_exp: bool = True) -> dict:
         try:
-            payload = jwt.decode(token, settings.AUTH_SECRET_KEY, algorithms=[settings.AUTH_ALGORITHM])
-            username = payload.get("sub")
+            return self.codec.decode(token, verify_exp=verify_exp)
         except InvalidTokenError:
             raise HTTPException(status_code=401)
-        user = await self.user_service.get_by_username(username)
+
+    async def _token_user_id(self, payload: dict) -> tp.Optional[int]:
+        '''
+            id владельца access-токена: из claim uid, иначе по username; None, если пользователя уже нет
+        '''
+        if "uid" in payload:
+            return payload["uid"]
+        try:
+            return (await self.user_service.get_by_username(payload.get("sub"))).id
+        except HTTPException:
+            return None
+
+    async def get_current_user(self, token: str):
+        payload = self._decode(token)
+        username = payload.get("sub")
+        jti = payload.get("jti")
+        if self.revocation_list is not None:
+            if jti and self.revocation_list.is_revoked(jti):
+                raise HTTPException(status_code=401)
+            # пользователь переименован или удален после выдачи токена (в том числе на другом поде)
+            if self.revocation_list.is_subject_revoked(username, payload.get("exp")):
+                raise HTTPException(status_code=401)
+        if self.principal_cache is None:
+            return await self.user_service.get_by_username(username)
+
+        user = self.principal_cache.get(token, payload)
+        if user is None:
+            loaded_at = time.time()
+            user = await self.user_service.get_by_username(username)
+            self.principal_cache.set(token, user, loaded_at)
         return user
 
-def get_token_service(user_service: UserService = Depends(get_user_service)):
-    return TokenService(user_service)
+async def get_token_service(user_service: UserService = Depends(get_user_service),
+                            refresh_repository: RefreshTokenRepository = Depends(get_refresh_token_repository),
+                            revoked_repository: RevokedTokenRepository = Depends(get_revoked_token_repository)):
+    return TokenService(
+        user_service,
+        principal_cache=container.principal_cache,
+        login_admission=container.login_admission,
+        refresh_repository=refresh_repository,
+        revocation_list=container.revocation_list,
+        revoked_repository=revoked_repository,
+        codec=container.token_codec,
+    )
 
 async def get_current_user(
     token_service: TokenService = Depends(get_token_service),
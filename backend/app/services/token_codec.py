@@ -0,0 +1,29 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import jwt
+
+
+class TokenCodec:
+    '''
+        Выпуск и проверка access-токенов (JWT). Создается один раз на приложение
+    '''
+    def __init__(self, secret_key: str, algorithm: str, access_token_ttl: timedelta):
+        self.algorithm = algorithm
+        self.access_token_ttl = access_token_ttl
+        self._secret_key = secret_key
+        self._algorithms = [algorithm]
+        self._jwt = jwt.PyJWT()
+
+    def encode(self, data: dict) -> str:
+        to_encode = data.copy()
+        now = datetime.now(timezone.utc)
+        to_encode.update({"exp": now + self.access_token_ttl, "iat": now, "jti": uuid.uuid4().hex})
+        return self._jwt.encode(to_encode, self._secret_key, algorithm=self.algorithm)
+
+    def decode(self, token: str, verify_exp: bool = True) -> dict:
+        '''
+            verify_exp=False - для выхода с истекшим access-токеном; подпись проверяется всегда
+        '''
+        return self._jwt.decode(token, self._secret_key, algorithms=self._algorithms,
+                                options={"verify_exp": verify_exp})
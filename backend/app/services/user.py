@@ -1,18 +1,22 @@
 from datetime import datetime
 
-from argon2 import PasswordHasher
+import typing as tp
+
 from fastapi import Depends, HTTPException
-from pwdlib import PasswordHash
+from sqlalchemy.exc import IntegrityError
 
 from ..entries.schemas import UserSchema, CreateUserInputSchema, CreateUserSchema, \
-    UpdateUserInputSchema, UserAdditionalSchema
+    UpdateUserInputSchema, UserAdditionalSchema, UserPageSchema
 from ..repository.user import UserRepository, get_user_repository
+from ..container import container
+from .hashing import AsyncPasswordHash
+from .pagination import encode_cursor, decode_cursor
 
 
 class UserService:
-    def __init__(self, repository: UserRepository):
+    def __init__(self, repository: UserRepository, password_hasher: tp.Optional[AsyncPasswordHash] = None):
         self.repository = repository
-        self.password_hasher = PasswordHash.recommended()
+        self.password_hasher = password_hasher or container.password_hash
 
 
     async def get_all(self):
@@ -20,6 +24,13 @@ class UserService:
         users = [UserSchema.model_validate(user_model, from_attributes=True) for user_model in user_models]
         return users
 
+    async def get_page(self, limit: int, cursor: tp.Optional[str] = None, prefix: tp.Optional[str] = None) -> UserPageSchema:
+        after = decode_cursor(cursor, str)
+        rows = await self.repository.get_page(limit + 1, after[0] if after else None, prefix)
+        users = [UserSchema(id=row.id, username=row.username, created_at=row.created_at) for row in rows[:limit]]
+        next_cursor = encode_cursor(users[-1].username) if len(rows) > limit else None
+        return UserPageSchema(items=users, next_cursor=next_cursor)
+
     async def get_by_id(self, id: int):
         user_model = await self.repository.get_by_id(id)
         if user_model:
@@ -44,15 +55,18 @@ class UserService:
             raise HTTPException(status_code=400, detail="User already exists")
         create_user = CreateUserSchema(
             username=user.username,
-            password=self.get_password_hash(user.password),
+            password=await self.get_password_hash(user.password),
             created_at=datetime.now(),
         )
         await self.repository.create(create_user)
         return create_user
 
     async def update(self, id: int, user: UpdateUserInputSchema):
-        user.password = self.get_password_hash(user.password) if user.password else None
-        updated_user = await self.repository.update(id, user)
+        user.password = await self.get_password_hash(user.password) if user.password else None
+        try:
+            updated_user = await self.repository.update(id, user)
+        except IntegrityError:
+            raise HTTPException(status_code=400, detail="User already exists")
         if updated_user:
             return UserSchema.model_validate(updated_user, from_attributes=True)
         raise HTTPException(status_code=404, detail="User not found")
@@ -66,17 +80,20 @@ class UserService:
         if not user:
             raise HTTPException(status_code=401)
 
-        user = CreateUserSchema.model_validate(user, from_attributes=True)
-        if self.verify_password(password, user.password):
-            return user
-        raise HTTPException(status_code=401)
+        valid, updated_hash = await self.password_hasher.verify_and_update(password, user.password)
+        if not valid:
+            raise HTTPException(status_code=401)
+        if updated_hash:
+            # хеш слабее текущих параметров argon2 - пересчитываем при успешном входе
+            await self.repository.update(user.id, UpdateUserInputSchema(password=updated_hash))
+        return UserSchema.model_validate(user, from_attributes=True)
 
-    def get_password_hash(self, password: str) -> str:
-        return self.password_hasher.hash(password)
+    async def get_password_hash(self, password: str) -> str:
+        return await self.password_hasher.hash(password)
 
-    def verify_password(self, password: str, hashed_password: str) -> bool:
-        return self.password_hasher.verify(password, hashed_password)
+    async def verify_password(self, password: str, hashed_password: str) -> bool:
+        return await self.password_hasher.verify(password, hashed_password)
 
 
-def get_user_service(repository: UserRepository = Depends(get_user_repository)) -> UserService:
+async def get_user_service(repository: UserRepository = Depends(get_user_repository)) -> UserService:
     return UserService(repository)
\ No newline at end of file
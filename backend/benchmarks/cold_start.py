@@ -0,0 +1,143 @@
+'''
+    Холодный старт: разбор python -X importtime для import app.main и время до первого ответа
+    сервера python -m app.serve (один воркер, SQLite-файл, схема уже применена - как при рестарте пода).
+
+        cd backend
+        python -m benchmarks.cold_start --runs 3
+        python -m benchmarks.cold_start --no-bytecode   # как в образе без предкомпилированных .pyc
+        python -m benchmarks.cold_start --budget 5      # код выхода 1, если медиана до ready дольше бюджета
+
+    Замер по времени не входит в pytest: на нагруженном CI он нестабилен. В тестах проверяется только,
+    какие модули импортирует app.main
+'''
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing as tp
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def importtime(env: tp.Optional[dict] = None) -> list[tuple[str, int, int, int]]:
+    '''
+        (модуль, собственное время мкс, накопленное мкс, глубина) для каждого импорта app.main
+    '''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def import_breakdown(rows: list[tuple[str, int, int, int]]) -> dict[str, int]:
+    '''
+        Собственное время импорта, сложенное по пакетам верхнего уровня (fastapi, sqlalchemy, ...); модули app - по отдельности
+    '''
+    totals: dict[str, int] = {}
+    for name, self_us, _, _ in rows:
+        package = name if name.startswith("app.") else name.split(".")[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(env: dict, timeout: float = 60) -> dict[str, float]:
+    '''
+        Секунды от запуска процесса до первого ответа /api/health/live, до ready и первого чтения из БД
+    '''
+    port = free_port()
+    env = {**env, "WEB_WORKERS": "1", "WEB_PORT": str(port), "HOST_IP": "127.0.0.1"}
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "app.serve"], cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    timings: dict[str, float] = {}
+    try:
+        with httpx.Client(base_url=base_url) as client:
+            while "ready" not in timings:
+                if time.perf_counter() - started > timeout or server.poll() is not None:
+                    raise RuntimeError("server did not become ready")
+                try:
+                    if "live" not in timings and client.get("/api/health/live").status_code == 200:
+                        timings["live"] = time.perf_counter() - started
+                    if client.get("/api/health/ready").status_code == 200:
+                        timings["ready"] = time.perf_counter() - started
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            client.get("/api/user/?limit=1").raise_for_status()
+            timings["first_query"] = time.perf_counter() - started
+        return timings
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def bench_env(tmp: str, no_bytecode: bool = False) -> dict:
+    env = {
+        **os.environ,
+        "DB_URL": f"sqlite+aiosqlite:///{os.path.join(tmp, 'cold.db')}",
+        "PASSWORD_HASH_EXECUTOR": "inline",
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(tmp, "metrics"),
+    }
+    os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    if no_bytecode:
+        # пустой кэш байткода и запрет записи: каждый импорт компилирует исходники заново
+        env["PYTHONPYCACHEPREFIX"] = os.path.join(tmp, "pycache")
+        env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def init_schema(env: dict):
+    subprocess.run([sys.executable, "-m", "app.db.db"], cwd=BACKEND_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = bench_env(tmp, args.no_bytecode)
+        init_schema(env)
+
+        rows = importtime(env)
+        total = sum(self_us for _, self_us, _, _ in rows)
+        print(f"import app.main: {total / 1e3:.0f} ms, {len(rows)} modules")
+        for package, self_us in list(import_breakdown(rows).items())[:args.top]:
+            print(f"  {package:<32}{self_us / 1e3:>8.1f} ms")
+
+        runs = [time_to_first_response(env) for _ in range(args.runs)]
+        print(f"\n{'median of ' + str(args.runs):<16}{'live':>8}{'ready':>8}{'first query':>13}  (s from process start)")
+        print(f"{'':<16}" + "".join(
+            f"{statistics.median(run[key] for run in runs):>{width}.2f}"
+            for key, width in (("live", 8), ("ready", 8), ("first_query", 13))
+        ))
+
+        ready = statistics.median(run["ready"] for run in runs)
+        if args.budget is not None and ready > args.budget:
+            print(f"\nready after {ready:.2f}s exceeds the {args.budget:.2f}s budget")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--no-bytecode", action="store_true")
+    parser.add_argument("--budget", type=float, default=None, help="max median seconds from process start to ready")
+    main(parser.parse_args())
@@ -0,0 +1,119 @@
+'''
+    Накладные расходы на разрешение зависимостей одного запроса.
+
+    legacy    - цепочка как до контейнера: синхронные фабрики (каждую FastAPI выполняет в threadpool)
+                и PasswordHash.recommended() в конструкторе UserService на каждый запрос.
+    container - текущие фабрики app.repository/app.services поверх app.container.
+    Обе цепочки получают пользователя из кэша по токену, в БД запросов нет.
+    Из времени запроса вычитается запрос к эндпоинту без зависимостей.
+    dependency_overrides не используются: с ними FastAPI перестраивает граф на каждый запрос.
+
+        cd backend
+        python -m benchmarks.dependency_resolution --requests 3000
+'''
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+import httpx
+from fastapi import Depends, FastAPI
+from pwdlib import PasswordHash
+
+from app.container import container
+from app.db.db import db
+from app.entries.schemas import UserSchema, oauth2_scheme
+from app.repository.note import NoteRepository
+from app.repository.refresh_token import RefreshTokenRepository
+from app.repository.revoked_token import RevokedTokenRepository
+from app.repository.user import UserRepository
+from app.services.note import NoteService
+from app.services.pemissions import NotePermission, get_note_permission
+from app.services.token import TokenService, get_token_service
+from app.services.user import UserService
+
+USER = UserSchema(id=1, username="bench", created_at=datetime.now())
+TOKEN = container.token_codec.encode({"sub": USER.username})
+HEADERS = {"Authorization": f"Bearer {TOKEN}"}
+
+
+class LegacyUserService(UserService):
+    def __init__(self, repository):
+        super().__init__(repository)
+        self.password_hasher_legacy = PasswordHash.recommended()
+
+
+def legacy_get_user_repository(session=Depends(db.get_session)):
+    return UserRepository(session)
+
+def legacy_get_user_service(repository=Depends(legacy_get_user_repository)):
+    return LegacyUserService(repository)
+
+def legacy_get_refresh_token_repository(session=Depends(db.get_session)):
+    return RefreshTokenRepository(session)
+
+def legacy_get_revoked_token_repository(session=Depends(db.get_session)):
+    return RevokedTokenRepository(session)
+
+def legacy_get_token_service(user_service=Depends(legacy_get_user_service),
+                             refresh_repository=Depends(legacy_get_refresh_token_repository),
+                             revoked_repository=Depends(legacy_get_revoked_token_repository)):
+    return TokenService(user_service, principal_cache=container.principal_cache,
+                        refresh_repository=refresh_repository, revoked_repository=revoked_repository)
+
+async def legacy_get_current_user(token_service=Depends(legacy_get_token_service), token=Depends(oauth2_scheme)):
+    return await token_service.get_current_user(token)
+
+def legacy_get_note_repository(session=Depends(db.get_session)):
+    return NoteRepository(session)
+
+def legacy_get_note_service(repository=Depends(legacy_get_note_repository)):
+    return NoteService(repository)
+
+def legacy_get_note_permission(user=Depends(legacy_get_current_user), service=Depends(legacy_get_note_service)):
+    return NotePermission(user, service)
+
+
+app = FastAPI()
+
+
+@app.get("/baseline")
+async def baseline():
+    return None
+
+@app.get("/legacy")
+async def legacy(permission=Depends(legacy_get_note_permission), token_service=Depends(legacy_get_token_service)):
+    return None
+
+@app.get("/container")
+async def current(permission: NotePermission = Depends(get_note_permission),
+                  token_service: TokenService = Depends(get_token_service)):
+    return None
+
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int) -> float:
+    for _ in range(100):
+        await client.get(path, headers=HEADERS)
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path, headers=HEADERS)
+    response.raise_for_status()
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def main(args):
+    container.principal_cache.set(TOKEN, USER)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        baseline_us = await measure(client, "/baseline", args.requests)
+        print(f"{'chain':<12}{'us/request':>12}{'deps us':>12}")
+        print(f"{'baseline':<12}{baseline_us:>12.1f}{0:>12.1f}")
+        for path in ("legacy", "container"):
+            request_us = await measure(client, f"/{path}", args.requests)
+            print(f"{path:<12}{request_us:>12.1f}{request_us - baseline_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+'''
+    Задержка /api/note/me, пока /api/token под нагрузкой.
+
+    Приложение запускается в том же event loop (как один воркер uvicorn) поверх
+    временной SQLite базы. Для каждого режима хеширования паролей выводятся p50/p99
+    задержки /api/note/me без нагрузки и во время шторма логинов.
+
+        cd backend
+        python -m benchmarks.login_contention --executor all --duration 5 --login-concurrency 8
+'''
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+import httpx
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app.db.db import db
+from app.main import app
+from app.container import container
+from app.services.hashing import AsyncPasswordHash
+
+CREDENTIALS = {"username": "admin", "password": "admin"}
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def probe(client: httpx.AsyncClient, headers: dict, stop: asyncio.Event) -> list:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get("/api/note/me", headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+        await asyncio.sleep(0.005)
+    return latencies
+
+
+async def login_storm(client: httpx.AsyncClient, stop: asyncio.Event) -> int:
+    logins = 0
+    while not stop.is_set():
+        response = await client.post("/api/token/", data=CREDENTIALS)
+        response.raise_for_status()
+        logins += 1
+    return logins
+
+
+async def run(client: httpx.AsyncClient, headers: dict, duration: float, login_concurrency: int):
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(client, headers, stop))
+    login_tasks = [asyncio.create_task(login_storm(client, stop)) for _ in range(login_concurrency)]
+    await asyncio.sleep(duration)
+    stop.set()
+    latencies = await probe_task
+    logins = sum(await asyncio.gather(*login_tasks))
+    return latencies, logins
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        db.url = f"sqlite+aiosqlite:///{directory}/bench.db"
+        db.engine = create_async_engine(db.url, echo=False)
+        db.session_factory = async_sessionmaker(bind=db.engine, expire_on_commit=False)
+        await db.init_tables()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post("/api/token/", data=CREDENTIALS)
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            password_hash = container.password_hash
+            executors = AsyncPasswordHash.EXECUTORS if args.executor == "all" else [args.executor]
+            print(f"{'executor':<10}{'load':<8}{'requests':>10}{'p50 ms':>10}{'p99 ms':>10}{'logins/s':>10}")
+            for executor in executors:
+                password_hash.shutdown()
+                password_hash.executor_kind = executor
+                # прогрев пула, чтобы не мерить запуск воркеров
+                await password_hash.verify("admin", await password_hash.hash("admin"))
+
+                for login_concurrency in (0, args.login_concurrency):
+                    latencies, logins = await run(client, headers, args.duration, login_concurrency)
+                    print(f"{executor:<10}{login_concurrency:<8}{len(latencies):>10}"
+                          f"{statistics.median(latencies):>10.2f}{percentile(latencies, 0.99):>10.2f}"
+                          f"{logins / args.duration:>10.1f}")
+            password_hash.shutdown()
+        await db.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--executor", choices=list(AsyncPasswordHash.EXECUTORS) + ["all"], default="all")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--login-concurrency", type=int, default=8)
+    asyncio.run(main(parser.parse_args()))
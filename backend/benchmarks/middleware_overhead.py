@@ -0,0 +1,92 @@
+'''
+    Накладные расходы middleware метрик на запрос к пустому эндпоинту.
+
+    none      - приложение без middleware метрик.
+    call_next - прежняя реализация через app.middleware("http") (BaseHTTPMiddleware).
+    asgi      - текущий PrometheusMiddleware.
+    ASGI-приложение вызывается напрямую, без сервера и HTTP-клиента.
+
+        cd backend
+        python -m benchmarks.middleware_overhead --requests 20000
+'''
+import argparse
+import asyncio
+import time
+from typing import Callable
+
+from fastapi import FastAPI, Request, Response
+
+from app.metrics.metrics import REQUESTS, REQUEST_DURATION, ACTIVE_REQUESTS, ERRORS
+from app.metrics.middleware import setup_metrics_middleware
+
+
+class CallNextPrometheusMiddleware:
+    '''
+        Прежняя реализация через call_next, оставлена для сравнения
+    '''
+    async def __call__(self, request: Request, call_next: Callable) -> Response:
+        method = request.method
+        endpoint = request.url.path
+        ACTIVE_REQUESTS.inc()
+        start_time = time.time()
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            REQUESTS.labels(method=method, endpoint=endpoint, status=status_code).inc()
+            REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(time.time() - start_time)
+            if status_code >= 400:
+                ERRORS.labels(method=method, endpoint=endpoint, error_type=f"http_{status_code}").inc()
+            return response
+        finally:
+            ACTIVE_REQUESTS.dec()
+
+
+def make_app(mode: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/bench")
+    async def bench() -> Response:
+        return Response(b"ok")
+
+    if mode == "call_next":
+        app.middleware("http")(CallNextPrometheusMiddleware())
+    elif mode == "asgi":
+        setup_metrics_middleware(app)
+    return app
+
+
+async def measure(app: FastAPI, requests: int) -> float:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/bench", "raw_path": b"/bench", "root_path": "", "query_string": b"", "headers": [],
+        "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    for _ in range(200):
+        await app(dict(scope), receive, send)
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+async def main(args):
+    print(f"{'mode':<12}{'us/req':>10}{'overhead us':>14}")
+    baseline = None
+    for mode in ("none", "call_next", "asgi"):
+        per_request = min([await measure(make_app(mode), args.requests) for _ in range(args.repeat)])
+        baseline = per_request if baseline is None else baseline
+        print(f"{mode:<12}{per_request:>10.1f}{per_request - baseline:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,71 @@
+'''
+    Процессорное время на сериализацию ответа GET /api/note со списком из 10k заметок.
+
+    default - return-аннотация list[NoteSchema]: FastAPI валидирует уже готовые схемы,
+              превращает их в dict и сериализует через json.dumps.
+    fast    - FAST_SERIALIZATION=true: один TypeAdapter.dump_json сразу в байты.
+    Сервис заметок подменен заглушкой, БД не используется.
+
+        cd backend
+        python -m benchmarks.serialization --notes 10000 --requests 50
+'''
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+import httpx
+
+from app.entries.schemas import NotePageSchema, NoteSchema, UserSchema
+from app.main import app
+from app.services.pemissions import get_note_permission
+from settings import settings
+
+
+class StubPermission:
+    def __init__(self, page: NotePageSchema):
+        self.page = page
+
+    async def read_all(self, limit, cursor=None, compact=False):
+        return self.page
+
+
+def make_page(notes: int) -> NotePageSchema:
+    user = UserSchema(id=1, username="bench", created_at=datetime.now())
+    items = [
+        NoteSchema(id=i, user=user, title=f"note {i}", description="description " * 8,
+                   created_at=datetime.now(), updated_at=datetime.now())
+        for i in range(notes)
+    ]
+    return NotePageSchema(items=items)
+
+
+async def measure(client: httpx.AsyncClient, requests: int) -> tuple[float, float, int]:
+    for _ in range(3):
+        await client.get("/api/note/")
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for _ in range(requests):
+        response = await client.get("/api/note/")
+    response.raise_for_status()
+    cpu = (time.process_time() - cpu_start) / requests * 1e3
+    wall = (time.perf_counter() - wall_start) / requests * 1e3
+    return cpu, wall, len(response.content)
+
+
+async def main(args):
+    permission = StubPermission(make_page(args.notes))
+    app.dependency_overrides[get_note_permission] = lambda: permission
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'mode':<10}{'cpu ms/req':>12}{'wall ms/req':>13}{'bytes':>10}")
+        for mode, enabled in (("default", False), ("fast", True)):
+            settings.FAST_SERIALIZATION = enabled
+            cpu, wall, size = await measure(client, args.requests)
+            print(f"{mode:<10}{cpu:>12.1f}{wall:>13.1f}{size:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+'''
+    Пропускная способность python -m app.serve с одним и с несколькими воркерами.
+
+    Сервер запускается подпроцессом на SQLite-файле (DB_URL), нагрузка - несколько процессов-клиентов
+    с httpx, чтобы в потолок упирался сервер, а не генератор нагрузки. Пути:
+    /api/health/live - только HTTP-стек, /api/user/?limit=20 - чтение из БД и сериализация.
+
+        cd backend
+        python -m benchmarks.throughput --workers 1 4 --seconds 10
+'''
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+PATHS = ("/api/health/live", "/api/user/?limit=20")
+
+
+async def _load(base_url: str, path: str, seconds: float, concurrency: int) -> int:
+    done = 0
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        async def worker():
+            nonlocal done
+            while time.perf_counter() < deadline:
+                response = await client.get(path)
+                response.raise_for_status()
+                done += 1
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return done
+
+
+def _client(args: tuple) -> int:
+    return asyncio.run(_load(*args))
+
+
+def wait_ready(base_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url + "/api/health/ready").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+def run(workers: int, env: dict, args) -> dict:
+    env = {**env, "WEB_WORKERS": str(workers), "WEB_PORT": str(args.port)}
+    server = subprocess.Popen([sys.executable, "-m", "app.serve"], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url)
+        results = {}
+        with multiprocessing.Pool(args.clients) as pool:
+            for path in PATHS:
+                pool.map(_client, [(base_url, path, 1, args.concurrency)] * args.clients)
+                counts = pool.map(_client, [(base_url, path, args.seconds, args.concurrency)] * args.clients)
+                results[path] = sum(counts) / args.seconds
+        return results
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DB_URL": f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}",
+            "HOST_IP": "127.0.0.1",
+            "PASSWORD_HASH_EXECUTOR": "inline",
+            "ENTITY_CACHE_BACKEND": "none",
+            "PROMETHEUS_MULTIPROC_DIR": os.path.join(tmp, "metrics"),
+        }
+        os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+        # схема создается заранее: воркеры на SQLite не должны мигрировать одновременно
+        subprocess.run([sys.executable, "-m", "app.db.db"], env=env, check=True, stdout=subprocess.DEVNULL)
+        env["DB_MIGRATE_ON_STARTUP"] = "false"
+
+        print(f"{'workers':<9}" + "".join(f"{path:>24}" for path in PATHS) + "   (req/s)")
+        for workers in args.workers:
+            results = run(workers, env, args)
+            print(f"{workers:<9}" + "".join(f"{results[path]:>24.0f}" for path in PATHS))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=4, help="процессов-генераторов нагрузки")
+    parser.add_argument("--concurrency", type=int, default=16, help="одновременных запросов на клиента")
+    parser.add_argument("--port", type=int, default=8765)
+    main(parser.parse_args())
@@ -11,9 +11,108 @@ class Settings:
     DB_USER: str = os.getenv("DB_USER", "user")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "password")
 
+    # Прод-запуск (python -m app.serve). 0 воркеров - по лимиту CPU контейнера (cgroup), иначе по числу ядер
+    WEB_WORKERS: int = int(os.getenv("WEB_WORKERS", "0"))
+    WEB_PORT: int = int(os.getenv("WEB_PORT", "8000"))
+    WEB_BACKLOG: int = int(os.getenv("WEB_BACKLOG", "2048"))
+    # Больше idle timeout балансировщика перед подом, иначе он получает обрывы на переиспользованных соединениях
+    WEB_KEEPALIVE_SECONDS: int = int(os.getenv("WEB_KEEPALIVE_SECONDS", "75"))
+    # Сверх этого числа одновременных соединений на воркер отвечать 503; 0 - без ограничения
+    WEB_LIMIT_CONCURRENCY: int = int(os.getenv("WEB_LIMIT_CONCURRENCY", "0"))
+    # Адреса/CIDR через запятую, от которых доверять X-Forwarded-For и X-Forwarded-Proto (ingress-контроллер)
+    WEB_FORWARDED_ALLOW_IPS: str = os.getenv("WEB_FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+    # Предел числа наборов меток на HTTP-метрику в процессе; сверх него запросы учитываются в серии overflow
+    METRICS_MAX_LABEL_SETS: int = int(os.getenv("METRICS_MAX_LABEL_SETS", "2000"))
+
+    # Сериализация ответов списков/сущностей сразу в JSON-байты, минуя повторную валидацию FastAPI
+    FAST_SERIALIZATION: bool = os.getenv("FAST_SERIALIZATION", "false").lower() == "true"
+
+    # Применять миграции при старте приложения. Иначе: python -m app.db.migrations upgrade
+    DB_MIGRATE_ON_STARTUP: bool = os.getenv("DB_MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+    # Пул соединений на процесс (и на каждую реплику). Всего к Postgres открывается до
+    # (DB_POOL_SIZE + DB_MAX_OVERFLOW) * воркеров * подов соединений - это должно помещаться в max_connections
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT_SECONDS: float = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+    # Соединения старше пересоздаются (-1 - никогда), pre-ping проверяет соединение перед выдачей
+    DB_POOL_RECYCLE_SECONDS: int = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    # Кэш подготовленных выражений asyncpg на соединение; 0 - за pgbouncer в режиме transaction
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+    # Старт: ожидание БД с экспоненциальной задержкой до дедлайна, затем прогрев соединений пула
+    DB_STARTUP_TIMEOUT_SECONDS: float = float(os.getenv("DB_STARTUP_TIMEOUT_SECONDS", "60"))
+    DB_STARTUP_BACKOFF_SECONDS: float = float(os.getenv("DB_STARTUP_BACKOFF_SECONDS", "0.1"))
+    DB_STARTUP_BACKOFF_MAX_SECONDS: float = float(os.getenv("DB_STARTUP_BACKOFF_MAX_SECONDS", "5"))
+    DB_POOL_PREWARM: int = int(os.getenv("DB_POOL_PREWARM", "2"))
+    # Сколько uvicorn ждет запросы в обработке после SIGTERM (timeout_graceful_shutdown). Вместе с preStop
+    # и закрытием пулов (до 5 с) должно быть меньше terminationGracePeriodSeconds пода
+    SHUTDOWN_DRAIN_SECONDS: float = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "15"))
+
+    # Реплики только для чтения: async URL через запятую. Пусто - все запросы идут в основную БД
+    DB_REPLICA_URLS: list[str] = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+    # После записи чтения того же клиента идут в основную БД столько секунд (read-your-writes).
+    # Отметка - cookie в ответе на запрос с записью; клиент с другого origin должен отправлять credentials
+    DB_READ_YOUR_WRITES_SECONDS: float = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+    # Реплика с отставанием больше порога или недоступная исключается до следующей проверки
+    DB_REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "10"))
+    DB_REPLICA_CHECK_SECONDS: float = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "5"))
+
     AUTH_SECRET_KEY: str = os.getenv("AUTH_SECRET_KEY", "secret_key")
     AUTH_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    REFRESH_TOKEN_EXPIRE_DAYS: int = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+    AUTH_EMBED_USER_CLAIMS: bool = os.getenv("AUTH_EMBED_USER_CLAIMS", "false").lower() == "true"
+
+    # process | thread | inline; 0 воркеров - доступные ядра, поделенные на число воркеров uvicorn
+    PASSWORD_HASH_EXECUTOR: str = os.getenv("PASSWORD_HASH_EXECUTOR", "process")
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "0"))
+
+    # Параметры argon2, одинаковые для всех подов. Подбираются один раз под ARGON2_TARGET_MS на железе пода:
+    # python -m app.services.hashing, результат фиксируется в env. При входе хеш пересчитывается,
+    # только если он слабее этих параметров
+    ARGON2_TIME_COST: int = int(os.getenv("ARGON2_TIME_COST", "3"))
+    ARGON2_MEMORY_COST: int = int(os.getenv("ARGON2_MEMORY_COST", "65536"))
+    ARGON2_PARALLELISM: int = int(os.getenv("ARGON2_PARALLELISM", "4"))
+    ARGON2_TARGET_MS: float = float(os.getenv("ARGON2_TARGET_MS", "100"))
+
+    # 0 одновременных логинов - по количеству воркеров хеширования
+    LOGIN_MAX_CONCURRENT: int = int(os.getenv("LOGIN_MAX_CONCURRENT", "0"))
+    LOGIN_QUEUE_DEPTH: int = int(os.getenv("LOGIN_QUEUE_DEPTH", "32"))
+    LOGIN_RETRY_AFTER_SECONDS: int = int(os.getenv("LOGIN_RETRY_AFTER_SECONDS", "1"))
+
+    REVOCATION_REFRESH_SECONDS: float = float(os.getenv("REVOCATION_REFRESH_SECONDS", "30"))
+    REVOCATION_FILTER_CAPACITY: int = int(os.getenv("REVOCATION_FILTER_CAPACITY", "100000"))
+    REVOCATION_FILTER_FP_RATE: float = float(os.getenv("REVOCATION_FILTER_FP_RATE", "0.001"))
+
+    NOTE_PAGE_DEFAULT_LIMIT: int = int(os.getenv("NOTE_PAGE_DEFAULT_LIMIT", "100"))
+    NOTE_PAGE_MAX_LIMIT: int = int(os.getenv("NOTE_PAGE_MAX_LIMIT", "1000"))
+    NOTE_BULK_MAX_ITEMS: int = int(os.getenv("NOTE_BULK_MAX_ITEMS", "1000"))
+    NOTE_EXPORT_BATCH_SIZE: int = int(os.getenv("NOTE_EXPORT_BATCH_SIZE", "1000"))
+    USER_PAGE_DEFAULT_LIMIT: int = int(os.getenv("USER_PAGE_DEFAULT_LIMIT", "50"))
+    USER_PAGE_MAX_LIMIT: int = int(os.getenv("USER_PAGE_MAX_LIMIT", "500"))
+
+    # none | redis | memory. По умолчанию кэша нет: запись инвалидирует его только там, где он хранится.
+    # redis - общий для всех воркеров и подов. memory инвалидируется только в своем процессе (на остальных
+    # воркерах и подах старая версия и ее ETag живут до ENTITY_CACHE_TTL_SECONDS) - только для одного процесса
+    ENTITY_CACHE_BACKEND: str = os.getenv("ENTITY_CACHE_BACKEND", "none")
+    ENTITY_CACHE_URL: str = os.getenv("ENTITY_CACHE_URL", "redis://localhost:6379/0")
+    ENTITY_CACHE_SIZE: int = int(os.getenv("ENTITY_CACHE_SIZE", "10000"))
+    ENTITY_CACHE_TTL_SECONDS: float = float(os.getenv("ENTITY_CACHE_TTL_SECONDS", "30"))
+
+    # Конфигурация text search Postgres. Зашивается в индекс ix_note_search_vector миграцией:
+    # при смене индекс нужно перестроить, иначе поиск его не использует
+    NOTE_SEARCH_CONFIG: str = os.getenv("NOTE_SEARCH_CONFIG", "simple")
+
+    # Кэш пользователей по access-токену. Изменение пользователя сбрасывает его только в своем процессе.
+    # Переименование и удаление к тому же отзывают токены пользователя через revoked_token: остальные воркеры
+    # и поды перестают их принимать в пределах REVOCATION_REFRESH_SECONDS. Пока обновление списка отзыва
+    # не удается, на других процессах устаревший пользователь живет до PRINCIPAL_CACHE_TTL_SECONDS,
+    # а с AUTH_EMBED_USER_CLAIMS - до истечения токена (ACCESS_TOKEN_EXPIRE_MINUTES)
+    PRINCIPAL_CACHE_SIZE: int = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+    PRINCIPAL_CACHE_TTL_SECONDS: int = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
 
     @property
     def SYNC_DB_URL(self):
@@ -21,6 +120,9 @@ class Settings:
 
     @property
     def ASYNC_DB_URL(self):
+        # DB_URL целиком заменяет параметры подключения (например, sqlite+aiosqlite:///bench.db для бенчмарков)
+        if os.getenv("DB_URL"):
+            return os.getenv("DB_URL")
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
 
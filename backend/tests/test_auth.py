@@ -4,13 +4,21 @@ import jwt
 import pytest
 from fastapi import HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
+from pwdlib import PasswordHash
 from starlette.testclient import TestClient
 
-from ..app.entries.schemas import CreateUserSchema, UserSchema
+from ..app.cache.principal import PrincipalCache
+from ..app.cache.revocation import RevocationList
+from ..app.entries.schemas import UserSchema
 from ..app.main import app
-from ..app.entries.models import UserTable
+from ..app.entries.models import UserTable, RefreshTokenTable
+from ..app.repository.refresh_token import RefreshTokenRepository, get_refresh_token_repository
+from ..app.repository.revoked_token import RevokedTokenRepository
 from ..app.repository.user import UserRepository
+from ..app.services.admission import LoginAdmission
+from ..app.services.hashing import AsyncPasswordHash, Argon2Params, calibrate_argon2, is_weaker
 from ..app.services.token import TokenService
+from ..app.services.token_codec import TokenCodec
 from ..app.services.user import UserService, get_user_service
 from unittest.mock import AsyncMock
 
@@ -32,10 +40,11 @@ def user_service(mock_repository):
 def token_service(user_service):
     return TokenService(user_service=user_service)
 
-def test_hash_password(user_service):
+@pytest.mark.asyncio
+async def test_hash_password(user_service):
     password = "VeryHardPassword"
-    hashed_password = user_service.get_password_hash(password)
-    verify_password = user_service.verify_password(password, hashed_password)
+    hashed_password = await user_service.get_password_hash(password)
+    verify_password = await user_service.verify_password(password, hashed_password)
     assert verify_password == True
 
 def test_token(token_service):
@@ -49,7 +58,7 @@ async def test_succeed_get_current_user(token_service, user_service, mock_reposi
     test_user = UserTable(
         id=1,
         username="test_user",
-        password=user_service.get_password_hash("test_password"),
+        password=await user_service.get_password_hash("test_password"),
         created_at=datetime.now(),
     )
 
@@ -73,7 +82,7 @@ async def test_expired_token(token_service, user_service, mock_repository):
     test_user = UserTable(
         id=1,
         username="test_user",
-        password=user_service.get_password_hash("test_password"),
+        password=await user_service.get_password_hash("test_password"),
         created_at=datetime.now(),
     )
 
@@ -96,20 +105,21 @@ async def test_expired_token(token_service, user_service, mock_repository):
 @pytest.mark.asyncio
 async def test_succeed_authenticate(user_service, mock_repository):
     test_user = UserTable(
+        id=1,
         username="test_user",
-        password=user_service.get_password_hash("test_password"),
+        password=await user_service.get_password_hash("test_password"),
         created_at=datetime.now(),
     )
 
     mock_repository.get_by_username.return_value = test_user
     user = await user_service.authenticate("test_username", "test_password")
-    assert user == CreateUserSchema.model_validate(test_user, from_attributes=True)
+    assert user == UserSchema.model_validate(test_user, from_attributes=True)
 
 @pytest.mark.asyncio
 async def test_failed_by_password_authenticate(user_service, mock_repository):
     test_user = UserTable(
         username="test_user",
-        password=user_service.get_password_hash("test_password"),
+        password=await user_service.get_password_hash("test_password"),
         created_at=datetime.now(),
     )
 
@@ -123,7 +133,7 @@ async def test_failed_by_password_authenticate(user_service, mock_repository):
 async def test_failed_by_user_not_found_authenticate(user_service, mock_repository):
     test_user = UserTable(
         username="test_user",
-        password=user_service.get_password_hash("test_password"),
+        password=await user_service.get_password_hash("test_password"),
         created_at=datetime.now(),
     )
 
@@ -138,12 +148,13 @@ def test_token_endpoint_success(client, user_service, mock_repository):
     test_user = UserTable(
         id=1,
         username="test_user",
-        password=user_service.get_password_hash("test_password"),
+        password=PasswordHash.recommended().hash("test_password"),
         created_at=datetime.now(),
     )
 
     mock_repository.get_by_username.return_value = test_user
     app.dependency_overrides[get_user_service] = lambda: user_service
+    app.dependency_overrides[get_refresh_token_repository] = lambda: AsyncMock(spec=RefreshTokenRepository)
 
     response = client.post(
         "api/token",
@@ -153,9 +164,225 @@ def test_token_endpoint_success(client, user_service, mock_repository):
     assert response.status_code == 200
     body = response.json()
     assert "access_token" in body
+    assert "refresh_token" in body
     assert body["token_type"] == "bearer"
 
 
+@pytest.mark.asyncio
+async def test_get_current_user_cached(user_service, mock_repository):
+    test_user = UserTable(id=1, username="test_user", password="hashed", created_at=datetime.now())
+    mock_repository.get_by_username.return_value = test_user
+    token_service = TokenService(user_service=user_service, principal_cache=PrincipalCache(maxsize=10, ttl=60))
+    token = token_service.create_access_token({"sub": "test_user"})
+
+    first = await token_service.get_current_user(token)
+    second = await token_service.get_current_user(token)
+
+    assert first == second == UserSchema.model_validate(test_user, from_attributes=True)
+    mock_repository.get_by_username.assert_awaited_once_with("test_user")
+
+@pytest.mark.asyncio
+async def test_get_current_user_cache_invalidated(user_service, mock_repository):
+    test_user = UserTable(id=1, username="test_user", password="hashed", created_at=datetime.now())
+    mock_repository.get_by_username.return_value = test_user
+    cache = PrincipalCache(maxsize=10, ttl=60)
+    token_service = TokenService(user_service=user_service, principal_cache=cache)
+    token = token_service.create_access_token({"sub": "test_user"})
+
+    await token_service.get_current_user(token)
+    cache.invalidate_user(1)
+    await token_service.get_current_user(token)
+
+    assert mock_repository.get_by_username.await_count == 2
+
+@pytest.mark.asyncio
+async def test_get_current_user_from_claims(user_service, mock_repository):
+    created_at = datetime.now()
+    cache = PrincipalCache(maxsize=10, ttl=60, embed_claims=True)
+    token_service = TokenService(user_service=user_service, principal_cache=cache)
+    token = token_service.create_access_token({"sub": "test_user", "uid": 1, "created_at": created_at.isoformat()})
+
+    user = await token_service.get_current_user(token)
+
+    assert user == UserSchema(id=1, username="test_user", created_at=created_at)
+    mock_repository.get_by_username.assert_not_awaited()
+
+    cache.invalidate_user(1)
+    mock_repository.get_by_username.return_value = UserTable(id=1, username="test_user", password="", created_at=created_at)
+    await token_service.get_current_user(token)
+    mock_repository.get_by_username.assert_awaited_once_with("test_user")
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("executor", ["process", "thread", "inline"])
+async def test_async_password_hash_executors(executor):
+    hasher = AsyncPasswordHash(executor=executor, workers=1)
+    try:
+        hashed_password = await hasher.hash("VeryHardPassword")
+        assert await hasher.verify("VeryHardPassword", hashed_password)
+        assert not await hasher.verify("WrongPassword", hashed_password)
+    finally:
+        hasher.shutdown()
+
+@pytest.mark.asyncio
+async def test_authenticate_rehashes_outdated_hash(mock_repository):
+    outdated = AsyncPasswordHash(executor="inline", params=Argon2Params(time_cost=1, memory_cost=19456, parallelism=1))
+    current = AsyncPasswordHash(executor="inline")
+    test_user = UserTable(id=1, username="test_user", password=await outdated.hash("test_password"), created_at=datetime.now())
+    mock_repository.get_by_username.return_value = test_user
+
+    user_service = UserService(repository=mock_repository, password_hasher=current)
+    await user_service.authenticate("test_user", "test_password")
+
+    mock_repository.update.assert_awaited_once()
+    user_id, update = mock_repository.update.await_args.args
+    assert user_id == 1
+    valid, updated_hash = await current.verify_and_update("test_password", update.password)
+    assert valid and updated_hash is None
+
+@pytest.mark.asyncio
+async def test_authenticate_keeps_current_hash(mock_repository):
+    hasher = AsyncPasswordHash(executor="inline")
+    test_user = UserTable(id=1, username="test_user", password=await hasher.hash("test_password"), created_at=datetime.now())
+    mock_repository.get_by_username.return_value = test_user
+
+    await UserService(repository=mock_repository, password_hasher=hasher).authenticate("test_user", "test_password")
+    mock_repository.update.assert_not_awaited()
+@pytest.mark.asyncio
+async def test_authenticate_keeps_stronger_hash(mock_repository):
+    # процесс с более слабыми параметрами не должен переписывать хеш, созданный с более сильными
+    stronger = AsyncPasswordHash(executor="inline", params=Argon2Params(time_cost=4, memory_cost=65536, parallelism=1))
+    weaker = AsyncPasswordHash(executor="inline", params=Argon2Params(time_cost=3, memory_cost=19456, parallelism=4))
+    test_user = UserTable(id=1, username="test_user", password=await stronger.hash("test_password"), created_at=datetime.now())
+    mock_repository.get_by_username.return_value = test_user
+
+    await UserService(repository=mock_repository, password_hasher=weaker).authenticate("test_user", "test_password")
+    mock_repository.update.assert_not_awaited()
+    assert is_weaker(test_user.password, Argon2Params(time_cost=5, memory_cost=65536, parallelism=1))
 
 
+def test_calibrate_argon2_respects_budget():
+    params = calibrate_argon2(target_ms=0.001, params=Argon2Params(time_cost=3, memory_cost=65536, parallelism=1))
+    assert params == Argon2Params(time_cost=1, memory_cost=19456, parallelism=1)
 
+@pytest.mark.asyncio
+async def test_login_admission_rejects_when_full():
+    admission = LoginAdmission(max_concurrent=1, queue_depth=0, retry_after=3)
+    async with admission.admit():
+        with pytest.raises(HTTPException) as exc:
+            async with admission.admit():
+                pass
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "3"
+
+    async with admission.admit():
+        pass
+
+
+@pytest.fixture
+def refresh_repository():
+    return AsyncMock(spec=RefreshTokenRepository)
+
+@pytest.mark.asyncio
+async def test_refresh_token_rotation(user_service, refresh_repository):
+    token_service = TokenService(user_service=user_service, refresh_repository=refresh_repository)
+    user = UserTable(id=1, username="test_user", password="hashed", created_at=datetime.now())
+    token_model = RefreshTokenTable(id=1, family_id=b"family", user_id=1, used=False,
+                                    expires_at=datetime.now(timezone.utc) + timedelta(days=1))
+    refresh_repository.get_by_hash.return_value = (token_model, user)
+    refresh_repository.rotate.return_value = True
+
+    result = await token_service.refresh("refresh")
+
+    assert jwt.decode(result["access_token"], settings.AUTH_SECRET_KEY, algorithms=[settings.AUTH_ALGORITHM])["sub"] == "test_user"
+    assert result["refresh_token"] != "refresh"
+    token_id, token_hash, family_id, user_id, _ = refresh_repository.rotate.await_args.args
+    assert (token_id, family_id, user_id) == (1, b"family", 1)
+    assert token_hash == TokenService._hash_refresh_token(result["refresh_token"])
+    refresh_repository.get_by_hash.assert_awaited_once_with(TokenService._hash_refresh_token("refresh"))
+
+@pytest.mark.asyncio
+async def test_refresh_token_reuse_revokes_family(user_service, refresh_repository):
+    token_service = TokenService(user_service=user_service, refresh_repository=refresh_repository)
+    user = UserTable(id=1, username="test_user", password="hashed", created_at=datetime.now())
+    token_model = RefreshTokenTable(id=1, family_id=b"family", user_id=1, used=True,
+                                    expires_at=datetime.now(timezone.utc) + timedelta(days=1))
+    refresh_repository.get_by_hash.return_value = (token_model, user)
+
+    with pytest.raises(HTTPException) as exc:
+        await token_service.refresh("refresh")
+
+    assert exc.value.status_code == 401
+    refresh_repository.revoke_family.assert_awaited_once_with(b"family")
+    refresh_repository.rotate.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_refresh_token_expired(user_service, refresh_repository):
+    token_service = TokenService(user_service=user_service, refresh_repository=refresh_repository)
+    user = UserTable(id=1, username="test_user", password="hashed", created_at=datetime.now())
+    token_model = RefreshTokenTable(id=1, family_id=b"family", user_id=1, used=False,
+                                    expires_at=datetime.now(timezone.utc) - timedelta(days=1))
+    refresh_repository.get_by_hash.return_value = (token_model, user)
+
+    with pytest.raises(HTTPException) as exc:
+        await token_service.refresh("refresh")
+
+    assert exc.value.status_code == 401
+    refresh_repository.rotate.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_revoked_token_rejected(user_service, mock_repository, refresh_repository):
+    mock_repository.get_by_username.return_value = UserTable(id=1, username="test_user", password="", created_at=datetime.now())
+    revoked_repository = AsyncMock(spec=RevokedTokenRepository)
+    revocation = RevocationList(capacity=100, false_positive_rate=0.01, refresh_interval=30)
+    token_service = TokenService(user_service=user_service, refresh_repository=refresh_repository,
+                                 revocation_list=revocation, revoked_repository=revoked_repository)
+    token = token_service.create_access_token({"sub": "test_user"})
+    other_token = token_service.create_access_token({"sub": "test_user"})
+
+    await token_service.get_current_user(token)
+    refresh_repository.get_by_hash.return_value = (RefreshTokenTable(family_id=b"family"), mock_repository.get_by_username.return_value)
+    await token_service.revoke(token, "refresh")
+
+    jti = jwt.decode(token, settings.AUTH_SECRET_KEY, algorithms=[settings.AUTH_ALGORITHM])["jti"]
+    assert revoked_repository.create.await_args.args[0] == jti
+    refresh_repository.revoke_family.assert_awaited_once_with(b"family")
+    with pytest.raises(HTTPException) as exc:
+        await token_service.get_current_user(token)
+    assert exc.value.status_code == 401
+    assert await token_service.get_current_user(other_token)
+
+@pytest.mark.asyncio
+async def test_revoke_accepts_expired_token(user_service, mock_repository, refresh_repository):
+    mock_repository.get_by_username.return_value = None
+    revoked_repository = AsyncMock(spec=RevokedTokenRepository)
+    codec = TokenCodec(settings.AUTH_SECRET_KEY, settings.AUTH_ALGORITHM, timedelta(minutes=-1))
+    token_service = TokenService(user_service=user_service, refresh_repository=refresh_repository,
+                                 revoked_repository=revoked_repository, codec=codec)
+    owner = UserTable(id=1, username="renamed", password="", created_at=datetime.now())
+    refresh_repository.get_by_hash.return_value = (RefreshTokenTable(family_id=b"family"), owner)
+
+    await token_service.revoke(token_service.create_access_token({"sub": "old_name", "uid": 2}), "refresh")
+    refresh_repository.revoke_family.assert_not_awaited()
+
+    await token_service.revoke(token_service.create_access_token({"sub": "old_name", "uid": 1}), "refresh")
+    refresh_repository.revoke_family.assert_awaited_once_with(b"family")
+    revoked_repository.create.assert_not_awaited()
+
+    forged = TokenCodec("other-secret", settings.AUTH_ALGORITHM, timedelta(minutes=-1)).encode({"sub": "old_name"})
+    with pytest.raises(HTTPException) as exc:
+        await token_service.revoke(forged, "refresh")
+    assert exc.value.status_code == 401
+
+@pytest.mark.asyncio
+async def test_tokens_of_renamed_user_rejected(user_service, mock_repository):
+    mock_repository.get_by_username.return_value = UserTable(id=1, username="test_user", password="", created_at=datetime.now())
+    revocation = RevocationList(capacity=100, false_positive_rate=0.01, refresh_interval=30)
+    token_service = TokenService(user_service=user_service, principal_cache=PrincipalCache(maxsize=10, ttl=60),
+                                 revocation_list=revocation)
+    token = token_service.create_access_token({"sub": "test_user"})
+    await token_service.get_current_user(token)
+
+    revocation.revoke_subject("test_user", datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
+    with pytest.raises(HTTPException) as exc:
+        await token_service.get_current_user(token)
+    assert exc.value.status_code == 401
@@ -0,0 +1,235 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from ..app.cache.entity import EntityCache, MemoryBackend, RedisBackend
+from ..app.cache.lru import TTLCache
+from ..app.cache.revocation import BloomFilter, RevocationList
+from ..app.entries.models import BaseTable
+from ..app.entries.schemas import UserSchema
+from ..app.metrics.metrics import ENTITY_CACHE_EVICTIONS
+from ..app.repository.revoked_token import RevokedTokenRepository
+
+DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+
+
+@pytest_asyncio.fixture
+async def session_factory():
+    engine = create_async_engine(DATABASE_URL, echo=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(BaseTable.metadata.create_all)
+    yield async_sessionmaker(bind=engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_ttl_cache_expires_entries():
+    now = [0.0]
+    cache = TTLCache(maxsize=10, ttl=5, clock=lambda: now[0])
+    cache.set("a", 1)
+    now[0] = 4.9
+    assert cache.get("a") == 1
+    now[0] = 5
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_bloom_filter():
+    bloom = BloomFilter.for_capacity(1000, 0.01)
+    keys = [f"key-{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+    assert bloom.false_positive_rate == pytest.approx(0.01, rel=0.5)
+
+def test_revocation_list():
+    revocation = RevocationList(capacity=100, false_positive_rate=0.01, refresh_interval=30)
+    revocation.add("revoked")
+
+    assert revocation.is_revoked("revoked")
+    assert not revocation.is_revoked("active")
+
+    revocation.replace(["other"])
+    assert not revocation.is_revoked("revoked")
+    assert revocation.is_revoked("other")
+
+def test_revocation_list_subjects():
+    revocation = RevocationList(capacity=100, false_positive_rate=0.01, refresh_interval=30)
+    until = datetime.now(timezone.utc) + timedelta(minutes=30)
+    assert not revocation.is_subject_revoked("user", until.timestamp())
+
+    revocation.revoke_subject("user", until)
+    assert revocation.is_subject_revoked("user", until.timestamp())
+    assert revocation.is_subject_revoked("user", None)
+    # токен, выданный после отзыва, истекает позже отметки
+    assert not revocation.is_subject_revoked("user", until.timestamp() + 1)
+    assert not revocation.is_subject_revoked("other", until.timestamp())
+
+
+@pytest.mark.asyncio
+async def test_revocation_list_refresh(session_factory):
+    now = datetime.now(timezone.utc)
+    async with session_factory() as session:
+        repository = RevokedTokenRepository(session)
+        await repository.create("active", now + timedelta(minutes=5))
+        await repository.create("expired", now - timedelta(minutes=5))
+
+    revocation = RevocationList(capacity=100, false_positive_rate=0.01, refresh_interval=30)
+    await revocation.refresh(session_factory)
+
+    assert revocation.is_revoked("active")
+    assert not revocation.is_revoked("expired")
+    async with session_factory() as session:
+        assert await RevokedTokenRepository(session).get_active(now - timedelta(days=1)) == ["active"]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def _user(user_id=1, username="user"):
+    return UserSchema(id=user_id, username=username, created_at=datetime(2024, 1, 1))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", [lambda: MemoryBackend(10, 60), lambda: RedisBackend(FakeRedis())])
+async def test_entity_cache_read_through(backend):
+    cache = EntityCache(backend(), ttl=60)
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        return _user()
+
+    assert await cache.get_or_load("user", 1, UserSchema, loader) == _user()
+    assert await cache.get_or_load("user", 1, UserSchema, loader) == _user()
+    assert len(loads) == 1
+
+    await cache.invalidate("user", 1)
+    await cache.get_or_load("user", 1, UserSchema, loader)
+    assert len(loads) == 2
+
+
+@pytest.mark.asyncio
+async def test_entity_cache_single_flight():
+    cache = EntityCache(MemoryBackend(10, 60), ttl=60)
+    loads = []
+    release = asyncio.Event()
+
+    async def loader():
+        loads.append(1)
+        await release.wait()
+        return _user()
+
+    tasks = [asyncio.create_task(cache.get_or_load("user", 1, UserSchema, loader)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*tasks) == [_user()] * 5
+    assert len(loads) == 1
+
+
+@pytest.mark.asyncio
+async def test_entity_cache_skips_value_invalidated_during_load():
+    cache = EntityCache(MemoryBackend(10, 60), ttl=60)
+
+    async def loader():
+        await cache.invalidate("user", 1)
+        return _user(username="stale")
+
+    assert (await cache.get_or_load("user", 1, UserSchema, loader)).username == "stale"
+    assert await cache.backend.get("user:1") is None
+
+
+@pytest.mark.asyncio
+async def test_entity_cache_skips_replica_reads_right_after_invalidation():
+    cache = EntityCache(MemoryBackend(10, 60), ttl=60, replica_lag=60)
+    await cache.invalidate("user", 1)
+
+    async def loader():
+        return _user(username="from replica")
+
+    await cache.get_or_load("user", 1, UserSchema, loader)
+    assert await cache.backend.get("user:1") is None
+    await cache.get_or_load("user", 2, UserSchema, loader)
+    assert await cache.backend.get("user:2") is not None
+
+
+@pytest.mark.asyncio
+async def test_entity_cache_does_not_cache_missing_or_failed():
+    cache = EntityCache(MemoryBackend(10, 60), ttl=60)
+
+    async def missing():
+        return None
+
+    async def failing():
+        raise RuntimeError("db is down")
+
+    assert await cache.get_or_load("user", 1, UserSchema, missing) is None
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("user", 1, UserSchema, failing)
+    assert await cache.backend.get("user:1") is None
+
+
+
+class DownRedis:
+    async def get(self, key):
+        raise ConnectionError("redis is down")
+
+    async def set(self, key, value, ex=None):
+        raise ConnectionError("redis is down")
+
+    async def delete(self, *keys):
+        raise ConnectionError("redis is down")
+
+
+@pytest.mark.asyncio
+async def test_entity_cache_survives_backend_errors(capsys):
+    cache = EntityCache(RedisBackend(DownRedis()), ttl=60)
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        return _user()
+
+    assert await cache.get_or_load("user", 1, UserSchema, loader) == _user()
+    assert await cache.get_or_load("user", 1, UserSchema, loader) == _user()
+    assert len(loads) == 2
+    await cache.invalidate("user", 1)
+    assert "redis is down" in capsys.readouterr().out
+
+@pytest.mark.asyncio
+async def test_memory_backend_counts_evictions():
+    backend = MemoryBackend(1, 60)
+    before = ENTITY_CACHE_EVICTIONS.labels("note")._value.get()
+
+    await backend.set("note:1", "first", 60)
+    await backend.set("note:2", "second", 60)
+
+    assert await backend.get("note:1") is None
+    assert ENTITY_CACHE_EVICTIONS.labels("note")._value.get() == before + 1
@@ -0,0 +1,128 @@
+import pytest
+from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from prometheus_client import REGISTRY
+from starlette.testclient import TestClient
+
+from ..app.metrics.middleware import PrometheusMiddleware, setup_metrics_middleware
+
+
+def _sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    setup_metrics_middleware(app)
+
+    @app.get("/metrics-test/ok")
+    async def ok():
+        return {"status": "ok"}
+
+    @app.get("/metrics-test/missing")
+    async def missing():
+        raise HTTPException(status_code=404)
+
+    @app.get("/metrics-test/crash")
+    async def crash():
+        raise RuntimeError("boom")
+
+    @app.get("/metrics-test/stream")
+    async def stream():
+        async def chunks():
+            for i in range(3):
+                yield f"{i}\n".encode()
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    router = APIRouter(prefix="/items")
+
+    @router.get("/{id}")
+    async def item(id: int):
+        return {"id": id}
+
+    app.include_router(router, prefix="/metrics-test")
+    return TestClient(app, raise_server_exceptions=False)
+
+
+def test_counts_status_from_response_start(client):
+    labels = dict(method="GET", endpoint="/metrics-test/ok")
+    before = _sample("http_requests_total", status="200", **labels)
+    durations = _sample("http_request_duration_seconds_count", **labels)
+
+    assert client.get("/metrics-test/ok").status_code == 200
+    assert client.get("/metrics-test/ok").status_code == 200
+
+    assert _sample("http_requests_total", status="200", **labels) == before + 2
+    assert _sample("http_request_duration_seconds_count", **labels) == durations + 2
+    assert _sample("http_requests_active") == 0
+
+
+def test_counts_http_errors_and_exceptions(client):
+    assert client.get("/metrics-test/missing").status_code == 404
+    assert _sample("http_errors_total", method="GET", endpoint="/metrics-test/missing", error_type="http_404") >= 1
+
+    assert client.get("/metrics-test/crash").status_code == 500
+    assert _sample("http_requests_total", method="GET", endpoint="/metrics-test/crash", status="500") >= 1
+    assert _sample("http_errors_total", method="GET", endpoint="/metrics-test/crash", error_type="RuntimeError") >= 1
+
+
+def test_streaming_response_passes_through(client):
+    response = client.get("/metrics-test/stream")
+    assert response.text == "0\n1\n2\n"
+    assert _sample("http_requests_total", method="GET", endpoint="/metrics-test/stream", status="200") >= 1
+
+
+@pytest.mark.asyncio
+async def test_non_http_scopes_are_not_counted():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["type"])
+
+    await PrometheusMiddleware(app)({"type": "lifespan"}, None, None)
+    assert calls == ["lifespan"]
+
+
+def test_labels_use_route_template(client):
+    before = _sample("http_requests_total", method="GET", endpoint="/metrics-test/items/{id}", status="200")
+    for item_id in (1, 2, 3):
+        assert client.get(f"/metrics-test/items/{item_id}").status_code == 200
+
+    assert _sample("http_requests_total", method="GET", endpoint="/metrics-test/items/{id}", status="200") == before + 3
+    assert _sample("http_requests_total", method="GET", endpoint="/metrics-test/items/1", status="200") == 0
+
+
+def test_unmatched_paths_and_unknown_methods_share_a_bucket(client):
+    before = _sample("http_requests_total", method="GET", endpoint="unmatched", status="404")
+    for path in ("/wp-login.php", "/.env", "/metrics-test/nope"):
+        assert client.get(path).status_code == 404
+    assert _sample("http_requests_total", method="GET", endpoint="unmatched", status="404") == before + 3
+
+    client.request("PROPFIND", "/metrics-test/ok")
+    assert _sample("http_requests_total", method="OTHER", endpoint="/metrics-test/ok", status="405") >= 1
+
+
+def test_label_sets_are_capped():
+    app = FastAPI()
+    app.add_middleware(PrometheusMiddleware, max_label_sets=2)
+
+    @app.get("/metrics-cap/{name}")
+    async def cap(name: str):
+        if name == "missing":
+            raise HTTPException(status_code=404)
+        return {}
+
+    client = TestClient(app)
+    overflow = _sample("metrics_label_overflow_total", metric="http_requests_total")
+    overflow_requests = _sample("http_requests_total", method="overflow", endpoint="overflow", status="overflow")
+
+    client.get("/metrics-cap/a")
+    client.post("/metrics-cap/a")
+    client.get("/metrics-cap/missing")
+    client.put("/metrics-cap/a")
+
+    assert _sample("http_requests_total", method="GET", endpoint="/metrics-cap/{name}", status="200") >= 1
+    assert _sample("http_requests_total", method="POST", endpoint="/metrics-cap/{name}", status="405") >= 1
+    assert _sample("metrics_label_overflow_total", metric="http_requests_total") == overflow + 2
+    assert _sample("http_requests_total", method="overflow", endpoint="overflow", status="overflow") == overflow_requests + 2
@@ -1,18 +1,24 @@
+import gzip
 from datetime import datetime
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 from fastapi import HTTPException
 from starlette.testclient import TestClient
 
 from ..app.entries.schemas import NoteSchema, UserSchema, CreateNoteSchema, CreateNoteInputSchema, \
-    UpdateNoteSchema
+    UpdateNoteSchema, NotePageSchema, BulkCreateNoteResultSchema, BulkNoteResultSchema, \
+    BulkUpdateNoteSchema, BulkNoteFilterSchema, BulkNoteChangeResultSchema, NoteSearchPageSchema, NoteSearchResultSchema, \
+    CompactNoteSchema, CompactNotePageSchema
 from ..app.main import app
+from ..app.routers import responses
 from ..app.repository.note import NoteRepository
 from ..app.services.note import NoteService, get_note_service
 from ..app.entries.models import NotesTable, UserTable
-from ..app.services.pemissions import get_note_permission
+from ..app.services.etag import note_etag, decode_note_etag
+from ..app.services.pemissions import get_note_permission, NotePermission
 from ..app.services.token import get_current_user
+from backend.settings import settings
 
 
 @pytest.fixture
@@ -120,7 +126,7 @@ async def test_delete_note(note_service, mock_repository):
 @pytest.mark.asyncio
 async def test_get_all_route(client, note_permission_service):
     app.dependency_overrides[get_note_permission] = lambda: note_permission_service
-    note_permission_service.read_all.return_value = []
+    note_permission_service.read_all.return_value = NotePageSchema(items=[], next_cursor="next", total_estimate=5)
 
     response = client.get(
         "api/note",
@@ -129,6 +135,19 @@ async def test_get_all_route(client, note_permission_service):
     assert response.status_code == 200
     body = response.json()
     assert [] == body
+    assert response.headers["X-Next-Cursor"] == "next"
+    assert response.headers["X-Total-Estimate"] == "5"
+    note_permission_service.read_all.assert_awaited_once_with(settings.NOTE_PAGE_DEFAULT_LIMIT, None, False)
+
+@pytest.mark.asyncio
+async def test_get_all_route_limit_cap(client, note_permission_service):
+    app.dependency_overrides[get_note_permission] = lambda: note_permission_service
+
+    response = client.get(
+        "api/note", params={"limit": settings.NOTE_PAGE_MAX_LIMIT + 1}
+    )
+
+    assert response.status_code == 422
 
 @pytest.mark.asyncio
 async def test_get_by_id_route(client, note_permission_service):
@@ -188,4 +207,389 @@ async def test_delete_user_route(client, note_permission_service):
         "api/note/1",
     )
 
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_get_page(note_service, mock_repository):
+    user = UserTable(id=1, username="test_user", password="test_pass", created_at=datetime.now())
+    notes_db = [NotesTable(id=i, user=user, title="title", description="description", created_at=datetime(2024, 1, i))
+                for i in (3, 2, 1)]
+    mock_repository.get_page.return_value = notes_db
+    mock_repository.estimate_count.return_value = 3
+
+    page = await note_service.get_page(2, user=UserSchema.model_validate(user, from_attributes=True))
+
+    assert [note.id for note in page.items] == [3, 2]
+    assert page.total_estimate == 3
+    mock_repository.get_page.assert_awaited_once_with(3, None, 1, False)
+
+    mock_repository.get_page.return_value = notes_db[2:]
+    page = await note_service.get_page(2, page.next_cursor)
+    assert [note.id for note in page.items] == [1]
+    assert page.next_cursor is None
+    mock_repository.get_page.assert_awaited_with(3, (datetime(2024, 1, 2), 2), None, True)
+    assert page.total_estimate is None
+    mock_repository.estimate_count.assert_awaited_once()
+
+    page = await note_service.get_page(2, user=UserSchema.model_validate(user, from_attributes=True), total=7)
+    assert page.total_estimate == 7
+    mock_repository.estimate_count.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_get_page_invalid_cursor(note_service):
+    with pytest.raises(HTTPException) as exc:
+        await note_service.get_page(2, "not-a-cursor")
+    assert exc.value.status_code == 400
+
+@pytest.mark.asyncio
+async def test_export(note_service, mock_repository):
+    row = {"id": 1, "title": "title", "description": None, "created_at": datetime(2024, 1, 1),
+           "updated_at": datetime(2024, 1, 1), "user_id": 1, "username": "test", "user_created_at": datetime(2024, 1, 1)}
+
+    async def stream(*args):
+        yield [row, {**row, "id": 2}]
+        yield [{**row, "id": 3}]
+    mock_repository.stream = stream
+
+    body = b"".join([chunk async for chunk in note_service.export(2)])
+    lines = [NoteSchema.model_validate_json(line) for line in body.splitlines()]
+    assert [note.id for note in lines] == [1, 2, 3]
+    assert lines[0].user.username == "test"
+
+    compressed = b"".join([chunk async for chunk in note_service.export(2, compress=True)])
+    assert gzip.decompress(compressed) == body
+
+def test_export_permission_scope():
+    service = MagicMock()
+    user = NotePermission(UserSchema(id=2, username="user", created_at=datetime.now()), service)
+    user.export()
+    service.export.assert_called_with(settings.NOTE_EXPORT_BATCH_SIZE, 2, None, None, False)
+    with pytest.raises(HTTPException) as exc:
+        user.export(user_id=1)
+    assert exc.value.status_code == 403
+
+    admin = NotePermission(UserSchema(id=1, username="admin", created_at=datetime.now()), service)
+    admin.export(user_id=2, compress=True)
+    service.export.assert_called_with(settings.NOTE_EXPORT_BATCH_SIZE, 2, None, None, True)
+
+def test_export_route(client, note_permission_service):
+    async def chunks():
+        yield b'{"id": 1}\n'
+        yield b'{"id": 2}\n'
+    note_permission_service = MagicMock()
+    note_permission_service.export.return_value = chunks()
+    app.dependency_overrides[get_note_permission] = lambda: note_permission_service
+
+    response = client.get("api/note/export", params={"since": "2024-01-01T00:00:00"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.content.splitlines() == [b'{"id": 1}', b'{"id": 2}']
+    note_permission_service.export.assert_called_once_with(None, datetime(2024, 1, 1), None, False)
+
+@pytest.mark.asyncio
+async def test_create_many(note_service, mock_repository):
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    mock_repository.create_many.return_value = [10, 11]
+
+    result = await note_service.create_many(user, [{"title": "a"}, {"description": "no title"}, {"title": "b", "description": "d"}])
+
+    assert result.created == 2
+    assert [item.id for item in result.results] == [10, None, 11]
+    assert result.results[1].errors[0]["loc"] == ("title",)
+    created = mock_repository.create_many.await_args.args[0]
+    assert [note.title for note in created] == ["a", "b"]
+    assert all(note.user_id == 1 for note in created)
+
+@pytest.mark.asyncio
+async def test_create_many_limit(note_service, mock_repository):
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    with pytest.raises(HTTPException) as exc:
+        await note_service.create_many(user, [{"title": "a"}] * (settings.NOTE_BULK_MAX_ITEMS + 1))
+    assert exc.value.status_code == 413
+    mock_repository.create_many.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_create_many_route(client, mock_note_service):
+    app.dependency_overrides[get_note_service] = lambda: mock_note_service
+    app.dependency_overrides[get_current_user] = lambda: UserSchema(id=1, username="test", created_at=datetime.now())
+    mock_note_service.create_many.return_value = BulkCreateNoteResultSchema(
+        created=1, results=[BulkNoteResultSchema(index=0, id=5)]
+    )
+
+    response = client.post("api/note/bulk", json=[{"title": "a"}])
+
+    assert response.status_code == 200
+    assert response.json()["results"][0]["id"] == 5
+
+@pytest.mark.asyncio
+async def test_update_many(note_service, mock_repository):
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    mock_repository.update_many.return_value = [3, 1]
+
+    result = await note_service.update_many(user, BulkUpdateNoteSchema(ids=[1, 2, 3], update=UpdateNoteSchema(title="new")))
+
+    assert result.affected == [1, 3]
+    assert result.rejected == [2]
+    mock_repository.update_many.assert_awaited_once_with(1, {"title": "new"}, [1, 2, 3], None, None)
+
+    with pytest.raises(HTTPException) as exc:
+        await note_service.update_many(user, BulkUpdateNoteSchema(ids=[1], update=UpdateNoteSchema()))
+    assert exc.value.status_code == 400
+
+@pytest.mark.asyncio
+async def test_delete_many(note_service, mock_repository):
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    mock_repository.delete_many.return_value = [4]
+
+    result = await note_service.delete_many(user, BulkNoteFilterSchema(until=datetime(2024, 1, 1)))
+
+    assert result.affected == [4]
+    assert result.rejected == []
+    mock_repository.delete_many.assert_awaited_once_with(1, None, None, datetime(2024, 1, 1))
+
+def test_bulk_filter_requires_selection():
+    with pytest.raises(ValueError):
+        BulkNoteFilterSchema()
+
+@pytest.mark.asyncio
+async def test_delete_many_route(client, note_permission_service):
+    app.dependency_overrides[get_note_permission] = lambda: note_permission_service
+    note_permission_service.owner_delete_many.return_value = BulkNoteChangeResultSchema(affected=[1], rejected=[2])
+
+    response = client.request("DELETE", "api/note/bulk", json={"ids": [1, 2]})
+
+    assert response.status_code == 200
+    assert response.json() == {"affected": [1], "rejected": [2]}
+    note_permission_service.owner_delete_many.assert_awaited_once_with(BulkNoteFilterSchema(ids=[1, 2]))
+
+    response = client.request("DELETE", "api/note/bulk", json={})
+    assert response.status_code == 422
+
+@pytest.mark.asyncio
+async def test_search(note_service, mock_repository):
+    user = UserTable(id=1, username="test_user", password="test_pass", created_at=datetime.now())
+    notes_db = [NotesTable(id=i, user=user, title="title", description="description", created_at=datetime.now())
+                for i in (3, 2)]
+    mock_repository.search.return_value = [(notes_db[0], 0.5, "<mark>title</mark>"), (notes_db[1], 0.25, "<mark>title</mark>")]
+    schema_user = UserSchema.model_validate(user, from_attributes=True)
+
+    page = await note_service.search(schema_user, "title", 1)
+
+    assert [(item.id, item.rank, item.snippet) for item in page.items] == [(3, 0.5, "<mark>title</mark>")]
+    mock_repository.search.assert_awaited_once_with(1, "title", 2, None)
+
+    await note_service.search(schema_user, "title", 1, page.next_cursor)
+    mock_repository.search.assert_awaited_with(1, "title", 2, (0.5, 3))
+
+@pytest.mark.asyncio
+async def test_search_route(client, mock_note_service):
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    app.dependency_overrides[get_note_service] = lambda: mock_note_service
+    app.dependency_overrides[get_current_user] = lambda: user
+    mock_note_service.search.return_value = NoteSearchPageSchema(items=[
+        NoteSearchResultSchema(id=1, title="milk", user=user, created_at=datetime.now(), rank=0.1, snippet="<mark>milk</mark>")
+    ], next_cursor="next")
+
+    response = client.get("api/note/search", params={"q": "milk", "limit": 1})
+
+    assert response.status_code == 200
+    assert response.json()[0]["snippet"] == "<mark>milk</mark>"
+    assert response.headers["X-Next-Cursor"] == "next"
+    mock_note_service.search.assert_awaited_once_with(user, "milk", 1, None)
+
+    assert client.get("api/note/search", params={"q": ""}).status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_update_owned(note_service, mock_repository):
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    version = datetime(2024, 1, 1)
+    row = NotesTable(id=1, user_id=1, title="new", created_at=version, updated_at=datetime(2024, 1, 2))
+    mock_repository.update_owned.return_value = row
+
+    result = await note_service.update_owned(1, user, UpdateNoteSchema(title="new"))
+    assert result.title == "new"
+    assert result.user == user
+    mock_repository.update_owned.assert_awaited_once_with(1, 1, {"title": "new"}, None)
+    mock_repository.get_version.assert_not_awaited()
+
+    await note_service.update_owned(1, user, UpdateNoteSchema(title="new"), note_etag(1, version, "test"))
+    mock_repository.update_owned.assert_awaited_with(1, 1, {"title": "new"}, [version])
+
+@pytest.mark.asyncio
+async def test_etags_change_on_rename(note_service, mock_repository):
+    mock_repository.collection_version.return_value = (1, datetime(2024, 1, 1), 1)
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    renamed = UserSchema(id=1, username="renamed", created_at=user.created_at)
+
+    assert (await note_service.get_collection_etag(user, 10))[0] != (await note_service.get_collection_etag(renamed, 10))[0]
+    version = datetime(2024, 1, 1)
+    assert note_etag(1, version, "test") != note_etag(1, version, "renamed")
+    assert decode_note_etag(note_etag(1, version, "renamed")) == (1, version)
+
+@pytest.mark.asyncio
+async def test_update_owned_failures(note_service, mock_repository):
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    version = datetime(2024, 1, 1)
+    mock_repository.update_owned.return_value = None
+
+    mock_repository.get_version.return_value = None
+    with pytest.raises(HTTPException) as exc:
+        await note_service.update_owned(1, user, UpdateNoteSchema(title="new"))
+    assert exc.value.status_code == 404
+
+    mock_repository.get_version.return_value = (2, version)
+    with pytest.raises(HTTPException) as exc:
+        await note_service.update_owned(1, user, UpdateNoteSchema(title="new"))
+    assert exc.value.status_code == 403
+
+    mock_repository.get_version.return_value = (1, datetime(2024, 1, 2))
+    with pytest.raises(HTTPException) as exc:
+        await note_service.update_owned(1, user, UpdateNoteSchema(title="new"), note_etag(1, version, "test"))
+    assert exc.value.status_code == 412
+
+    for bad_etag in ('"garbage"', note_etag(2, version, "test")):
+        with pytest.raises(HTTPException) as exc:
+            await note_service.update_owned(1, user, UpdateNoteSchema(title="new"), bad_etag)
+        assert exc.value.status_code == 412
+
+@pytest.mark.asyncio
+async def test_update_owned_without_changes(note_service, mock_repository):
+    user_db = UserTable(id=1, username="test", created_at=datetime.now())
+    note_db = NotesTable(id=1, user=user_db, title="title", created_at=datetime(2024, 1, 1))
+    mock_repository.update_owned.return_value = None
+    mock_repository.get_version.return_value = (1, datetime(2024, 1, 1))
+    mock_repository.get_by_id.return_value = note_db
+    user = UserSchema.model_validate(user_db, from_attributes=True)
+
+    result = await note_service.update_owned(1, user, UpdateNoteSchema(title="title"))
+    assert result.title == "title"
+
+    mock_repository.update_owned.reset_mock()
+    await note_service.update_owned(1, user, UpdateNoteSchema())
+    mock_repository.update_owned.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_delete_owned(note_service, mock_repository):
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    mock_repository.delete_owned.return_value = True
+    with pytest.raises(HTTPException) as exc:
+        await note_service.delete_owned(1, user)
+    assert exc.value.status_code == 204
+    mock_repository.get_version.assert_not_awaited()
+
+    mock_repository.delete_owned.return_value = False
+    mock_repository.get_version.return_value = (2, datetime.now())
+    with pytest.raises(HTTPException) as exc:
+        await note_service.delete_owned(1, user)
+    assert exc.value.status_code == 403
+
+    mock_repository.get_version.return_value = None
+    with pytest.raises(HTTPException) as exc:
+        await note_service.delete_owned(1, user)
+    assert exc.value.status_code == 404
+
+@pytest.mark.asyncio
+async def test_get_by_id_route_not_modified(client, note_permission_service):
+    app.dependency_overrides[get_note_permission] = lambda: note_permission_service
+    etag = note_etag(1, datetime(2024, 1, 1), "test")
+    note_permission_service.owner_etag.return_value = etag
+
+    response = client.get("api/note/1", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    note_permission_service.is_owner_read.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_get_my_notes_route_etag(client, mock_note_service):
+    app.dependency_overrides[get_note_service] = lambda: mock_note_service
+    app.dependency_overrides[get_current_user] = lambda: UserSchema(id=1, username="test", created_at=datetime.now())
+    mock_note_service.get_collection_etag.return_value = ('"abc"', 1)
+    mock_note_service.get_page.return_value = NotePageSchema(items=[])
+
+    response = client.get("api/note/me")
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"abc"'
+
+    response = client.get("api/note/me", headers={"If-None-Match": 'W/"abc"'})
+    assert response.status_code == 304
+    mock_note_service.get_page.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_update_route_if_match(client, note_permission_service):
+    app.dependency_overrides[get_note_permission] = lambda: note_permission_service
+    note = NoteSchema(id=1, user=UserSchema(username="test", id=1, created_at=datetime.now()), title="title",
+                      created_at=datetime(2024, 1, 1), updated_at=datetime(2024, 1, 2))
+    note_permission_service.is_owner_update.return_value = note
+    etag = note_etag(1, datetime(2024, 1, 1), "test")
+
+    response = client.put("api/note/1", json={"title": "title"}, headers={"If-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] == note_etag(1, datetime(2024, 1, 2), "test")
+    note_permission_service.is_owner_update.assert_awaited_once_with(1, UpdateNoteSchema(title="title"), etag)
+
+@pytest.mark.asyncio
+async def test_get_all_route_fast_serialization(client, note_permission_service, monkeypatch):
+    app.dependency_overrides[get_note_permission] = lambda: note_permission_service
+    user = UserSchema(username="тест", id=1, created_at=datetime(2024, 1, 1))
+    notes = [NoteSchema(id=i, user=user, title=f"заметка {i}", created_at=datetime(2024, 1, 1, 12)) for i in range(3)]
+    note_permission_service.read_all.return_value = NotePageSchema(items=notes, next_cursor="next")
+
+    slow = client.get("api/note")
+    monkeypatch.setattr(responses.settings, "FAST_SERIALIZATION", True)
+    fast = client.get("api/note")
+
+    assert fast.status_code == 200
+    assert fast.headers["content-type"] == "application/json"
+    assert fast.headers["X-Next-Cursor"] == "next"
+    assert fast.json() == slow.json()
+    assert fast.content == slow.content
+
+
+@pytest.mark.asyncio
+async def test_get_compact_page(note_service, mock_repository):
+    users = [UserTable(id=i, username=f"user{i}", password="test_pass", created_at=datetime.now()) for i in (1, 2)]
+    notes_db = [NotesTable(id=i, user_id=users[i % 2].id, title="title", created_at=datetime(2024, 1, i)) for i in (3, 2, 1)]
+    mock_repository.get_page.return_value = notes_db
+    mock_repository.get_users.return_value = users
+    mock_repository.estimate_count.return_value = 3
+
+    page = await note_service.get_compact_page(5)
+
+    assert [(note.id, note.user_id) for note in page.items] == [(3, 2), (2, 1), (1, 2)]
+    assert {user_id: user.username for user_id, user in page.users.items()} == {1: "user1", 2: "user2"}
+    mock_repository.get_page.assert_awaited_once_with(6, None, None, False)
+    assert set(mock_repository.get_users.await_args.args[0]) == {1, 2}
+
+    me = UserSchema.model_validate(users[0], from_attributes=True)
+    page = await note_service.get_compact_page(5, user=me)
+    assert page.users == {1: me}
+    mock_repository.get_users.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_get_my_notes_route_compact(client, mock_note_service):
+    user = UserSchema(id=1, username="test", created_at=datetime.now())
+    app.dependency_overrides[get_note_service] = lambda: mock_note_service
+    app.dependency_overrides[get_current_user] = lambda: user
+    mock_note_service.get_collection_etag.return_value = ('"abc"', 1)
+    mock_note_service.get_compact_page.return_value = CompactNotePageSchema(
+        items=[CompactNoteSchema(id=1, title="title", user_id=1, created_at=datetime.now())], users={1: user},
+        next_cursor="next",
+    )
+
+    response = client.get("api/note/me", params={"format": "compact"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["items"][0]["user_id"] == 1
+    assert body["users"]["1"]["username"] == "test"
+    assert response.headers["X-Next-Cursor"] == "next"
+    mock_note_service.get_compact_page.assert_awaited_once_with(settings.NOTE_PAGE_DEFAULT_LIMIT, None, user, 1)
+    assert mock_note_service.get_collection_etag.await_args.args[-1] == "compact"
+    mock_note_service.get_page.assert_not_awaited()
+
+    assert client.get("api/note/me", params={"format": "xml"}).status_code == 422
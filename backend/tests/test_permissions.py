@@ -3,7 +3,7 @@ from unittest.mock import AsyncMock
 from fastapi import HTTPException
 from datetime import datetime
 
-from ..app.entries.schemas import UserSchema, NoteSchema, UpdateNoteSchema, UpdateUserInputSchema
+from ..app.entries.schemas import UserSchema, NoteSchema, UpdateNoteSchema, UpdateUserInputSchema, NotePageSchema
 from ..app.services.pemissions import NotePermission, UserPermission
 
 @pytest.fixture
@@ -29,18 +29,19 @@ def user_service():
 
 @pytest.mark.asyncio
 async def test_admin_read_all(admin_user, note_service):
-    note_service.get_all.return_value = []
+    note_service.get_page.return_value = NotePageSchema(items=[])
     note_permission = NotePermission(user=admin_user, service=note_service)
-    result = await note_permission.read_all()
-    assert result == []
+    result = await note_permission.read_all(10)
+    assert result == NotePageSchema(items=[])
+    note_service.get_page.assert_awaited_once_with(10, None)
 
 @pytest.mark.asyncio
 async def test_not_admin_read_all(test_user, note_service):
-    note_service.get_all.return_value = []
     note_permission = NotePermission(user=test_user, service=note_service)
     with pytest.raises(HTTPException) as exc:
-        await note_permission.read_all()
+        await note_permission.read_all(10)
     assert exc.value.status_code == 403
+    note_service.get_page.assert_not_awaited()
 
 @pytest.mark.asyncio
 async def test_owner_read(test_user, note_service, test_note):
@@ -59,16 +60,16 @@ async def test_not_owner_read(admin_user, note_service, test_note):
 
 @pytest.mark.asyncio
 async def test_owner_update(test_user, note_service, test_note):
-    note_service.get_by_id.return_value = test_note
-    note_service.update.return_value = test_note
+    note_service.update_owned.return_value = test_note
     note_permission = NotePermission(user=test_user, service=note_service)
     result = await note_permission.is_owner_update(1, UpdateNoteSchema())
     assert result == test_note
+    note_service.update_owned.assert_awaited_once_with(1, test_user, UpdateNoteSchema(), None)
+    note_service.get_by_id.assert_not_awaited()
 
 @pytest.mark.asyncio
-async def test_not_owner_update(admin_user, note_service, test_note):
-    note_service.get_by_id.return_value = test_note
-    note_service.update.return_value = test_note
+async def test_not_owner_update(admin_user, note_service):
+    note_service.update_owned.side_effect = HTTPException(status_code=403)
     note_permission = NotePermission(user=admin_user, service=note_service)
     with pytest.raises(HTTPException) as exc:
         await note_permission.is_owner_update(1, UpdateNoteSchema())
@@ -76,13 +77,14 @@ async def test_not_owner_update(admin_user, note_service, test_note):
 
 @pytest.mark.asyncio
 async def test_owner_delete(test_user, note_service, test_note):
-    note_service.get_by_id.return_value = test_note
     note_permission = NotePermission(user=test_user, service=note_service)
     await note_permission.is_owner_delete(1)
+    note_service.delete_owned.assert_awaited_once_with(1, test_user)
+    note_service.get_by_id.assert_not_awaited()
 
 @pytest.mark.asyncio
-async def test_not_owner_delete(admin_user, note_service, test_note):
-    note_service.get_by_id.return_value = test_note
+async def test_not_owner_delete(admin_user, note_service):
+    note_service.delete_owned.side_effect = HTTPException(status_code=403)
     note_permission = NotePermission(user=admin_user, service=note_service)
     with pytest.raises(HTTPException) as exc:
         await note_permission.is_owner_delete(1)
@@ -118,4 +120,19 @@ async def test_not_owner_update_user(admin_user, user_service, test_user):
     user_permission = UserPermission(user=admin_user, service=user_service)
     with pytest.raises(HTTPException) as exc:
         await user_permission.is_owner_update(1, UpdateUserInputSchema())
-    assert exc.value.status_code == 403
\ No newline at end of file
+    assert exc.value.status_code == 403
+
+@pytest.mark.asyncio
+async def test_owner_update_user_skips_lookup(test_user, user_service):
+    user_permission = UserPermission(user=test_user, service=user_service)
+    await user_permission.is_owner_update(1, UpdateUserInputSchema(username="new"))
+    user_service.get_by_id.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_not_owner_update_missing_user(test_user, user_service):
+    user_service.get_by_id.side_effect = HTTPException(status_code=404)
+    user_permission = UserPermission(user=test_user, service=user_service)
+    with pytest.raises(HTTPException) as exc:
+        await user_permission.is_owner_update(5, UpdateUserInputSchema())
+    assert exc.value.status_code == 404
+    user_service.update.assert_not_awaited()
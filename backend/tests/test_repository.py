@@ -1,14 +1,22 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 import pytest
 
 import pytest_asyncio
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 
+from ..app.cache.entity import EntityCache, MemoryBackend
+from ..app.cache.principal import PrincipalCache
+from ..app.cache.revocation import RevocationList
+from ..app.db.migrations import Migrator
 from ..app.entries.models import BaseTable
-from ..app.entries.schemas import CreateUserSchema, UpdateUserInputSchema, UpdateNoteSchema, CreateNoteSchema
+from ..app.entries.schemas import CreateUserSchema, UpdateUserInputSchema, UpdateNoteSchema, CreateNoteSchema, \
+    UserSchema
 from ..app.repository.note import NoteRepository
+from ..app.repository.refresh_token import RefreshTokenRepository
+from ..app.repository.revoked_token import RevokedTokenRepository
 from ..app.repository.user import UserRepository
 
 DATABASE_URL = "sqlite+aiosqlite:///:memory:"
@@ -16,8 +24,7 @@ DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 @pytest_asyncio.fixture
 async def async_session():
     engine = create_async_engine(DATABASE_URL, echo=True)
-    async with engine.begin() as conn:
-        await conn.run_sync(BaseTable.metadata.create_all)
+    await Migrator(engine).upgrade()
 
     async_session_maker = sessionmaker(
         engine, expire_on_commit=False, class_=AsyncSession
@@ -205,3 +212,293 @@ async def test_get_by_username_additional(async_session: AsyncSession):
     assert find_user is None
 
 
+@pytest.mark.asyncio
+async def test_user_write_invalidates_principal_cache(async_session: AsyncSession):
+    cache = PrincipalCache(maxsize=10, ttl=60)
+    repo = UserRepository(async_session, principal_cache=cache)
+
+    created_user = await repo.create(CreateUserSchema(username="testuser", password="secret", created_at=datetime.now()))
+    payload = {"sub": "testuser"}
+    cache.set("token", UserSchema.model_validate(created_user, from_attributes=True), loaded_at=0)
+    assert cache.get("token", payload) is not None
+
+    await repo.update(created_user.id, UpdateUserInputSchema(username="renamed"))
+    assert cache.get("token", payload) is None
+
+    cache.set("token", UserSchema.model_validate(created_user, from_attributes=True))
+    await repo.delete(created_user.id)
+    assert cache.get("token", payload) is None
+
+
+@pytest.mark.asyncio
+async def test_user_rename_and_delete_revoke_tokens_for_other_processes(async_session: AsyncSession):
+    local, other = (RevocationList(capacity=10, false_positive_rate=0.01, refresh_interval=30) for _ in range(2))
+    repo = UserRepository(async_session, revocation_list=local)
+    issued = (datetime.now() + timedelta(minutes=1)).timestamp()
+
+    created_user = await repo.create(CreateUserSchema(username="testuser", password="secret", created_at=datetime.now()))
+    await repo.update(created_user.id, UpdateUserInputSchema(password="other"))
+    assert await RevokedTokenRepository(async_session).get_active_subjects(datetime.now() - timedelta(days=1), "sub:") == []
+
+    await repo.update(created_user.id, UpdateUserInputSchema(username="renamed"))
+    assert local.is_subject_revoked("testuser", issued)
+    assert not local.is_subject_revoked("renamed", issued)
+
+    # другой процесс видит отзыв после обновления списка из revoked_token
+    session_factory = async_sessionmaker(bind=async_session.bind, expire_on_commit=False)
+    await other.refresh(session_factory)
+    assert other.is_subject_revoked("testuser", issued)
+    assert not other.is_subject_revoked("testuser", issued + 3600)
+
+    await repo.delete(created_user.id)
+    await other.refresh(session_factory)
+    assert other.is_subject_revoked("renamed", issued)
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_rotate_and_revoke(async_session: AsyncSession):
+    user_repo = UserRepository(async_session)
+    token_repo = RefreshTokenRepository(async_session)
+
+    created_user = await user_repo.create(CreateUserSchema(username="testuser", password="secret", created_at=datetime.now()))
+    expires_at = datetime.now() + timedelta(days=1)
+    first = await token_repo.create(b"1" * 32, b"f" * 16, created_user.id, expires_at)
+
+    token_model, user_model = await token_repo.get_by_hash(b"1" * 32)
+    assert token_model.id == first.id
+    assert user_model.username == "testuser"
+
+    assert await token_repo.rotate(first.id, b"2" * 32, b"f" * 16, created_user.id, expires_at)
+    assert not await token_repo.rotate(first.id, b"3" * 32, b"f" * 16, created_user.id, expires_at)
+    assert await token_repo.get_by_hash(b"3" * 32) is None
+
+    second, _ = await token_repo.get_by_hash(b"2" * 32)
+    assert not second.used
+
+    await token_repo.revoke_family(b"f" * 16)
+    assert await token_repo.get_by_hash(b"1" * 32) is None
+    assert await token_repo.get_by_hash(b"2" * 32) is None
+
+
+@pytest.mark.asyncio
+async def test_get_notes_page(async_session: AsyncSession):
+    note_repo = NoteRepository(async_session)
+    user_repo = UserRepository(async_session)
+
+    first_user = await user_repo.create(CreateUserSchema(username="first", password="secret", created_at=datetime.now()))
+    second_user = await user_repo.create(CreateUserSchema(username="second", password="secret", created_at=datetime.now()))
+    created_at = datetime(2024, 1, 1)
+    for i in range(5):
+        await note_repo.create(CreateNoteSchema(title=f"title{i}", user_id=first_user.id, created_at=created_at))
+    await note_repo.create(CreateNoteSchema(title="other", user_id=second_user.id, created_at=created_at))
+
+    page = await note_repo.get_page(2, user_id=first_user.id)
+    assert [note.id for note in page] == [5, 4]
+
+    page = await note_repo.get_page(10, after=(page[-1].created_at, page[-1].id), user_id=first_user.id)
+    assert [note.id for note in page] == [3, 2, 1]
+
+    assert len(await note_repo.get_page(10)) == 6
+    without_user = await note_repo.get_page(10, user_id=first_user.id, load_user=False)
+    assert [note.user_id for note in without_user] == [first_user.id] * 5
+    assert sorted(user.username for user in await note_repo.get_users([second_user.id, first_user.id, first_user.id])) == ["first", "second"]
+    assert await note_repo.estimate_count(first_user.id) == 5
+    assert await note_repo.estimate_count() == 6
+
+
+@pytest.mark.asyncio
+async def test_stream_notes(async_session: AsyncSession):
+    note_repo = NoteRepository(async_session)
+    user_repo = UserRepository(async_session)
+
+    first_user = await user_repo.create(CreateUserSchema(username="first", password="secret", created_at=datetime.now()))
+    second_user = await user_repo.create(CreateUserSchema(username="second", password="secret", created_at=datetime.now()))
+    for i in range(5):
+        await note_repo.create(CreateNoteSchema(title=f"title{i}", user_id=first_user.id, created_at=datetime(2024, 1, i + 1)))
+    await note_repo.create(CreateNoteSchema(title="other", user_id=second_user.id, created_at=datetime(2024, 1, 1)))
+
+    batches = [batch async for batch in note_repo.stream(2, user_id=first_user.id)]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [row["id"] for batch in batches for row in batch] == [1, 2, 3, 4, 5]
+    assert batches[0][0]["username"] == "first"
+
+    batches = [batch async for batch in note_repo.stream(10, since=datetime(2024, 1, 2), until=datetime(2024, 1, 4))]
+    assert [row["title"] for batch in batches for row in batch] == ["title1", "title2"]
+
+
+@pytest.mark.asyncio
+async def test_create_many_notes(async_session: AsyncSession):
+    note_repo = NoteRepository(async_session)
+    user_repo = UserRepository(async_session)
+    user = await user_repo.create(CreateUserSchema(username="first", password="secret", created_at=datetime.now()))
+
+    ids = await note_repo.create_many([
+        CreateNoteSchema(title=f"title{i}", user_id=user.id, created_at=datetime.now()) for i in range(3)
+    ])
+
+    assert ids == [1, 2, 3]
+    assert [note.title for note in await note_repo.get_all()] == ["title0", "title1", "title2"]
+
+
+@pytest.mark.asyncio
+async def test_update_and_delete_many_notes(async_session: AsyncSession):
+    note_repo = NoteRepository(async_session)
+    user_repo = UserRepository(async_session)
+    first_user = await user_repo.create(CreateUserSchema(username="first", password="secret", created_at=datetime.now()))
+    second_user = await user_repo.create(CreateUserSchema(username="second", password="secret", created_at=datetime.now()))
+    await note_repo.create_many([
+        CreateNoteSchema(title=f"title{i}", user_id=first_user.id, created_at=datetime(2024, 1, i + 1)) for i in range(4)
+    ])
+    await note_repo.create(CreateNoteSchema(title="other", user_id=second_user.id, created_at=datetime(2024, 1, 1)))
+
+    affected = await note_repo.update_many(first_user.id, {"title": "changed"}, ids=[1, 2, 5])
+    assert sorted(affected) == [1, 2]
+    assert (await note_repo.get_by_id(5)).title == "other"
+    assert (await note_repo.get_by_id(1)).updated_at is not None
+
+    affected = await note_repo.delete_many(first_user.id, since=datetime(2024, 1, 3))
+    assert sorted(affected) == [3, 4]
+    assert [note.id for note in await note_repo.get_all()] == [1, 2, 5]
+
+
+@pytest.mark.asyncio
+async def test_search_notes(async_session: AsyncSession):
+    note_repo = NoteRepository(async_session)
+    user_repo = UserRepository(async_session)
+    first_user = await user_repo.create(CreateUserSchema(username="first", password="secret", created_at=datetime.now()))
+    second_user = await user_repo.create(CreateUserSchema(username="second", password="secret", created_at=datetime.now()))
+    await note_repo.create_many([
+        CreateNoteSchema(title="shopping list", description="milk and bread", user_id=first_user.id, created_at=datetime.now()),
+        CreateNoteSchema(title="work", description="buy milk for the office", user_id=first_user.id, created_at=datetime.now()),
+        CreateNoteSchema(title="milk", description="", user_id=second_user.id, created_at=datetime.now()),
+        CreateNoteSchema(title="ideas", description="nothing here", user_id=first_user.id, created_at=datetime.now()),
+    ])
+
+    rows = await note_repo.search(first_user.id, "milk", 10)
+    assert sorted(note.id for note, _, _ in rows) == [1, 2]
+    assert all("<mark>milk</mark>" in snippet for _, _, snippet in rows)
+    ranks = [rank for _, rank, _ in rows]
+    assert ranks == sorted(ranks, reverse=True)
+
+    first_page = await note_repo.search(first_user.id, "milk", 1)
+    note, rank, _ = first_page[0]
+    second_page = await note_repo.search(first_user.id, "milk", 1, after=(rank, note.id))
+    assert [note.id for note, _, _ in first_page + second_page] == [note.id for note, _, _ in rows]
+
+    await note_repo.update(2, UpdateNoteSchema(description="coffee"))
+    assert [note.id for note, _, _ in await note_repo.search(first_user.id, "milk bread", 10)] == [1]
+    assert await note_repo.search(first_user.id, "coffee", 10) != []
+    assert await note_repo.search(first_user.id, "\"*", 10) == []
+
+
+@pytest.mark.asyncio
+async def test_entity_cache_invalidated_by_writes(async_session: AsyncSession):
+    entity_cache = EntityCache(MemoryBackend(100, 60), ttl=60)
+    note_repo = NoteRepository(async_session, entity_cache)
+    user_repo = UserRepository(async_session, entity_cache=entity_cache)
+    user = await user_repo.create(CreateUserSchema(username="first", password="secret", created_at=datetime.now()))
+    await note_repo.create_many([
+        CreateNoteSchema(title=f"title{i}", user_id=user.id, created_at=datetime.now()) for i in range(3)
+    ])
+
+    cached = await note_repo.get_by_id(1)
+    assert cached.title == "title0"
+    assert await note_repo.get_by_id(1) is cached
+
+    await note_repo.update(1, UpdateNoteSchema(title="changed"))
+    assert (await note_repo.get_by_id(1)).title == "changed"
+
+    await note_repo.get_by_id(2)
+    await note_repo.update_many(user.id, {"title": "bulk"}, ids=[2])
+    assert (await note_repo.get_by_id(2)).title == "bulk"
+
+    assert (await user_repo.get_by_id(user.id)).username == "first"
+    await user_repo.update(user.id, UpdateUserInputSchema(username="renamed"))
+    assert (await user_repo.get_by_id(user.id)).username == "renamed"
+    assert (await note_repo.get_by_id(2)).user.username == "renamed"
+
+    await note_repo.get_by_id(3)
+    await user_repo.delete(user.id)
+    assert await user_repo.get_by_id(user.id) is None
+    assert await entity_cache.backend.get("note:3") is None
+
+
+@pytest.mark.asyncio
+async def test_note_versions_and_conditional_update(async_session: AsyncSession):
+    note_repo = NoteRepository(async_session)
+    user_repo = UserRepository(async_session)
+    user = await user_repo.create(CreateUserSchema(username="first", password="secret", created_at=datetime.now()))
+    other = await user_repo.create(CreateUserSchema(username="second", password="secret", created_at=datetime.now()))
+    created_at = datetime(2024, 1, 1)
+    await note_repo.create(CreateNoteSchema(title="title", user_id=user.id, created_at=created_at))
+
+    assert await note_repo.get_version(1) == (user.id, created_at)
+    assert await note_repo.get_version(2) is None
+    assert await note_repo.collection_version(user.id) == (1, created_at, 1)
+    assert await note_repo.collection_version(other.id) == (0, None, None)
+
+    assert await note_repo.update_owned(1, user.id, {"title": "stale"}, [datetime(2023, 1, 1)]) is None
+    assert await note_repo.update_owned(1, other.id, {"title": "foreign"}) is None
+    assert await note_repo.update_owned(1, user.id, {"title": "title"}) is None
+    updated = await note_repo.update_owned(1, user.id, {"title": "fresh"}, [created_at])
+    assert updated.title == "fresh"
+    assert updated.user_id == user.id
+
+    _, version = await note_repo.get_version(1)
+    assert version == updated.updated_at
+    assert (await note_repo.collection_version(user.id))[1] == version
+
+    assert not await note_repo.delete_owned(1, other.id)
+    assert await note_repo.delete_owned(1, user.id)
+    assert await note_repo.get_version(1) is None
+
+
+@pytest.mark.asyncio
+async def test_update_user_unique_and_unchanged(async_session: AsyncSession):
+    repo = UserRepository(async_session)
+    await repo.create(CreateUserSchema(username="first", password="secret", created_at=datetime.now()))
+    await repo.create(CreateUserSchema(username="second", password="secret", created_at=datetime.now()))
+
+    user = await repo.update(1, UpdateUserInputSchema(username="first"))
+    assert user.username == "first"
+
+    with pytest.raises(IntegrityError):
+        await repo.update(2, UpdateUserInputSchema(username="first"))
+    assert (await repo.get_by_id(2)).username == "second"
+
+
+@pytest.mark.asyncio
+async def test_user_page(async_session: AsyncSession):
+    repo = UserRepository(async_session)
+    for username in ["bob", "alice", "al_x", "alx", "carol"]:
+        await repo.create(CreateUserSchema(username=username, password="secret", created_at=datetime.now()))
+
+    first = await repo.get_page(2)
+    assert [row.username for row in first] == ["al_x", "alice"]
+    assert not hasattr(first[0], "password")
+    second = await repo.get_page(10, first[-1].username)
+    assert [row.username for row in second] == ["alx", "bob", "carol"]
+
+    assert [row.username for row in await repo.get_page(10, prefix="al")] == ["al_x", "alice", "alx"]
+    # _ в префиксе - обычный символ, а не шаблон LIKE
+    assert [row.username for row in await repo.get_page(10, prefix="al_")] == ["al_x"]
+    assert [row.username for row in await repo.get_page(10, "al_x", prefix="al")] == ["alice", "alx"]
+
+
+@pytest.mark.asyncio
+async def test_expired_refresh_tokens_are_deleted_by_revocation_refresh(async_session: AsyncSession):
+    user_repo = UserRepository(async_session)
+    token_repo = RefreshTokenRepository(async_session)
+    created_user = await user_repo.create(CreateUserSchema(username="testuser", password="secret", created_at=datetime.now()))
+    now = datetime.now(timezone.utc)
+
+    expired = await token_repo.create(b"1" * 32, b"f" * 16, created_user.id, now - timedelta(minutes=1))
+    assert await token_repo.rotate(expired.id, b"2" * 32, b"f" * 16, created_user.id, now - timedelta(seconds=1))
+    await token_repo.create(b"3" * 32, b"g" * 16, created_user.id, now + timedelta(days=1))
+
+    revocation = RevocationList(capacity=10, false_positive_rate=0.01, refresh_interval=30)
+    await revocation.refresh(async_sessionmaker(bind=async_session.bind, expire_on_commit=False))
+
+    assert await token_repo.get_by_hash(b"1" * 32) is None
+    assert await token_repo.get_by_hash(b"2" * 32) is None
+    assert await token_repo.get_by_hash(b"3" * 32) is not None
@@ -8,11 +8,14 @@ from backend.app.entries.models import UserTable
 import pytest
 from starlette.testclient import TestClient
 
-from ..app.entries.schemas import CreateUserInputSchema, UpdateUserInputSchema, UserSchema, CreateUserSchema
+from ..app.entries.schemas import CreateUserInputSchema, UpdateUserInputSchema, UserSchema, CreateUserSchema, \
+    UserPageSchema
 from ..app.main import app
 from ..app.repository.user import UserRepository
 from ..app.services.pemissions import get_user_permission
+from ..app.services.pagination import encode_cursor
 from ..app.services.user import UserService, get_user_service
+from backend.settings import settings
 
 
 @pytest.fixture
@@ -48,7 +51,7 @@ async def test_create_user_success(user_service, mock_repository):
     created_user = await user_service.create(input_data)
 
     assert created_user.username == input_data.username
-    assert user_service.verify_password("test_pass", created_user.password)
+    assert await user_service.verify_password("test_pass", created_user.password)
 
 @pytest.mark.asyncio
 async def test_create_user_already_exists(user_service, mock_repository):
@@ -105,6 +108,24 @@ async def test_get_all(user_service, mock_repository):
     result = await user_service.get_all()
     assert result == [UserSchema.model_validate(user_model, from_attributes=True) for user_model in result]
 
+@pytest.mark.asyncio
+async def test_get_page(user_service, mock_repository):
+    created_at = datetime.now()
+    mock_repository.get_page.return_value = [
+        UserTable(id=1, username="anna", created_at=created_at),
+        UserTable(id=2, username="boris", created_at=created_at),
+        UserTable(id=3, username="vera", created_at=created_at),
+    ]
+    page = await user_service.get_page(2, prefix="a")
+    assert [user.username for user in page.items] == ["anna", "boris"]
+    assert page.next_cursor == encode_cursor("boris")
+    mock_repository.get_page.assert_awaited_once_with(3, None, "a")
+
+    mock_repository.get_page.return_value = []
+    page = await user_service.get_page(2, page.next_cursor)
+    assert page.items == [] and page.next_cursor is None
+    mock_repository.get_page.assert_awaited_with(3, "boris", None)
+
 @pytest.mark.asyncio
 async def test_get_by_username_found(user_service, mock_repository):
     mock_user = UserTable(id=1, username="test_user", password="hashed", created_at=datetime.now())
@@ -138,7 +159,7 @@ async def test_get_by_username_additional_not_found(user_service, mock_repositor
 @pytest.mark.asyncio
 async def test_get_all_route(client, mock_user_service):
     app.dependency_overrides[get_user_service] = lambda: mock_user_service
-    mock_user_service.get_all.return_value = []
+    mock_user_service.get_page.return_value = UserPageSchema(items=[])
 
     response = client.get(
         "api/user",
@@ -147,6 +168,23 @@ async def test_get_all_route(client, mock_user_service):
     assert response.status_code == 200
     body = response.json()
     assert [] == body
+    mock_user_service.get_page.assert_awaited_once_with(settings.USER_PAGE_DEFAULT_LIMIT, None, None)
+    assert "X-Next-Cursor" not in response.headers
+
+@pytest.mark.asyncio
+async def test_get_page_route(client, mock_user_service):
+    app.dependency_overrides[get_user_service] = lambda: mock_user_service
+    user = UserSchema(id=1, username="anna", created_at=datetime.now())
+    mock_user_service.get_page.return_value = UserPageSchema(items=[user], next_cursor="next")
+
+    response = client.get("api/user", params={"limit": 1, "prefix": "an"})
+
+    assert response.status_code == 200
+    assert response.json()[0]["username"] == "anna"
+    assert response.headers["X-Next-Cursor"] == "next"
+    mock_user_service.get_page.assert_awaited_once_with(1, None, "an")
+
+    assert client.get("api/user", params={"limit": settings.USER_PAGE_MAX_LIMIT + 1}).status_code == 422
 
 @pytest.mark.asyncio
 async def test_get_by_id_route(client, mock_user_service):
@@ -162,6 +200,10 @@ async def test_get_by_id_route(client, mock_user_service):
     body = response.json()
     assert user == UserSchema.model_validate(body)
 
+    response = client.get("api/user/1", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.content == b""
+
 @pytest.mark.asyncio
 async def test_create_user_route(client, mock_user_service):
     app.dependency_overrides[get_user_service] = lambda: mock_user_service